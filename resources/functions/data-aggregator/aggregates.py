@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+from collections import defaultdict
+from decimal import Decimal
+from hyperloglog import HyperLogLog
+
+SUM = 'sum'
+COUNT = 'count'
+MIN = 'min'
+MAX = 'max'
+DISTINCT = 'distinct'
+OPERATIONS = {SUM, COUNT, MIN, MAX, DISTINCT}
+DEFAULT_OPERATIONS = [SUM]
+# aggregate keys not listed in the configuration fall back to this entry
+DEFAULT_OPERATIONS_KEY = '*'
+# the sketch behind a distinct count is stored next to its estimate
+SKETCH_SUFFIX = '_hll'
+
+
+def parse_operations(configuration):
+    """
+    Parse the JSON {aggregate_key: [operation, ...]} configuration of the
+    operations applied to each aggregate key.
+    """
+    operations = json.loads(configuration) if configuration else {}
+    for aggregate_key, key_operations in operations.items():
+        unknown = set(key_operations) - OPERATIONS
+        if unknown:
+            raise ValueError(f"Unknown operations {sorted(unknown)} for {aggregate_key}")
+    return operations
+
+
+def attribute_name(aggregate_key, operation):
+    """Return the item attribute holding operation applied to aggregate_key."""
+    # sums keep the plain aggregate key for compatibility with existing items
+    return aggregate_key if operation == SUM else f"{aggregate_key}_{operation}"
+
+
+class Aggregates:
+    """
+    The aggregated values of one checkpoint, per item key. An item key is
+    the (primary key, usage window) pair of the item the values are added
+    to; the window is None when usage is not windowed.
+
+    Sums and counts are kept as counters that are added to the stored item.
+    Minimums, maximums and distinct-count sketches are merged with the
+    stored values instead, which is idempotent.
+    """
+
+    def __init__(self, operations):
+        self.operations = operations
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.minimums = defaultdict(dict)
+        self.maximums = defaultdict(dict)
+        self.sketches = defaultdict(dict)
+        self.line_counts = defaultdict(int)
+
+    def operations_for(self, aggregate_key):
+        return self.operations.get(
+            aggregate_key, self.operations.get(DEFAULT_OPERATIONS_KEY, DEFAULT_OPERATIONS)
+        )
+
+    def item_keys(self):
+        return self.line_counts.keys()
+
+    def add(self, item_key, aggregate_key, aggregate_value):
+        """Apply every operation configured for aggregate_key to one value."""
+        self.line_counts[item_key] += 1
+        for operation in self.operations_for(aggregate_key):
+            attribute = attribute_name(aggregate_key, operation)
+            if operation == SUM:
+                self.counters[item_key][attribute] += int(aggregate_value)
+            elif operation == COUNT:
+                self.counters[item_key][attribute] += 1
+            elif operation == DISTINCT:
+                self.sketch(item_key, attribute).add(aggregate_value)
+            else:
+                self.merge_extreme(item_key, attribute, operation, Decimal(str(aggregate_value)))
+
+    def merge_extreme(self, item_key, attribute, operation, value):
+        extremes = self.minimums if operation == MIN else self.maximums
+        current = extremes[item_key].get(attribute)
+        if current is None or (value < current if operation == MIN else value > current):
+            extremes[item_key][attribute] = value
+
+    def sketch(self, item_key, attribute):
+        return self.sketches[item_key].setdefault(attribute, HyperLogLog())
@@ -1,21 +1,77 @@
 from aws_lambda_powertools.utilities.data_classes import event_source, S3Event
 from urllib.parse import unquote_plus
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from zlib import crc32
 import boto3  # relying on lambda runtime to provide boto3 https://docs.aws.amazon.com/lambda/latest/dg/lambda-runtimes.html
 import os
+import logging
+import random
+import time
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools import Tracer
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
 import json
 import jmespath
+from botocore.config import Config
+from aggregates import Aggregates, parse_operations, MIN, MAX, SKETCH_SUFFIX
+from hyperloglog import HyperLogLog
+from object_reader import read_lines
+from parquet_reader import ParquetAggregator, S3RangeFile
+from processing_ledger import ProcessingLedger, COMPLETE
+from usage_window import window_expiry, window_format, window_or_none, EXPIRES_AT_COLUMN, WINDOW_COLUMN
+from write_pacer import WritePacer
 
 tracer = Tracer()
 logger = Logger(service=os.environ['SERVICE_NAME'])
-dynamodb = boto3.resource("dynamodb")
-s3_client = boto3.client('s3')
+max_workers = int(os.environ.get('MAX_WORKERS', '4'))
+# clients are shared by all worker threads, so size their connection
+# pools to match the number of workers that can use them at once
+client_config = Config(max_pool_connections=max(max_workers, 10))
+dynamodb = boto3.resource("dynamodb", config=client_config)
+# the resource's client takes plain python values in transactions as well.
+# Throttled writes are retried by the write pacer, which also slows down,
+# so the SDK's own retries are turned off for this client. Every request to
+# the data table goes through it and the pacer.
+write_client = boto3.resource(
+    "dynamodb", config=client_config.merge(Config(retries={'total_max_attempts': 1}))
+).meta.client
+s3_client = boto3.client('s3', config=client_config)
 data_table = dynamodb.Table(os.environ['DATA_TABLE'])
+# write capacity units per second this function may use, 0 means unpaced
+pacer = WritePacer(data_table.name, int(os.environ.get('WRITE_CAPACITY_BUDGET', '0')))
+ledger = ProcessingLedger(dynamodb.meta.client, os.environ['LEDGER_TABLE'])
 primary_key_column = os.environ['PRIMARY_KEY_COLUMN']
 primary_key_path = os.environ['PRIMARY_KEY_PATH']
 aggregate_key_path = os.environ['AGGREGATE_KEY_PATH']
 aggregate_value_path = os.environ['AGGREGATE_VALUE_PATH']
+# when set, usage is aggregated per time window of the record's timestamp
+# into items keyed by the primary key and the window (WINDOW_COLUMN)
+timestamp_path = os.environ.get('TIMESTAMP_PATH')
+usage_window = os.environ.get('USAGE_WINDOW', 'DAILY') if timestamp_path else None
+if usage_window:
+    window_format(usage_window)
+# windowed items are kept for this many hours after their window starts,
+# which must be longer than billing looks back for late records
+usage_retention_hours = int(os.environ.get('USAGE_RETENTION_HOURS', '720'))
+# {aggregate_key: [operation, ...]}, every aggregate key is summed by default
+operations = parse_operations(os.environ.get('AGGREGATE_OPERATIONS'))
+# fraction of the records that are logged when the log level is DEBUG
+record_log_sample_rate = float(os.environ.get('RECORD_LOG_SAMPLE_RATE', '0.01'))
+# number of lines applied between two ledger checkpoints
+checkpoint_lines = int(os.environ.get('CHECKPOINT_LINES', '10000'))
+# primary keys with at least shard_threshold lines in a checkpoint are
+# spread over shard_count items (primaryKey#n) to avoid a hot partition
+shard_count = int(os.environ.get('SHARD_COUNT', '0'))
+shard_threshold = int(os.environ.get('SHARD_THRESHOLD', '1000'))
+# shard items point back at the primary key they hold usage for
+SHARD_OF_COLUMN = 'sbtaws_shard_of'
+
+# objects written by Firehose record format conversion to Parquet
+PARQUET_SUFFIX = '.parquet'
+# a transaction holds at most 100 items, one of which is the ledger update
+MAX_TRANSACTION_KEYS = 99
 
 
 @event_source(data_class=S3Event)
@@ -24,38 +80,349 @@ def handler(event: S3Event, context):
     logger.info(event)
 
     # Multiple records can be delivered in a single event
-    for record in event.records:
-        object_key = unquote_plus(record.s3.get_object.key)
-        obj = s3_client.get_object(Bucket=event.bucket_name, Key=object_key)
-        lines = obj['Body'].read().decode('utf-8').splitlines()
-
-        for line in lines:
-            logger.info(line)
-            data = json.loads(line)
-            logger.info(data)
-
-            primary_key = jmespath.search(primary_key_path, data)
-            aggregate_key = jmespath.search(aggregate_key_path, data)
-            aggregate_value = jmespath.search(aggregate_value_path, data)
-
-            logger.info(f"primary_key: {primary_key}")
-            logger.info(f"aggregate_key: {aggregate_key}")
-            logger.info(f"aggregate_value: {aggregate_value}")
-            if primary_key is None or aggregate_key is None or aggregate_value is None:
-                logger.info(f"Skipping line {line}. Required data not found.")
+    objects = [
+        (unquote_plus(record.s3.get_object.key), record.s3.get_object)
+        for record in event.records
+    ]
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(objects)))) as executor:
+        futures = [
+            executor.submit(_process_object, bucket_name, object_key, s3_object)
+            for object_key, s3_object in objects
+        ]
+
+        # results are collected in record order so that errors are
+        # reported in the order the objects were delivered
+        for (object_key, _), future in zip(objects, futures):
+            try:
+                future.result()
+            except Exception as error:
+                logger.exception(f"Error processing {bucket_name}/{object_key}")
+                errors.append(f"{object_key}: {error}")
+
+    logger.info("Write pacing", extra=pacer.collect_stats())
+
+    # objects that were committed are recorded in the ledger, so the retry
+    # triggered by this error only redoes the work that is missing
+    if errors:
+        raise RuntimeError(
+            f"Failed to process {len(errors)} of {len(objects)} objects "
+            f"in {bucket_name}: {'; '.join(errors)}"
+        )
+
+
+def _process_object(bucket_name, object_key, s3_object):
+    # unversioned buckets have no version id, but the sequencer identifies
+    # the PUT that triggered this notification just as well
+    object_id = ledger.object_id(
+        bucket_name, object_key, s3_object.version_id or s3_object.sequencer
+    )
+    checkpoint = ledger.begin(object_id)
+    if checkpoint['status'] == COMPLETE:
+        logger.info(f"Skipping {object_id}. Already processed.")
+        return
+
+    line_offset = int(checkpoint['lineOffset'])
+    groups_committed = int(checkpoint['groupsCommitted'])
+    pending_offset = checkpoint.get('pendingOffset')
+
+    summary = Counter()
+    primary_keys = set()
+    started = time.monotonic()
+    try:
+        # lines (or rows) before the last checkpoint have already been applied
+        aggregate_next = _open_object(bucket_name, object_key, s3_object.version_id, line_offset)
+        if line_offset:
+            logger.info(f"Resuming {object_id} from line {line_offset}")
+
+        while True:
+            # a partially committed checkpoint must be rebuilt from the same lines
+            end_offset = int(pending_offset) if pending_offset is not None else line_offset + checkpoint_lines
+            aggregates, lines_read = aggregate_next(end_offset - line_offset)
+            done = line_offset + lines_read < end_offset
+            end_offset = line_offset + lines_read
+
+            summary['LinesRead'] += lines_read
+            summary['LinesSkipped'] += lines_read - sum(aggregates.line_counts.values())
+            primary_keys.update(primary_key for primary_key, _ in aggregates.item_keys())
+
+            if not _commit(object_id, line_offset, end_offset, aggregates, groups_committed, done, summary):
+                logger.warning(f"{object_id} was checkpointed by another invocation. Stopping.")
+                return
+            if done:
+                break
+
+            line_offset = end_offset
+            groups_committed = 0
+            pending_offset = None
+    finally:
+        summary['PrimaryKeysTouched'] = len(primary_keys)
+        _publish_summary(bucket_name, object_key, s3_object.size, summary, time.monotonic() - started)
+
+
+def _publish_summary(bucket_name, object_key, object_size, summary, elapsed):
+    # One line per object instead of one per record: the counters are
+    # published as Embedded Metric Format metrics, the object as metadata.
+    metrics = EphemeralMetrics(namespace=os.environ['SERVICE_NAME'], service=os.environ['SERVICE_NAME'])
+    for name in ('LinesRead', 'LinesSkipped', 'PrimaryKeysTouched', 'WritesIssued'):
+        metrics.add_metric(name=name, unit=MetricUnit.Count, value=summary[name])
+    metrics.add_metric(name='ObjectBytes', unit=MetricUnit.Bytes, value=object_size or 0)
+    metrics.add_metric(name='ElapsedTime', unit=MetricUnit.Milliseconds, value=round(elapsed * 1000))
+    metrics.add_metadata(key='bucket', value=bucket_name)
+    metrics.add_metadata(key='objectKey', value=object_key)
+    metrics.flush_metrics()
+
+
+def _open_object(bucket_name, object_key, version_id, line_offset):
+    """
+    Return a function that aggregates the next n lines (or rows) of the
+    object, starting at line_offset.
+    """
+    if object_key.endswith(PARQUET_SUFFIX):
+        parquet_aggregator = ParquetAggregator(
+            S3RangeFile(s3_client, bucket_name, object_key, version_id),
+            primary_key_path,
+            aggregate_key_path,
+            aggregate_value_path,
+            operations,
+            timestamp_path=timestamp_path,
+            usage_window=usage_window,
+            row_offset=line_offset,
+        )
+        return parquet_aggregator.aggregate
+
+    get_object_kwargs = {'Bucket': bucket_name, 'Key': object_key}
+    if version_id:
+        get_object_kwargs['VersionId'] = version_id
+    obj = s3_client.get_object(**get_object_kwargs)
+
+    lines = islice(read_lines(obj, object_key), line_offset, None)
+    return lambda limit: _aggregate_lines(islice(lines, limit))
+
+
+def _aggregate_lines(lines):
+    # Folding the lines of a checkpoint in memory first means each
+    # primary key is written once per checkpoint instead of once per line.
+    aggregates = Aggregates(operations)
+    lines_read = 0
+    # only a sample of the records is logged, and only when debugging
+    log_records = logger.isEnabledFor(logging.DEBUG)
+
+    for line in lines:
+        lines_read += 1
+        data = json.loads(line)
+
+        primary_key = jmespath.search(primary_key_path, data)
+        aggregate_key = jmespath.search(aggregate_key_path, data)
+        aggregate_value = jmespath.search(aggregate_value_path, data)
+
+        if log_records and random.random() < record_log_sample_rate:
+            logger.debug(
+                "Sampled record",
+                extra={
+                    'record': data,
+                    'primary_key': primary_key,
+                    'aggregate_key': aggregate_key,
+                    'aggregate_value': aggregate_value,
+                },
+            )
+        if primary_key is None or aggregate_key is None or aggregate_value is None:
+            continue
+
+        window = None
+        if usage_window:
+            # records without a usable timestamp are skipped, like those
+            # without a key or value
+            window = window_or_none(jmespath.search(timestamp_path, data), usage_window)
+            if window is None:
                 continue
 
-            # perform the following as an atomic operation
-            # i.e., read and update in one-go
-            # if we break it up into 2 operations, it's possible
-            # that after we read, another process updates the aggregate_value
-            # so then adding to the value that we just read would result
-            # in the wrong sum.
-            response = data_table.update_item(
-                Key={primary_key_column: primary_key},
-                UpdateExpression=f"SET {aggregate_key} = if_not_exists({aggregate_key}, :default_val) + :val",
-                ExpressionAttributeValues={':val': int(aggregate_value), ':default_val': 0}
+        aggregates.add((primary_key, window), str(aggregate_key), aggregate_value)
+
+    return aggregates, lines_read
+
+
+def _commit(object_id, line_offset, end_offset, aggregates, groups_committed, done, summary):
+    # The counters and the ledger checkpoint are written in one transaction,
+    # so either both move forward or neither does. Primary keys are sorted
+    # so that a retry splits a checkpoint into exactly the same groups.
+    item_keys = sorted(aggregates.item_keys(), key=str)
+    groups = [
+        item_keys[start:start + MAX_TRANSACTION_KEYS]
+        for start in range(0, len(item_keys), MAX_TRANSACTION_KEYS)
+    ] or [[]]
+
+    # every checkpoint of every object picks its own shard, which spreads
+    # concurrent writers over the shards while a retry picks the same one
+    shard = crc32(f"{object_id}:{line_offset}".encode()) % shard_count if shard_count else None
+
+    for group in range(groups_committed, len(groups)):
+        # minimums, maximums and sketches are merged first: merging them
+        # again when a retry rebuilds this group does not change them
+        for item_key in groups[group]:
+            summary['WritesIssued'] += _merge_extremes(item_key, aggregates)
+            summary['WritesIssued'] += _merge_sketches(item_key, aggregates.sketches[item_key])
+
+        transact_items = [
+            _add_aggregates(
+                item_key,
+                aggregates.counters[item_key],
+                shard if aggregates.line_counts[item_key] >= shard_threshold else None,
             )
-            logger.info(f"update response: {response}")
+            for item_key in groups[group]
+            if aggregates.counters[item_key]
+        ]
+        transact_items.append(
+            ledger.advance(object_id, line_offset, end_offset, group, len(groups), done)
+        )
+
+        summary['WritesIssued'] += 1
+        try:
+            # transactional writes cost two write capacity units per item
+            response = pacer.write(
+                write_client.transact_write_items,
+                2 * (len(transact_items) - 1),
+                TransactItems=transact_items,
+            )
+        except write_client.exceptions.TransactionCanceledException as error:
+            reasons = error.response.get('CancellationReasons', [])
+            if reasons and reasons[-1].get('Code') == 'ConditionalCheckFailed':
+                return False
+            raise
+        logger.debug(f"transaction response for {object_id}: {response}")
+
+    return True
+
+
+def _item_key(item_key, shard=None):
+    primary_key, window = item_key
+    key = {primary_key_column: primary_key if shard is None else f"{primary_key}#{shard}"}
+    if window is not None:
+        key[WINDOW_COLUMN] = window
+    return key
+
+
+def _expires_at(item_key):
+    # every item of a window expires at the same time, so writing it again
+    # does not move it
+    window = item_key[1]
+    return window_expiry(window, usage_window, usage_retention_hours) if window is not None else None
 
-        logger.info(f"{bucket_name}/{object_key}")
+
+def _expiry(item_key):
+    """Return the SET clause, names and values that give a windowed item its expiry."""
+    expires_at = _expires_at(item_key)
+    if expires_at is None:
+        return "", {}, {}
+    return ", #expiresAt = :expiresAt", {"#expiresAt": EXPIRES_AT_COLUMN}, {":expiresAt": expires_at}
+
+
+def _add_aggregates(item_key, values, shard=None):
+    # perform the following as an atomic operation
+    # i.e., read and update in one-go
+    # if we break it up into 2 operations, it's possible
+    # that after we read, another process updates the aggregate_value
+    # so then adding to the value that we just read would result
+    # in the wrong sum. ADD creates missing counters starting at zero,
+    # so all of the keys for a primary key can go in a single update.
+    expression_attribute_names = {}
+    expression_attribute_values = {}
+    add_clauses = []
+    for index, (aggregate_key, value) in enumerate(values.items()):
+        expression_attribute_names[f"#k{index}"] = aggregate_key
+        expression_attribute_values[f":v{index}"] = value
+        add_clauses.append(f"#k{index} :v{index}")
+
+    set_clauses = []
+    if shard is not None:
+        set_clauses.append("#shardOf = :shardOf")
+        expression_attribute_names["#shardOf"] = SHARD_OF_COLUMN
+        expression_attribute_values[":shardOf"] = item_key[0]
+    expires_at = _expires_at(item_key)
+    if expires_at is not None:
+        set_clauses.append("#expiresAt = :expiresAt")
+        expression_attribute_names["#expiresAt"] = EXPIRES_AT_COLUMN
+        expression_attribute_values[":expiresAt"] = expires_at
+
+    update_expression = "ADD " + ", ".join(add_clauses)
+    if set_clauses:
+        update_expression = f"SET {', '.join(set_clauses)} {update_expression}"
+
+    return {
+        'Update': {
+            'TableName': data_table.name,
+            'Key': _item_key(item_key, shard),
+            'UpdateExpression': update_expression,
+            'ExpressionAttributeNames': expression_attribute_names,
+            'ExpressionAttributeValues': expression_attribute_values,
+        }
+    }
+
+
+def _merge_extremes(item_key, aggregates):
+    # items with only minimums or maximums are not written by the
+    # transaction, so these writes set the expiry as well
+    expiry_clause, expiry_names, expiry_values = _expiry(item_key)
+    writes = 0
+    for operation, extremes in ((MIN, aggregates.minimums), (MAX, aggregates.maximums)):
+        for attribute, value in extremes[item_key].items():
+            writes += 1
+            try:
+                # only replace the stored value when this one goes further
+                pacer.write(
+                    write_client.update_item,
+                    1,
+                    TableName=data_table.name,
+                    Key=_item_key(item_key),
+                    UpdateExpression=f"SET #a = :v{expiry_clause}",
+                    ConditionExpression=f"attribute_not_exists(#a) OR #a {'>' if operation == MIN else '<'} :v",
+                    ExpressionAttributeNames={"#a": attribute, **expiry_names},
+                    ExpressionAttributeValues={":v": value, **expiry_values},
+                )
+            except write_client.exceptions.ConditionalCheckFailedException:
+                pass
+    return writes
+
+
+def _merge_sketches(item_key, sketches):
+    expiry_clause, expiry_names, expiry_values = _expiry(item_key)
+    writes = 0
+    for attribute, sketch in sketches.items():
+        sketch_attribute = f"{attribute}{SKETCH_SUFFIX}"
+        while True:
+            item = pacer.read(
+                write_client.get_item,
+                TableName=data_table.name,
+                Key=_item_key(item_key),
+                ProjectionExpression="#s",
+                ExpressionAttributeNames={"#s": sketch_attribute},
+                ConsistentRead=True,
+            ).get("Item", {})
+            stored = item.get(sketch_attribute)
+            merged = sketch.merge(HyperLogLog.from_bytes(stored.value)) if stored else sketch
+            if stored and merged.to_bytes() == stored.value:
+                break
+
+            # the sketch is replaced only if nobody else changed it since it
+            # was read; otherwise it is read and merged again
+            condition = "#s = :stored" if stored else "attribute_not_exists(#s)"
+            expression_attribute_values = {":s": merged.to_bytes(), ":e": merged.estimate(), **expiry_values}
+            if stored:
+                expression_attribute_values[":stored"] = stored
+            writes += 1
+            try:
+                pacer.write(
+                    write_client.update_item,
+                    len(merged.to_bytes()) // 1024 + 1,
+                    TableName=data_table.name,
+                    Key=_item_key(item_key),
+                    UpdateExpression=f"SET #s = :s, #e = :e{expiry_clause}",
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames={"#s": sketch_attribute, "#e": attribute, **expiry_names},
+                    ExpressionAttributeValues=expression_attribute_values,
+                )
+                break
+            except write_client.exceptions.ConditionalCheckFailedException:
+                continue
+    return writes
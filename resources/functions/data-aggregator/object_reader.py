@@ -0,0 +1,118 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import codecs
+import tempfile
+import zipfile
+import zlib
+
+try:
+    # bundled with the function from requirements.txt, and only needed for
+    # Snappy-compressed Firehose output
+    import snappy
+except ImportError:
+    snappy = None
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# compression suffixes used by Firehose when writing objects to s3
+_SUFFIX_COMPRESSION = {
+    '.gz': 'gzip',
+    '.snappy': 'snappy',
+    '.zip': 'zip',
+}
+
+
+def detect_compression(content_encoding, object_key):
+    """Return the compression of an object based on its Content-Encoding or suffix."""
+    if content_encoding:
+        encoding = content_encoding.lower()
+        if encoding in ('gzip', 'x-gzip'):
+            return 'gzip'
+        if encoding in ('snappy', 'zip'):
+            return encoding
+
+    for suffix, compression in _SUFFIX_COMPRESSION.items():
+        if object_key.endswith(suffix):
+            return compression
+
+    return None
+
+
+def read_lines(obj, object_key, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the lines of an s3 get_object response one at a time.
+
+    The body is streamed chunk by chunk and decompressed incrementally, so
+    neither the raw object nor its decoded contents are held in memory.
+    Empty lines are skipped.
+    """
+    compression = detect_compression(obj.get('ContentEncoding'), object_key)
+    chunks = obj['Body'].iter_chunks(chunk_size)
+
+    if compression == 'gzip':
+        chunks = _gunzip(chunks)
+    elif compression == 'snappy':
+        chunks = _unsnappy(chunks)
+    elif compression == 'zip':
+        chunks = _unzip(chunks, chunk_size)
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            line = line.rstrip('\r')
+            if line:
+                yield line
+
+    pending = (pending + decoder.decode(b'', final=True)).rstrip('\r')
+    if pending:
+        yield pending
+
+
+def _gunzip(chunks):
+    # MAX_WBITS | 32 lets zlib detect the gzip/zlib header on its own
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            if not decompressor.eof:
+                break
+            # concatenated gzip members, start over with the remaining bytes
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+
+    yield decompressor.flush()
+
+
+def _unsnappy(chunks):
+    if snappy is None:
+        raise RuntimeError(
+            "python-snappy is required to read Snappy-compressed objects")
+
+    decompressor = snappy.StreamDecompressor()
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+
+    decompressor.flush()
+
+
+def _unzip(chunks, chunk_size):
+    # zip archives keep their index at the end of the file, so the body is
+    # spooled (to /tmp once it outgrows chunk_size) rather than kept in memory
+    with tempfile.SpooledTemporaryFile(max_size=chunk_size) as spool:
+        for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+
+        with zipfile.ZipFile(spool) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                with archive.open(member) as member_file:
+                    while chunk := member_file.read(chunk_size):
+                        yield chunk
+                # keep the last line of a member from running into the next
+                yield b'\n'
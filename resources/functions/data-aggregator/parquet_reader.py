@@ -0,0 +1,228 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import io
+from decimal import Decimal
+import jmespath
+from aggregates import Aggregates, attribute_name, SUM, COUNT, MIN, MAX, DISTINCT
+from usage_window import window_format, window_or_none, MILLISECONDS_THRESHOLD
+
+try:
+    # optional, provided by a layer such as the AWS SDK for pandas layer
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+def column_path(expression):
+    """
+    Return the Parquet column path (e.g. ['metric', 'name']) equivalent to a
+    JMESPath expression. Only plain field and sub-expressions have one.
+    """
+    def walk(node):
+        if node['type'] == 'field':
+            return [node['value']]
+        if node['type'] == 'subexpression':
+            return [part for child in node['children'] for part in walk(child)]
+        raise ValueError(
+            f"JMESPath expression {expression} cannot be mapped to a Parquet column")
+
+    return walk(jmespath.compile(expression).parsed)
+
+
+class S3RangeFile(io.RawIOBase):
+    """
+    Read-only, seekable view of an s3 object that fetches the ranges it is
+    asked for, so Parquet readers only download the footer and the column
+    chunks they need.
+    """
+
+    def __init__(self, s3_client, bucket_name, object_key, version_id=None):
+        self.s3_client = s3_client
+        self.object_kwargs = {'Bucket': bucket_name, 'Key': object_key}
+        if version_id:
+            self.object_kwargs['VersionId'] = version_id
+        self.size = s3_client.head_object(**self.object_kwargs)['ContentLength']
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if self.position >= end:
+            return 0
+
+        body = self.s3_client.get_object(
+            Range=f"bytes={self.position}-{end - 1}", **self.object_kwargs
+        )['Body'].read()
+        buffer[:len(body)] = body
+        self.position += len(body)
+        return len(body)
+
+
+class ParquetAggregator:
+    """
+    Aggregates the rows of a Parquet object in checkpoint sized slices.
+
+    Only the primary key, aggregate key and aggregate value (and timestamp)
+    columns are read, and each slice is aggregated with vectorised group-bys
+    instead of row by row.
+    """
+
+    def __init__(self, source, primary_key_path, aggregate_key_path, aggregate_value_path,
+                 operations, timestamp_path=None, usage_window=None, row_offset=0,
+                 batch_size=65536):
+        if pa is None:
+            raise RuntimeError("pyarrow is required to read Parquet objects")
+
+        self.paths = [
+            column_path(primary_key_path),
+            column_path(aggregate_key_path),
+            column_path(aggregate_value_path),
+        ]
+        if timestamp_path:
+            self.paths.append(column_path(timestamp_path))
+        self.usage_window = usage_window
+        self.operations = operations
+        parquet_file = pq.ParquetFile(io.BufferedReader(source, READ_BUFFER_SIZE))
+        self.batches = parquet_file.iter_batches(
+            batch_size=batch_size,
+            columns=sorted({'.'.join(path) for path in self.paths}),
+        )
+        self.pending = None
+        # rows before the last checkpoint have already been applied
+        self._take(row_offset)
+
+    def aggregate(self, rows):
+        """Aggregate the next rows rows, returning (Aggregates, rows read)."""
+        aggregates = Aggregates(self.operations)
+        table = self._take(rows)
+        if table is None:
+            return aggregates, 0
+
+        columns = [self._column(table, path) for path in self.paths]
+        rows_read = table.num_rows
+        table = pa.table({
+            'primary_key': columns[0],
+            'aggregate_key': pc.cast(columns[1], pa.string()),
+            'aggregate_value': columns[2],
+            'window': self._windows(columns[3]) if len(columns) > 3 else pa.nulls(rows_read, pa.string()),
+        })
+        # rows missing any of the values are skipped, as with NDJSON
+        valid = pc.and_(
+            pc.and_(pc.is_valid(table['primary_key']), pc.is_valid(table['aggregate_key'])),
+            pc.is_valid(table['aggregate_value']),
+        )
+        if self.usage_window:
+            valid = pc.and_(valid, pc.is_valid(table['window']))
+        table = table.filter(valid)
+
+        # aggregates are kept per item, i.e. per (primary key, window)
+        counts = table.group_by(['primary_key', 'window']).aggregate(
+            [('primary_key', 'count')]
+        ).to_pydict()
+        aggregates.line_counts.update(
+            zip(zip(counts['primary_key'], counts['window']), counts['primary_key_count'])
+        )
+
+        by_operation = {}
+        for aggregate_key in pc.unique(table['aggregate_key']).to_pylist():
+            for operation in aggregates.operations_for(aggregate_key):
+                by_operation.setdefault(operation, []).append(aggregate_key)
+
+        for operation, aggregate_keys in by_operation.items():
+            rows = table.filter(pc.is_in(table['aggregate_key'], pa.array(aggregate_keys)))
+            values = rows['aggregate_value']
+            if operation == SUM and not pa.types.is_integer(values.type):
+                # int() truncates towards zero, so do the same here
+                values = pc.cast(pc.trunc(pc.cast(values, pa.float64())), pa.int64())
+            elif operation in (MIN, MAX):
+                values = pc.cast(values, pa.float64())
+            elif operation == DISTINCT:
+                values = pc.cast(values, pa.string())
+            rows = rows.set_column(2, 'aggregate_value', values)
+
+            function = {SUM: 'sum', COUNT: 'count', MIN: 'min', MAX: 'max', DISTINCT: 'distinct'}[operation]
+            grouped = rows.group_by(['primary_key', 'window', 'aggregate_key']).aggregate(
+                [('aggregate_value', function)]
+            ).to_pydict()
+            for primary_key, window, aggregate_key, value in zip(
+                grouped['primary_key'], grouped['window'], grouped['aggregate_key'],
+                grouped[f"aggregate_value_{function}"],
+            ):
+                item_key = (primary_key, window)
+                attribute = attribute_name(aggregate_key, operation)
+                if operation in (SUM, COUNT):
+                    aggregates.counters[item_key][attribute] += value
+                elif operation == DISTINCT:
+                    sketch = aggregates.sketch(item_key, attribute)
+                    for distinct_value in value:
+                        sketch.add(distinct_value)
+                else:
+                    aggregates.merge_extreme(item_key, attribute, operation, Decimal(str(value)))
+
+        return aggregates, rows_read
+
+    def _take(self, rows):
+        slices = []
+        while rows > 0:
+            if self.pending is None:
+                self.pending = next(self.batches, None)
+                if self.pending is None:
+                    break
+            batch = self.pending.slice(0, rows)
+            rest = self.pending.slice(batch.num_rows)
+            self.pending = rest if rest.num_rows else None
+            slices.append(batch)
+            rows -= batch.num_rows
+
+        return pa.Table.from_batches(slices) if slices else None
+
+    def _windows(self, timestamps):
+        """Return the name of the usage window of each timestamp."""
+        if pa.types.is_timestamp(timestamps.type):
+            times = timestamps
+        elif pa.types.is_integer(timestamps.type) or pa.types.is_floating(timestamps.type):
+            seconds = pc.cast(timestamps, pa.float64())
+            seconds = pc.if_else(
+                pc.greater(seconds, MILLISECONDS_THRESHOLD), pc.divide(seconds, 1000), seconds
+            )
+            times = pc.cast(pc.cast(pc.floor(seconds), pa.int64()), pa.timestamp('s'))
+        else:
+            # ISO 8601 strings may carry any offset, so they are parsed one by
+            # one; rows whose timestamp cannot be parsed get no window and are
+            # skipped, like such records in NDJSON objects
+            return pa.array(
+                [window_or_none(timestamp, self.usage_window) for timestamp in timestamps.to_pylist()],
+                pa.string(),
+            )
+
+        if times.type.tz is not None:
+            times = pc.cast(times, pa.timestamp(times.type.unit, 'UTC'))
+        return pc.strftime(times, format=window_format(self.usage_window))
+
+    @staticmethod
+    def _column(table, path):
+        column = table.column(path[0]).combine_chunks()
+        for field in path[1:]:
+            column = pc.struct_field(column, field)
+        return column
@@ -0,0 +1,98 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+from boto3.dynamodb.conditions import Attr
+
+OBJECT_ID_COLUMN = 'objectId'
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETE = 'COMPLETE'
+
+# ledger entries only need to outlive the s3 notification retries
+LEDGER_TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+class ProcessingLedger:
+    """
+    Records how far each s3 object has been applied to the aggregation table.
+
+    Every object has one ledger item holding the number of lines that have
+    been committed (lineOffset). A checkpoint covering more tenants than fit
+    in a single transaction is committed in groups; while that happens the
+    item also holds the end of the checkpoint (pendingOffset) and the number
+    of groups already committed (groupsCommitted), so that a retry rebuilds
+    exactly the same groups and skips the ones that were applied.
+
+    The ledger is shared by the worker threads, so it uses a client, which
+    unlike a Table resource is safe to share between threads. It takes the
+    client of a DynamoDB resource, which takes plain python values.
+    """
+
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+
+    @staticmethod
+    def object_id(bucket_name, object_key, version):
+        return f"{bucket_name}/{object_key}#{version}"
+
+    def begin(self, object_id):
+        """Return the ledger item for object_id, creating it on the first attempt."""
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    OBJECT_ID_COLUMN: object_id,
+                    'lineOffset': 0,
+                    'groupsCommitted': 0,
+                    'status': IN_PROGRESS,
+                    'expiresAt': int(time.time()) + LEDGER_TTL_SECONDS,
+                },
+                ConditionExpression=Attr(OBJECT_ID_COLUMN).not_exists(),
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+        return self.client.get_item(
+            TableName=self.table_name, Key={OBJECT_ID_COLUMN: object_id}, ConsistentRead=True
+        )['Item']
+
+    def advance(self, object_id, line_offset, end_offset, group, groups, done):
+        """
+        Return the TransactWriteItems entry that records group (of groups)
+        of the checkpoint between line_offset and end_offset as committed.
+
+        The entry is conditional on the ledger still being where this
+        invocation found it, so a concurrent or stale invocation cannot
+        apply the same lines twice.
+        """
+        expression_attribute_values = {
+            ':offset': line_offset,
+            ':group': group,
+            ':end': end_offset,
+        }
+        expression_attribute_names = {}
+
+        if group + 1 < groups:
+            update_expression = 'SET pendingOffset = :end, groupsCommitted = :next'
+            expression_attribute_values[':next'] = group + 1
+        else:
+            update_expression = (
+                'SET lineOffset = :end, groupsCommitted = :zero, #status = :status '
+                'REMOVE pendingOffset'
+            )
+            expression_attribute_names['#status'] = 'status'
+            expression_attribute_values[':zero'] = 0
+            expression_attribute_values[':status'] = COMPLETE if done else IN_PROGRESS
+
+        update = {
+            'TableName': self.table_name,
+            'Key': {OBJECT_ID_COLUMN: object_id},
+            'UpdateExpression': update_expression,
+            'ConditionExpression': 'lineOffset = :offset AND groupsCommitted = :group',
+            'ExpressionAttributeValues': expression_attribute_values,
+        }
+        if expression_attribute_names:
+            update['ExpressionAttributeNames'] = expression_attribute_names
+
+        return {'Update': update}
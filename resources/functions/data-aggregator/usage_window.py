@@ -0,0 +1,65 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timedelta, timezone
+
+# the sort key of windowed items, and the index that lists a window's items
+WINDOW_COLUMN = 'usageWindow'
+WINDOW_INDEX = 'UsageWindowIndex'
+# windowed items are deleted by the table's time to live once the epoch
+# seconds in this attribute have passed
+EXPIRES_AT_COLUMN = 'sbtaws_expires_at'
+
+# windows are named by the UTC time they start at, so they sort in time order
+WINDOW_FORMATS = {
+    'HOURLY': '%Y-%m-%dT%H',
+    'DAILY': '%Y-%m-%d',
+}
+
+# numeric timestamps above this are taken to be in milliseconds
+# (as seconds it would be more than 3000 years from now)
+MILLISECONDS_THRESHOLD = 100_000_000_000
+
+
+def window_format(usage_window):
+    try:
+        return WINDOW_FORMATS[usage_window]
+    except KeyError:
+        raise ValueError(
+            f"Unknown usage window {usage_window}, expected one of {sorted(WINDOW_FORMATS)}")
+
+
+def parse_timestamp(value):
+    """
+    Return the UTC datetime of a record's timestamp: epoch seconds or
+    milliseconds, or an ISO 8601 string (UTC unless it has an offset).
+    """
+    if isinstance(value, str):
+        timestamp = datetime.fromisoformat(value)
+        if timestamp.tzinfo is None:
+            return timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.astimezone(timezone.utc)
+
+    seconds = float(value)
+    if seconds > MILLISECONDS_THRESHOLD:
+        seconds /= 1000
+    return datetime.fromtimestamp(seconds, timezone.utc)
+
+
+def window_of(value, usage_window):
+    """Return the name of the usage window a record's timestamp falls in."""
+    return parse_timestamp(value).strftime(window_format(usage_window))
+
+
+def window_or_none(value, usage_window):
+    """Return the name of the usage window of a timestamp, None if it is not one."""
+    try:
+        return window_of(value, usage_window)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def window_expiry(window, usage_window, retention_hours):
+    """Return the epoch seconds at which the items of a window expire."""
+    start = datetime.strptime(window, window_format(usage_window)).replace(tzinfo=timezone.utc)
+    return int((start + timedelta(hours=retention_hours)).timestamp())
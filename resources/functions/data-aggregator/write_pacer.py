@@ -0,0 +1,169 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+
+# error codes returned by DynamoDB when a request was throttled
+THROTTLING_ERRORS = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+}
+# cancellation reasons that make a transaction worth retrying as-is
+RETRYABLE_CANCELLATION_REASONS = {
+    'ThrottlingError',
+    'ProvisionedThroughputExceeded',
+    'TransactionConflict',
+}
+THROTTLED_CANCELLATION_REASONS = {'ThrottlingError', 'ProvisionedThroughputExceeded'}
+
+
+class WritePacer:
+    """
+    Paces writes to a write capacity budget and retries throttled writes.
+
+    The budget is enforced with a token bucket refilled at the current rate
+    (write capacity units per second). Tokens for a write are taken up front
+    from an estimate and settled against the ConsumedCapacity that DynamoDB
+    returns. The rate is halved every time a write is throttled and grows
+    back towards the budget with every write that succeeds. Throttled writes
+    are retried with exponential backoff and full jitter.
+
+    A budget of 0 disables pacing; throttled writes are still retried.
+    """
+
+    def __init__(self, table_name, capacity_per_second=0, max_attempts=8,
+                 base_delay=0.05, max_delay=5.0):
+        self.table_name = table_name
+        self.budget = float(capacity_per_second)
+        self.rate = self.budget
+        self.tokens = self.budget
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.throttles = 0
+        self.retries = 0
+        self.consumed_capacity = 0.0
+
+    def write(self, operation, estimated_units, **kwargs):
+        """Call operation(**kwargs) within the budget, retrying when throttled."""
+        kwargs['ReturnConsumedCapacity'] = 'TOTAL'
+        for attempt in range(self.max_attempts):
+            self._acquire(estimated_units)
+            try:
+                response = operation(**kwargs)
+            except ClientError as error:
+                throttled, retryable = self._classify(error)
+                self._settle(estimated_units, 0, throttled)
+                if not retryable or attempt + 1 == self.max_attempts:
+                    raise
+                with self.lock:
+                    self.retries += 1
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+
+            # single item writes return one ConsumedCapacity, transactions a list
+            consumed_capacity = response.get('ConsumedCapacity', [])
+            if isinstance(consumed_capacity, dict):
+                consumed_capacity = [consumed_capacity]
+            consumed = sum(
+                capacity.get('CapacityUnits', 0)
+                for capacity in consumed_capacity
+                if capacity.get('TableName') == self.table_name
+            )
+            self._settle(estimated_units, float(consumed), False)
+            return response
+
+    def read(self, operation, **kwargs):
+        """
+        Call operation(**kwargs), retrying when throttled. Reads are not
+        paced, as they do not consume write capacity.
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                return operation(**kwargs)
+            except ClientError as error:
+                _, retryable = self._classify(error)
+                if not retryable or attempt + 1 == self.max_attempts:
+                    raise
+                with self.lock:
+                    self.retries += 1
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def collect_stats(self):
+        """Return the counters gathered since the last call and reset them."""
+        with self.lock:
+            stats = {
+                'throttles': self.throttles,
+                'retries': self.retries,
+                'consumedCapacity': self.consumed_capacity,
+                'writeRate': self.rate,
+            }
+            self.throttles = 0
+            self.retries = 0
+            self.consumed_capacity = 0.0
+        return stats
+
+    def _acquire(self, units):
+        if not self.budget:
+            return
+
+        while True:
+            with self.lock:
+                self._refill()
+                # a write larger than the bucket waits for a full bucket
+                # and then borrows against the next refills
+                if self.tokens >= min(units, self.rate):
+                    self.tokens -= units
+                    return
+                wait = (min(units, self.rate) - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def _settle(self, estimated_units, consumed_units, throttled):
+        with self.lock:
+            self.consumed_capacity += consumed_units
+            if not self.budget:
+                if throttled:
+                    self.throttles += 1
+                return
+
+            self._refill()
+            # give back what was reserved but not used (or take the difference)
+            self.tokens = min(self.rate, self.tokens + estimated_units - consumed_units)
+            if throttled:
+                self.throttles += 1
+                self.rate = max(1.0, self.rate / 2)
+                self.tokens = min(self.tokens, self.rate)
+            else:
+                self.rate = min(self.budget, self.rate + max(1.0, self.budget * 0.05))
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    @staticmethod
+    def _classify(error):
+        code = error.response.get('Error', {}).get('Code')
+        if code in THROTTLING_ERRORS:
+            return True, True
+        if code == 'TransactionCanceledException':
+            reasons = {
+                reason.get('Code')
+                for reason in error.response.get('CancellationReasons', [])
+            }
+            # a failed condition is an answer, not something to retry
+            if 'ConditionalCheckFailed' in reasons:
+                return False, False
+            return (
+                bool(reasons & THROTTLED_CANCELLATION_REASONS),
+                bool(reasons & RETRYABLE_CANCELLATION_REASONS),
+            )
+        if code == 'TransactionConflictException':
+            return False, True
+        return False, False
@@ -1,9 +1,10 @@
+import json
 import os
 import boto3
 import uuid
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from aws_lambda_powertools.utilities.data_classes import EventBridgeEvent
+from aws_lambda_powertools.utilities.data_classes import EventBridgeEvent, SQSEvent
 from botocore.exceptions import ClientError
 
 logger = Logger()
@@ -12,8 +13,17 @@ CUSTOMERS_TABLE = os.environ["CUSTOMERS_TABLE"]
 customers_table = dynamodb.Table(CUSTOMERS_TABLE)
 
 
+# customers created from queued events are named after the event, so an
+# event that is delivered again overwrites the customer it created before
+CUSTOMER_ID_NAMESPACE = uuid.UUID("5f1b7a0e-3c1d-4d2a-9a43-3b8f0f6c2e71")
+
+
 @logger.inject_lambda_context
 def handler(event: EventBridgeEvent, context: LambdaContext):
+    # onboarding events may be buffered in an SQS queue and arrive in batches
+    if "Records" in event:
+        return create_customers(SQSEvent(event))
+
     logger.info(f"Received event: {event}")
 
     tenant_id = event["detail"]["tenantId"]
@@ -36,3 +46,41 @@ def handler(event: EventBridgeEvent, context: LambdaContext):
         "statusCode": 200,
         "body": f"Customer created for tenant {tenant_id} with customerId {customer_id}",
     }
+
+
+def create_customers(event: SQSEvent):
+    """
+    Create a customer for every onboarding event in a batch of SQS messages.
+    Messages that could not be processed are reported as batch item failures,
+    so only those are delivered again.
+    """
+    failures = []
+    customers = []
+    for record in event.records:
+        try:
+            detail = json.loads(record.body)
+            customers.append(
+                (
+                    record.message_id,
+                    {
+                        "customerId": str(uuid.uuid5(CUSTOMER_ID_NAMESPACE, detail["id"])),
+                        "email": detail["detail"]["email"],
+                        "tenantId": detail["detail"]["tenantId"],
+                    },
+                )
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            logger.exception(f"Invalid onboarding event in message {record.message_id}: {e}")
+            failures.append(record.message_id)
+
+    try:
+        with customers_table.batch_writer(overwrite_by_pkeys=["customerId"]) as batch:
+            for _, customer in customers:
+                batch.put_item(Item=customer)
+        logger.info(f"Created {len(customers)} customers")
+    except ClientError as e:
+        # writing a customer again is harmless, so the whole batch is retried
+        logger.exception(f"Error creating customers: {e}")
+        failures.extend(message_id for message_id, _ in customers)
+
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
@@ -1,12 +1,17 @@
+import json
 import os
 import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from aws_lambda_powertools.utilities.data_classes import EventBridgeEvent
+from aws_lambda_powertools.utilities.data_classes import EventBridgeEvent, SQSEvent
 from botocore.exceptions import ClientError
 
 logger = Logger()
-dynamodb = boto3.resource("dynamodb")
+# customers of a batch of offboarding events are looked up concurrently
+MAX_LOOKUP_WORKERS = 10
+dynamodb = boto3.resource("dynamodb", config=Config(max_pool_connections=MAX_LOOKUP_WORKERS))
 CUSTOMERS_TABLE = os.environ["CUSTOMERS_TABLE"]
 TENANT_INDEX_NAME = os.environ["TENANT_INDEX_NAME"]
 customers_table = dynamodb.Table(CUSTOMERS_TABLE)
@@ -14,6 +19,10 @@ customers_table = dynamodb.Table(CUSTOMERS_TABLE)
 
 @logger.inject_lambda_context
 def handler(event: EventBridgeEvent, context: LambdaContext):
+    # offboarding events may be buffered in an SQS queue and arrive in batches
+    if "Records" in event:
+        return delete_customers(SQSEvent(event))
+
     logger.info(f"Received event: {event}")
 
     tenant_id = event["detail"]["tenantId"]
@@ -41,3 +50,69 @@ def handler(event: EventBridgeEvent, context: LambdaContext):
         logger.exception(f"Error deleting customer: {e}")
 
     return {"statusCode": 200, "body": f"Customer deleted for tenant {tenant_id}"}
+
+
+def delete_customers(event: SQSEvent):
+    """
+    Delete the customer of every offboarding event in a batch of SQS messages.
+    Messages that could not be processed are reported as batch item failures,
+    so only those are delivered again.
+    """
+    failures = []
+    tenants = []
+    for record in event.records:
+        try:
+            tenants.append((record.message_id, json.loads(record.body)["detail"]["tenantId"]))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.exception(f"Invalid offboarding event in message {record.message_id}: {e}")
+            failures.append(record.message_id)
+
+    # the tenant index cannot be read with batch_get_item, so it is queried
+    # for all tenants of the batch at once
+    with ThreadPoolExecutor(max_workers=MAX_LOOKUP_WORKERS) as executor:
+        lookups = list(executor.map(lambda tenant: find_customer_ids(tenant[1]), tenants))
+
+    deletes = []
+    for (message_id, tenant_id), customer_ids in zip(tenants, lookups):
+        if customer_ids is None:
+            failures.append(message_id)
+        elif not customer_ids:
+            logger.warning(f"Customer not found: {tenant_id}")
+        else:
+            deletes.append((message_id, customer_ids))
+
+    try:
+        # deleting a customer again is harmless, so the whole batch is retried
+        with customers_table.batch_writer(overwrite_by_pkeys=["customerId"]) as batch:
+            for _, customer_ids in deletes:
+                for customer_id in customer_ids:
+                    batch.delete_item(Key={"customerId": customer_id})
+        logger.info(f"Deleted the customers of {len(deletes)} tenants")
+    except ClientError as e:
+        logger.exception(f"Error deleting customers: {e}")
+        failures.extend(message_id for message_id, _ in deletes)
+
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
+
+
+def find_customer_ids(tenant_id):
+    """Return the ids of a tenant's customers, or None if they could not be read."""
+    # this runs on the lookup threads, so it queries through the resource's
+    # client, which unlike the Table resource is safe to share between them
+    query_kwargs = {
+        "TableName": CUSTOMERS_TABLE,
+        "IndexName": TENANT_INDEX_NAME,
+        "KeyConditionExpression": "tenantId = :tenantId",
+        "ExpressionAttributeValues": {":tenantId": tenant_id},
+    }
+    customer_ids = []
+    try:
+        while True:
+            response = dynamodb.meta.client.query(**query_kwargs)
+            customer_ids.extend(item["customerId"] for item in response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return customer_ids
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except ClientError as e:
+        logger.exception(f"Error finding the customer of tenant {tenant_id}: {e}")
+        return None
@@ -0,0 +1,119 @@
+import os
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from typing import Literal, Optional
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.event_handler import APIGatewayHttpResolver
+from aws_lambda_powertools.event_handler.exceptions import BadRequestError, InternalServerError
+from aws_lambda_powertools.event_handler.openapi.params import Path, Query
+from aws_lambda_powertools.logging import correlation_paths
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from typing_extensions import Annotated
+
+logger = Logger()
+app = APIGatewayHttpResolver(enable_validation=True)
+dynamodb = boto3.resource("dynamodb")
+billing_table = dynamodb.Table(os.environ["BILLING_TABLE"])
+# put-usage keeps monthly and yearly rollups of a tenant's billing records
+# next to them, with billingPeriod set to e.g. MONTHLY#2025-06. Periods
+# start with a digit, so a range of periods never includes a rollup.
+ROLLUP_PREFIXES = {"MONTHLY": "MONTHLY#", "YEARLY": "YEARLY#"}
+ROLLUP_FORMATS = {"MONTHLY": "%Y-%m", "YEARLY": "%Y"}
+FIRST_PERIOD = "0"
+LAST_PERIOD = "9"
+# sorts after every character a period is made of
+PERIOD_END = "\uffff"
+# Billing records of usage windows are named by the window they bill (see
+# put-usage), all other records by the epoch seconds their run started at.
+# Those always have EPOCH_DIGITS digits, so they sort in time order.
+usage_window = os.environ.get("USAGE_WINDOW")
+WINDOW_FORMATS = {"HOURLY": "%Y-%m-%dT%H", "DAILY": "%Y-%m-%d"}
+EPOCH_DIGITS = 10
+# the formats of the dates from and to, by their length. Four digits are a
+# year, any other number is epoch seconds.
+DATE_FORMATS = {4: "%Y", 7: "%Y-%m", 10: "%Y-%m-%d", 13: "%Y-%m-%dT%H"}
+
+
+@app.get("/billing/usage/<tenantId>")
+def fetch_usage(
+    tenantId: Annotated[str, Path(min_length=1)],
+    from_: Annotated[Optional[str], Query(alias="from", min_length=1)] = None,
+    to: Annotated[Optional[str], Query(min_length=1)] = None,
+    rollup: Annotated[Optional[Literal["MONTHLY", "YEARLY"]], Query()] = None,
+    limit: Annotated[Optional[int], Query(gt=0)] = 100,
+    next_token: Annotated[Optional[str], Query(min_length=1)] = None,
+):
+    """
+    Return the billing records of a tenant from period from to period to,
+    or its monthly or yearly rollups when rollup is set. from and to are
+    UTC dates, from a year (2025) to an hour (2025-06-10T12), or epoch
+    seconds. Both ends are inclusive: from=2025-06&to=2025-06 returns the
+    records of June 2025, whichever way the billing records are named.
+    """
+    prefix = ROLLUP_PREFIXES.get(rollup, "")
+    period_format = ROLLUP_FORMATS.get(rollup) or WINDOW_FORMATS.get(usage_window)
+    low = prefix + (period_of(from_, "from", period_format, end=False) if from_ else FIRST_PERIOD)
+    high = prefix + (period_of(to, "to", period_format, end=True) if to else LAST_PERIOD + PERIOD_END)
+
+    query_kwargs = {
+        "KeyConditionExpression": Key("tenantId").eq(tenantId)
+        & Key("billingPeriod").between(low, high),
+        "Limit": limit,
+    }
+    if next_token:
+        query_kwargs["ExclusiveStartKey"] = {"tenantId": tenantId, "billingPeriod": next_token}
+
+    try:
+        response = billing_table.query(**query_kwargs)
+    except ClientError as e:
+        logger.exception(f"Error querying usage of tenant {tenantId}: {e}")
+        raise InternalServerError("Unknown error during processing!")
+
+    usage = response["Items"]
+    for record in usage:
+        # rollups are returned under the name of the period they cover
+        record["billingPeriod"] = record["billingPeriod"][len(prefix):]
+
+    return_response = {"data": usage}
+    if "LastEvaluatedKey" in response:
+        return_response["next_token"] = response["LastEvaluatedKey"]["billingPeriod"]
+    return return_response, HTTPStatus.OK
+
+
+def period_of(value, name, period_format, end):
+    """
+    Return the name of the period the start (or with end, the end) of a date
+    or epoch seconds falls in: period_format of it, or its epoch seconds
+    when periods are named by them.
+    """
+    if value.isdigit() and len(value) != 4:
+        start = stop = datetime.fromtimestamp(min(int(value), 10**EPOCH_DIGITS - 1), timezone.utc)
+    else:
+        try:
+            start = datetime.strptime(value, DATE_FORMATS[len(value)]).replace(tzinfo=timezone.utc)
+        except (KeyError, ValueError):
+            raise BadRequestError(f"Invalid {name}, expected a date such as 2025-06 or epoch seconds")
+        stop = next_date(start, len(value)) - timedelta(seconds=1)
+
+    point = stop if end else start
+    if period_format:
+        return point.strftime(period_format)
+    return str(int(point.timestamp())).zfill(EPOCH_DIGITS)
+
+
+def next_date(start, length):
+    """Return the start of the year, month, day or hour after the one of a date of length."""
+    if length == 4:
+        return start.replace(year=start.year + 1)
+    if length == 7:
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + (timedelta(days=1) if length == 10 else timedelta(hours=1))
+
+
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_HTTP)
+def handler(event: dict, context: LambdaContext):
+    return app.resolve(event, context)
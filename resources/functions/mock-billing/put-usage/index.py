@@ -1,64 +1,550 @@
+import json
 import os
+import random
+import threading
+import time
 import boto3
+from botocore.config import Config
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from datetime import datetime
+from boto3.dynamodb.conditions import Key
+from datetime import datetime, timedelta, timezone
 from botocore.exceptions import ClientError
 
 logger = Logger()
-dynamodb = boto3.resource("dynamodb")
+# the usage table is scanned in SCAN_SEGMENTS parallel segments, each by
+# its own worker thread sharing these clients
+scan_segments = int(os.environ.get("SCAN_SEGMENTS", "1"))
+dynamodb = boto3.resource(
+    "dynamodb", config=Config(max_pool_connections=max(scan_segments, 10))
+)
 data_repository = dynamodb.Table(os.environ["DATA_REPOSITORY"])
 billing_table = dynamodb.Table(os.environ["BILLING_TABLE"])
+lambda_client = boto3.client("lambda")
+# In incremental mode only the tenants marked in DIRTY_TENANTS_TABLE are
+# billed. The track-usage function marks tenants from the data repository's
+# stream, counting their changes in CHANGES_COLUMN.
+dirty_tenants_table = (
+    dynamodb.Table(os.environ["DIRTY_TENANTS_TABLE"])
+    if os.environ.get("DIRTY_TENANTS_TABLE")
+    else None
+)
+CHANGES_COLUMN = "changes"
+# usage of hot tenants may be spread over SHARD_COUNT items (tenantId#n)
+# that point back at the tenant through the SHARD_OF_COLUMN attribute
+shard_count = int(os.environ.get("SHARD_COUNT", "0"))
+SHARD_OF_COLUMN = "sbtaws_shard_of"
+# distinct-count sketches are only needed while aggregating, not for billing
+SKETCH_SUFFIX = "_hll"
+# a transaction holds at most 100 items: a delete for every usage item
+# of the tenants in a batch plus a put for every tenant's billing record
+# and an update for each of its rollups
+MAX_TRANSACTION_ITEMS = 100
+MAX_CLOSE_ATTEMPTS = 5
+BASE_RETRY_DELAY = 0.05
+MAX_RETRY_DELAY = 2.0
+RETRYABLE_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TransactionConflictException",
+    "InternalServerError",
+}
+# a run stops scanning this long before the function times out, records
+# where every segment got to and continues in a follow-up invocation
+RUN_TIME_MARGIN_SECONDS = 30
+# items per scan page, which bounds the work done between deadline checks
+SCAN_PAGE_SIZE = 1000
+MAX_SCAN_ATTEMPTS = 5
+RETRYABLE_CANCELLATION_REASONS = {
+    "ThrottlingError",
+    "ProvisionedThroughputExceeded",
+    "TransactionConflict",
+}
+# when the ingestor aggregates usage per time window, the data repository
+# keeps one item per tenant and window, and every window is billed on its own
+usage_window = os.environ.get("USAGE_WINDOW")
+WINDOW_COLUMN = "usageWindow"
+# windowed items expire through the data repository's time to live
+EXPIRES_AT_COLUMN = "sbtaws_expires_at"
+WINDOW_INDEX = "UsageWindowIndex"
+WINDOW_FORMATS = {"HOURLY": "%Y-%m-%dT%H", "DAILY": "%Y-%m-%d"}
+WINDOW_LENGTHS = {"HOURLY": timedelta(hours=1), "DAILY": timedelta(days=1)}
+# windows that ended within this many hours are (re)billed, which picks up
+# records that arrived after a window was first billed
+lookback_hours = int(os.environ.get("USAGE_LOOKBACK_HOURS", "48"))
+# Billing records are added up into monthly and yearly rollup records of
+# the tenant as they are written, stored next to them with billingPeriod
+# set to e.g. MONTHLY#2025-06. Periods start with a digit, so rollups
+# never fall in a range of periods. Minimums, maximums and distinct counts
+# cannot be added up and are left out of rollups.
+ROLLUP_FORMATS = {"MONTHLY": "%Y-%m", "YEARLY": "%Y"}
+NON_ADDITIVE_SUFFIXES = ("_min", "_max", "_distinct")
 
 
 @logger.inject_lambda_context
 def handler(event: dict, context: LambdaContext):
     logger.info("Starting put-usage function")
 
-    current_period = str(int(datetime.now().timestamp()))
+    if usage_window:
+        for window in ended_windows(datetime.now(timezone.utc)):
+            bill_window(window)
+        return {
+            "statusCode": 200,
+            "body": "Usage data processed and billing records updated",
+        }
 
-    scan_kwargs = {}
+    # A run that ran out of time is continued by a follow-up invocation,
+    # which keeps the run's billing period (its run id) and the segments'
+    # start keys. Segments that are missing from startKeys are done.
+    current_period = event.get("runId") or str(int(datetime.now().timestamp()))
+    total_segments = event.get("totalSegments", scan_segments)
+    start_keys = event.get("startKeys") or {str(segment): None for segment in range(total_segments)}
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - RUN_TIME_MARGIN_SECONDS
+
+    processed_tenants = set()
+    lock = threading.Lock()
+    remaining = {}
+    with ThreadPoolExecutor(max_workers=len(start_keys)) as executor:
+        futures = {
+            segment: executor.submit(
+                scan_segment,
+                int(segment),
+                total_segments,
+                start_key,
+                current_period,
+                deadline,
+                processed_tenants,
+                lock,
+            )
+            for segment, start_key in start_keys.items()
+        }
+        for segment, future in futures.items():
+            try:
+                done, start_key = future.result()
+            except ClientError as e:
+                # its usage stays in the data repository for the next run
+                logger.exception(f"Giving up on segment {segment} of run {current_period}: {e}")
+                continue
+            if not done:
+                remaining[segment] = start_key
+
+    if remaining:
+        logger.info(
+            f"Continuing run {current_period} in a follow-up invocation",
+            extra={"startKeys": remaining},
+        )
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps(
+                {
+                    "runId": current_period,
+                    "totalSegments": total_segments,
+                    "startKeys": remaining,
+                }
+            ),
+        )
+        return {
+            "statusCode": 202,
+            "body": "Usage data partially processed, continuing in a follow-up invocation",
+        }
+
+    return {
+        "statusCode": 200,
+        "body": "Usage data processed and billing records updated",
+    }
+
+
+def scan_segment(segment, total_segments, start_key, current_period, deadline, processed_tenants, lock):
+    """
+    Bill the tenants of a scan segment, starting after start_key.
+
+    Returns (done, start_key): when the deadline is reached before the
+    segment was scanned to the end, start_key is where it stopped.
+    """
+    scanned_table = dirty_tenants_table or data_repository
+    scan_kwargs = {"Segment": segment, "TotalSegments": total_segments, "Limit": SCAN_PAGE_SIZE}
+    items_scanned = 0
+    pages = 0
+    attempts = 0
+    batch = []
+    batch_items = 0
+    marks = {}
     done = False
-    start_key = None
+    # every invocation scans at least a page of each segment, so a run
+    # always moves forward however little time it is given
     while not done:
+        if pages and time.monotonic() > deadline:
+            break
         if start_key:
             scan_kwargs["ExclusiveStartKey"] = start_key
+        # only failed scans count towards MAX_SCAN_ATTEMPTS, the page is
+        # scanned again after a backoff
         try:
-            response = data_repository.scan(**scan_kwargs)
-            for item in response.get("Items", []):
-                process_item(item, current_period)
-            start_key = response.get("LastEvaluatedKey", None)
-            done = start_key is None
+            response = scanned_table.scan(**scan_kwargs)
         except ClientError as e:
-            logger.exception(f"Error scanning data repository: {e}")
+            attempts += 1
+            if attempts >= MAX_SCAN_ATTEMPTS:
+                raise
+            logger.warning(f"Error scanning segment {segment} of {scanned_table.name}: {e}")
+            time.sleep(random.uniform(0, min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2**attempts)))
+            continue
+        attempts = 0
+
+        for item in response.get("Items", []):
+            tenant_usage = claim_usage(item, processed_tenants, lock)
+            if tenant_usage is None:
+                continue
+            tenant_id, usage_items = tenant_usage
+            # each tenant takes a delete per usage item, a put and
+            # an update per rollup
+            tenant_items = len(usage_items) + 1 + len(ROLLUP_FORMATS)
+            if batch_items + tenant_items > MAX_TRANSACTION_ITEMS:
+                bill_batch(batch, marks, current_period)
+                batch = []
+                batch_items = 0
+                marks = {}
+            if dirty_tenants_table:
+                marks[tenant_id] = item[CHANGES_COLUMN]
+            if usage_items:
+                batch.append(tenant_usage)
+                batch_items += tenant_items
+        start_key = response.get("LastEvaluatedKey", None)
+        done = start_key is None
+
+        items_scanned += len(response.get("Items", []))
+        pages += 1
+        logger.info(
+            "Scan progress",
+            extra={
+                "segment": segment,
+                "totalSegments": total_segments,
+                "pages": pages,
+                "itemsScanned": items_scanned,
+                "done": done,
+            },
+        )
+
+    # the usage of every page scanned so far is billed before the segment
+    # reports where it stopped
+    if batch or marks:
+        bill_batch(batch, marks, current_period)
+    return done, start_key
+
+
+def bill_batch(batch, marks, current_period):
+    """
+    Bill a batch of tenants and clear the dirty marks of those that are
+    clean again. A batch that fails is left for the next run: its usage
+    stays in the data repository and its tenants stay marked, so the
+    segment goes on with the tenants after it.
+    """
+    try:
+        billed = close_usage(batch, current_period) if batch else set()
+        batch_tenants = {tenant_id for tenant_id, _ in batch}
+        # tenants that were billed, or had no usage to bill, are clean again
+        for tenant_id, changes in marks.items():
+            if tenant_id in billed or tenant_id not in batch_tenants:
+                clear_dirty_mark(tenant_id, changes)
+    except ClientError as e:
+        logger.exception(
+            f"Error billing a batch of {len(batch)} tenants: {e}",
+            extra={"tenants": [tenant_id for tenant_id, _ in batch]},
+        )
+
+
+def clear_dirty_mark(tenant_id, changes):
+    # a tenant whose usage changed again since it was marked stays dirty
+    try:
+        dirty_tenants_table.delete_item(
+            Key={"tenantId": tenant_id},
+            ConditionExpression="#changes = :changes",
+            ExpressionAttributeNames={"#changes": CHANGES_COLUMN},
+            ExpressionAttributeValues={":changes": changes},
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def claim_usage(item, processed_tenants, lock):
+    """
+    Return (tenant id, usage items) for the tenant of a scanned item, or
+    None when another item of the same tenant was claimed already. Items
+    scanned from the dirty tenants table hold no usage, so it is read.
+    """
+    # a tenant's shards are rolled up together with the tenant's own item,
+    # so whichever of them any segment returns first closes the period
+    tenant_id = item.get(SHARD_OF_COLUMN, item["tenantId"])
+    with lock:
+        if tenant_id in processed_tenants:
+            return None
+        processed_tenants.add(tenant_id)
+
+    if not (shard_count or dirty_tenants_table):
+        return tenant_id, [item]
+    try:
+        return tenant_id, read_usage(tenant_id)
+    except ClientError as e:
+        # the tenant stays claimed, its usage is billed in the next run
+        logger.exception(f"Error reading the usage of tenant {tenant_id}: {e}")
+        return None
+
+
+def read_usage(tenant_id):
+    """Return the current usage items of a tenant: its own item and its shards."""
+    request_items = {
+        data_repository.name: {
+            "Keys": [
+                {"tenantId": key}
+                for key in [tenant_id] + [f"{tenant_id}#{n}" for n in range(shard_count)]
+            ],
+            "ConsistentRead": True,
+        }
+    }
+    usage_items = []
+    while request_items:
+        response = dynamodb.batch_get_item(RequestItems=request_items)
+        usage_items.extend(response["Responses"].get(data_repository.name, []))
+        request_items = response.get("UnprocessedKeys")
+    return usage_items
+
 
+def close_usage(batch, current_period):
+    """
+    Move the usage of a batch of tenants into billing records.
+
+    The usage items of every tenant are deleted and its billing record is
+    put in one transaction, so usage is either billed or left in place.
+    Each delete is conditional on the item being unchanged since it was
+    read; tenants that received usage in the meantime are read again and
+    the batch is retried. A tenant already billed for this period is
+    dropped from the batch, its new usage is billed in the next period.
+    The tenant's rollups are updated in the same transaction.
+
+    Returns the ids of the tenants whose usage was billed.
+    """
+    # the period of a run is named by the time it started at
+    period_start = datetime.fromtimestamp(int(current_period), timezone.utc)
+    for attempt in range(MAX_CLOSE_ATTEMPTS):
+        transact_items = []
+        owners = []
+        for tenant_id, usage_items in batch:
+            usage = {}
+            for usage_item in usage_items:
+                transact_items.append(delete_unchanged(usage_item))
+                owners.append(tenant_id)
+                merge_usage(usage, usage_item)
+            transact_items.append(
+                {
+                    "Put": {
+                        "TableName": billing_table.name,
+                        "Item": {
+                            "tenantId": tenant_id,
+                            "billingPeriod": current_period,
+                        }
+                        | usage,
+                        "ConditionExpression": "attribute_not_exists(tenantId)",
+                    }
+                }
+            )
+            owners.append(tenant_id)
+            for rollup_update in update_rollups(tenant_id, period_start, usage):
+                transact_items.append(rollup_update)
+                owners.append(tenant_id)
+
+        try:
+            dynamodb.meta.client.transact_write_items(TransactItems=transact_items)
+            logger.info(
+                f"Updated billing records for {len(batch)} tenants",
+                extra={"tenants": [tenant_id for tenant_id, _ in batch]},
+            )
+            return {tenant_id for tenant_id, _ in batch}
+        except dynamodb.meta.client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get("CancellationReasons", [])
+            failed = [
+                (owners[index], "Put" in transact_items[index])
+                for index, reason in enumerate(reasons)
+                if reason.get("Code") == "ConditionalCheckFailed"
+            ]
+            if not failed and not RETRYABLE_CANCELLATION_REASONS & {
+                reason.get("Code") for reason in reasons
+            }:
+                logger.exception(f"Error updating billing records: {e}")
+                return set()
+            billed = {tenant_id for tenant_id, is_put in failed if is_put}
+            changed = {tenant_id for tenant_id, is_put in failed if not is_put} - billed
+            batch = [
+                (tenant_id, read_usage(tenant_id) if tenant_id in changed else usage_items)
+                for tenant_id, usage_items in batch
+                if tenant_id not in billed
+            ]
+            batch = [(tenant_id, usage_items) for tenant_id, usage_items in batch if usage_items]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in RETRYABLE_ERRORS:
+                logger.exception(f"Error updating billing records: {e}")
+                return set()
+        if not batch:
+            return set()
+        time.sleep(random.uniform(0, min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2**attempt)))
+
+    logger.error(
+        f"Gave up updating billing records after {MAX_CLOSE_ATTEMPTS} attempts, "
+        "their usage is billed in the next period",
+        extra={"tenants": [tenant_id for tenant_id, _ in batch]},
+    )
+    return set()
+
+
+def delete_unchanged(usage_item):
+    """Return the transaction delete of a usage item, if it still holds the same usage."""
     return {
-        "statusCode": 200,
-        "body": "Usage data processed and billing records updated",
+        "Delete": {
+            "TableName": data_repository.name,
+            "Key": {"tenantId": usage_item["tenantId"]},
+            **unchanged_condition(usage_item),
+        }
     }
 
 
-def process_item(item, current_period):
-    tenant_id = item["tenantId"]
+def unchanged_condition(item):
+    """Return the condition that every attribute of an item still has the same value."""
+    expression_attribute_names = {}
+    expression_attribute_values = {}
+    conditions = []
+    for index, (k, v) in enumerate(item.items()):
+        expression_attribute_names[f"#a{index}"] = k
+        expression_attribute_values[f":v{index}"] = v
+        conditions.append(f"#a{index} = :v{index}")
 
-    try:
-        # Atomic delete and retrieve operation
-        old_item = data_repository.delete_item(
-            Key={"tenantId": tenant_id}, ReturnValues="ALL_OLD"
-        )["Attributes"]
+    return {
+        "ConditionExpression": " AND ".join(conditions),
+        "ExpressionAttributeNames": expression_attribute_names,
+        "ExpressionAttributeValues": expression_attribute_values,
+    }
 
-        usage = {k: v for k, v in old_item.items() if k not in ["tenantId"]}
 
-        billing_table.put_item(
-            Item={
-                "tenantId": tenant_id,
-                "billingPeriod": current_period,
+def update_rollups(tenant_id, period_start, usage):
+    """
+    Return the transaction updates that add usage to the rollups of the
+    period starting at period_start.
+    """
+    additive = {
+        k: v for k, v in usage.items() if v and not k.endswith(NON_ADDITIVE_SUFFIXES)
+    }
+    if not additive:
+        return []
+
+    expression_attribute_names = {}
+    expression_attribute_values = {}
+    additions = []
+    for index, (k, v) in enumerate(additive.items()):
+        expression_attribute_names[f"#a{index}"] = k
+        expression_attribute_values[f":v{index}"] = v
+        additions.append(f"#a{index} :v{index}")
+
+    return [
+        {
+            "Update": {
+                "TableName": billing_table.name,
+                "Key": {
+                    "tenantId": tenant_id,
+                    "billingPeriod": f"{rollup}#{period_start.strftime(rollup_format)}",
+                },
+                "UpdateExpression": "ADD " + ", ".join(additions),
+                "ExpressionAttributeNames": expression_attribute_names,
+                "ExpressionAttributeValues": expression_attribute_values,
             }
-            | usage
-        )
-        logger.info(f"Updated billing record for tenant {tenant_id}")
+        }
+        for rollup, rollup_format in ROLLUP_FORMATS.items()
+    ]
+
+
+def merge_usage(usage, usage_item):
+    for k, v in usage_item.items():
+        if k in ["tenantId", SHARD_OF_COLUMN, WINDOW_COLUMN, EXPIRES_AT_COLUMN] or k.endswith(SKETCH_SUFFIX):
+            continue
+        # only sums and counts are sharded, minimums, maximums and
+        # distinct counts are kept on the tenant's own item
+        usage[k] = usage[k] + v if k in usage else v
+
+
+def ended_windows(now):
+    """Return the names of the windows that ended in the lookback period."""
+    length = WINDOW_LENGTHS[usage_window]
+    window_format = WINDOW_FORMATS[usage_window]
+    # the start of the window that is still open
+    start = datetime.strptime(now.strftime(window_format), window_format)
+    start = start.replace(tzinfo=timezone.utc)
+    windows = []
+    # start is where the window before it ends
+    while start > now - timedelta(hours=lookback_hours):
+        start -= length
+        windows.append(start.strftime(window_format))
+    return sorted(windows)
+
+
+def bill_window(window):
+    # The items of a window are read through the window index, so nothing
+    # else in the data repository is read. They are left in place: billing
+    # the window again (with records that arrived late) replaces its record.
+    usage_by_tenant = defaultdict(dict)
+    query_kwargs = {
+        "IndexName": WINDOW_INDEX,
+        "KeyConditionExpression": Key(WINDOW_COLUMN).eq(window),
+    }
+    try:
+        while True:
+            response = data_repository.query(**query_kwargs)
+            for item in response.get("Items", []):
+                merge_usage(usage_by_tenant[item.get(SHARD_OF_COLUMN, item["tenantId"])], item)
+            if "LastEvaluatedKey" not in response:
+                break
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
     except ClientError as e:
-        logger.exception(
-            f"Error processing and updating billing record for tenant {tenant_id}: {e}"
-        )
+        logger.exception(f"Error querying usage window {window}: {e}")
+        return
+
+    window_start = datetime.strptime(window, WINDOW_FORMATS[usage_window])
+    for tenant_id, usage in usage_by_tenant.items():
+        try:
+            replace_window_record(tenant_id, window, window_start, usage)
+            logger.info(f"Updated billing record for tenant {tenant_id} and window {window}")
+        except ClientError as e:
+            logger.exception(
+                f"Error updating billing record for tenant {tenant_id} and window {window}: {e}"
+            )
+
+
+def replace_window_record(tenant_id, window, window_start, usage):
+    # A window billed again replaces its record, so only the difference to
+    # the record it replaces is added to the rollups. The record is only
+    # replaced if it did not change since it was read; otherwise the window
+    # is billed again by the next run.
+    key = {"tenantId": tenant_id, "billingPeriod": window}
+    record = billing_table.get_item(Key=key, ConsistentRead=True).get("Item")
+    if record:
+        condition = unchanged_condition(record)
+        previous = {k: v for k, v in record.items() if k not in key}
+    else:
+        condition = {"ConditionExpression": "attribute_not_exists(tenantId)"}
+        previous = {}
+
+    difference = dict(usage)
+    for k, v in previous.items():
+        difference[k] = difference.get(k, 0) - v
+    dynamodb.meta.client.transact_write_items(
+        TransactItems=[
+            {
+                "Put": {
+                    "TableName": billing_table.name,
+                    "Item": key | usage,
+                    **condition,
+                }
+            }
+        ]
+        + update_rollups(tenant_id, window_start, difference)
+    )
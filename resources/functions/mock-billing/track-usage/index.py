@@ -0,0 +1,40 @@
+import os
+import boto3
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.utilities.data_classes import event_source, DynamoDBStreamEvent
+from aws_lambda_powertools.utilities.data_classes.dynamo_db_stream_event import (
+    DynamoDBRecordEventName,
+)
+from aws_lambda_powertools.utilities.typing import LambdaContext
+
+logger = Logger()
+dynamodb = boto3.resource("dynamodb")
+dirty_tenants_table = dynamodb.Table(os.environ["DIRTY_TENANTS_TABLE"])
+# sharded usage items point back at their tenant through this attribute
+SHARD_OF_COLUMN = "sbtaws_shard_of"
+CHANGES_COLUMN = "changes"
+
+
+@logger.inject_lambda_context
+@event_source(data_class=DynamoDBStreamEvent)
+def handler(event: DynamoDBStreamEvent, context: LambdaContext):
+    # Usage is only added to the data repository by the aggregator; items
+    # are removed when put-usage bills them, which needs no marking.
+    tenants = set()
+    for record in event.records:
+        if record.event_name == DynamoDBRecordEventName.REMOVE:
+            continue
+        new_image = record.dynamodb.new_image
+        tenants.add(new_image.get(SHARD_OF_COLUMN, new_image["tenantId"]))
+
+    # every change is counted, so put-usage can tell whether a tenant
+    # changed again after it read the tenant's usage
+    for tenant_id in tenants:
+        dirty_tenants_table.update_item(
+            Key={"tenantId": tenant_id},
+            UpdateExpression="ADD #changes :one",
+            ExpressionAttributeNames={"#changes": CHANGES_COLUMN},
+            ExpressionAttributeValues={":one": 1},
+        )
+
+    logger.info(f"Marked {len(tenants)} tenants with unbilled usage")
@@ -0,0 +1,86 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from aws_lambda_powertools import Logger, Tracer
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from botocore.config import Config
+
+tracer = Tracer()
+logger = Logger()
+
+# the tenant table is scanned in BACKFILL_SEGMENTS parallel segments, each by
+# its own worker thread sharing these clients
+backfill_segments = int(os.environ.get("BACKFILL_SEGMENTS", "4"))
+dynamodb = boto3.resource("dynamodb", config=Config(max_pool_connections=max(backfill_segments, 10)))
+tenant_details_table = dynamodb.Table(os.environ["TENANT_DETAILS_TABLE"])
+# the sparse active tenants index is keyed on this attribute, which holds
+# the tenant's shard of the index, see index.py
+ACTIVE_LISTING_COLUMN = "sbtaws_active_listing"
+ACTIVE_LISTING_SHARDS = 8
+# the partition every tenant was listed in before the index was sharded
+UNSHARDED_LISTING = "ACTIVE"
+
+
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def handler(event: dict, context: LambdaContext):
+    """
+    List the active tenants written before the active tenants index existed
+    in it, by giving them its key attribute, and move the ones listed before
+    it was sharded to their shard. Tenants that are listed in their shard
+    are left as they are, so it is safe to run again. It is run when it is
+    first deployed, and whenever it changes.
+    """
+    total_segments = int(event.get("segments", backfill_segments))
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        listed = sum(
+            executor.map(
+                lambda segment: backfill_segment(segment, total_segments), range(total_segments)
+            )
+        )
+    logger.info("Listed active tenants", extra={"listed": listed})
+    return {"listed": listed}
+
+
+def backfill_segment(segment, total_segments):
+    """List the unlisted active tenants of a scan segment, returning how many."""
+    unlisted = Attr("sbtaws_active").eq(True) & (
+        Attr(ACTIVE_LISTING_COLUMN).not_exists() | Attr(ACTIVE_LISTING_COLUMN).eq(UNSHARDED_LISTING)
+    )
+    scan_kwargs = {
+        "Segment": segment,
+        "TotalSegments": total_segments,
+        "FilterExpression": unlisted,
+        "ProjectionExpression": "tenantId",
+    }
+    listed = 0
+    while True:
+        response = tenant_details_table.scan(**scan_kwargs)
+        for tenant in response["Items"]:
+            try:
+                # the tenant may have been deactivated since it was read
+                tenant_details_table.update_item(
+                    Key={"tenantId": tenant["tenantId"]},
+                    UpdateExpression="SET #listing = :listing",
+                    ConditionExpression=unlisted,
+                    ExpressionAttributeNames={"#listing": ACTIVE_LISTING_COLUMN},
+                    ExpressionAttributeValues={":listing": active_listing(tenant["tenantId"])},
+                )
+                listed += 1
+            except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+                pass
+        if "LastEvaluatedKey" not in response:
+            break
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    return listed
+
+
+def active_listing(tenant_id):
+    # must be the shard index.py lists the tenant in
+    return f"ACTIVE#{zlib.crc32(tenant_id.encode()) % ACTIVE_LISTING_SHARDS}"
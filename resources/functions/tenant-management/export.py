@@ -0,0 +1,141 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import base64
+import gzip
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import boto3
+from botocore.config import Config
+from aws_lambda_powertools import Logger, Tracer
+from aws_lambda_powertools.utilities.typing import LambdaContext
+
+tracer = Tracer()
+logger = Logger()
+
+# the tenant table is scanned in EXPORT_SEGMENTS parallel segments, each by
+# its own worker thread sharing these clients
+export_segments = int(os.environ.get("EXPORT_SEGMENTS", "8"))
+client_config = Config(max_pool_connections=max(export_segments, 10))
+dynamodb = boto3.resource("dynamodb", config=client_config)
+tenant_details_table = dynamodb.Table(os.environ["TENANT_DETAILS_TABLE"])
+# any S3 compatible store can be exported to, e.g. a local stand-in for tests
+s3 = boto3.client(
+    "s3",
+    endpoint_url=os.environ.get("EXPORT_S3_ENDPOINT_URL") or None,
+    config=client_config,
+)
+default_bucket = os.environ.get("EXPORT_BUCKET")
+# a segment's tenants are uploaded in objects of about this many bytes
+# (before compression), which bounds the memory each segment holds
+chunk_bytes = int(os.environ.get("EXPORT_CHUNK_BYTES", str(16 * 1024 * 1024)))
+
+
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def handler(event: dict, context: LambdaContext):
+    """
+    Export every tenant as a line of NDJSON to bucket (EXPORT_BUCKET by
+    default), under prefix, optionally gzip compressed. Returns the manifest
+    of the export, which is also written next to it as manifest.json.
+
+    The table is read with a parallel scan, not a point in time snapshot:
+    tenants that change during the export may be exported in either state.
+    """
+    export_id = str(uuid.uuid4())
+    bucket = event.get("bucket") or default_bucket
+    if not bucket:
+        raise ValueError("No bucket to export tenants to")
+    prefix = event.get("prefix", f"tenant-exports/{export_id}/")
+    compress = bool(event.get("gzip", False))
+    total_segments = int(event.get("segments", export_segments))
+    started_at = datetime.now(timezone.utc)
+    logger.info(
+        "Exporting tenants",
+        extra={"bucket": bucket, "prefix": prefix, "gzip": compress, "segments": total_segments},
+    )
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        segment_files = list(
+            executor.map(
+                lambda segment: export_segment(
+                    segment, total_segments, bucket, prefix, compress
+                ),
+                range(total_segments),
+            )
+        )
+
+    files = [file for files in segment_files for file in files]
+    manifest = {
+        "exportId": export_id,
+        "bucket": bucket,
+        "prefix": prefix,
+        "format": "ndjson",
+        "compression": "gzip" if compress else None,
+        "startedAt": started_at.isoformat(),
+        "completedAt": datetime.now(timezone.utc).isoformat(),
+        "tenantCount": sum(file["tenants"] for file in files),
+        "files": files,
+    }
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{prefix}manifest.json",
+        Body=json.dumps(manifest).encode(),
+        ContentType="application/json",
+    )
+    logger.info(
+        "Exported tenants",
+        extra={"tenantCount": manifest["tenantCount"], "files": len(files)},
+    )
+    return manifest
+
+
+def export_segment(segment, total_segments, bucket, prefix, compress):
+    """Export the tenants of a scan segment, returning the files written."""
+    files = []
+    lines = []
+    size = 0
+    scan_kwargs = {"Segment": segment, "TotalSegments": total_segments}
+    while True:
+        response = tenant_details_table.scan(**scan_kwargs)
+        for tenant in response.get("Items", []):
+            line = json.dumps(tenant, default=_json_default).encode() + b"\n"
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_bytes:
+                files.append(upload_chunk(bucket, prefix, segment, len(files), lines, compress))
+                lines = []
+                size = 0
+        if "LastEvaluatedKey" not in response:
+            break
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    if lines:
+        files.append(upload_chunk(bucket, prefix, segment, len(files), lines, compress))
+    return files
+
+
+def upload_chunk(bucket, prefix, segment, index, lines, compress):
+    body = b"".join(lines)
+    key = f"{prefix}part-{segment:04d}-{index:05d}.ndjson"
+    if compress:
+        body = gzip.compress(body)
+        key += ".gz"
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+    return {"key": key, "tenants": len(lines), "bytes": len(body)}
+
+
+def _json_default(value):
+    # DynamoDB numbers are read as Decimal, sets as set and binary as Binary
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, set):
+        return sorted(value, key=str)
+    if hasattr(value, "value") and isinstance(value.value, bytes):
+        return base64.b64encode(value.value).decode()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
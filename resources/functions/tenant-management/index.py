@@ -1,40 +1,98 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import base64
+import binascii
+import heapq
+import json
 import os
+import random
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from functools import reduce
+from itertools import islice
 from http import HTTPStatus
 import uuid
 
 import boto3
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import TypeSerializer
 import botocore
 from typing import Optional
 from aws_lambda_powertools import Logger, Tracer
-from aws_lambda_powertools.event_handler import APIGatewayHttpResolver, CORSConfig
+from aws_lambda_powertools.event_handler import (
+    APIGatewayHttpResolver,
+    CORSConfig,
+    Response,
+    content_types,
+)
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.event_handler.openapi.params import Query, Path
 from typing_extensions import Annotated
 from aws_lambda_powertools.event_handler.exceptions import (
+    BadRequestError,
     InternalServerError,
     NotFoundError,
+    ServiceError,
 )
+from update_expression import build_update
 
 tracer = Tracer()
 logger = Logger()
 # TODO Make sure we fill in an appropriate origin for this call (the CloudFront domain)
-cors_config = CORSConfig(allow_origin="*", max_age=300)
+cors_config = CORSConfig(
+    allow_origin="*", allow_headers=["If-Match", "If-None-Match"], expose_headers=["ETag"], max_age=300
+)
 app = APIGatewayHttpResolver(cors=cors_config, enable_validation=True)
 
 dynamodb = boto3.resource("dynamodb")
+serializer = TypeSerializer()
 tenant_details_table = dynamodb.Table(os.environ["TENANT_DETAILS_TABLE"])
+# Only active tenants have the ACTIVE_LISTING_COLUMN attribute, so the
+# sparse index it keys lists them without reading inactive tenants. Every
+# active tenant is in one of the ACTIVE_LISTING_SHARDS partitions of the
+# index (ACTIVE#<shard>), so that no single partition takes every write.
+# Tenants created before the index, or before it was sharded, are given
+# their partition by backfill.py.
+active_tenants_index_name = os.environ["ACTIVE_TENANTS_INDEX_NAME"]
+ACTIVE_LISTING_COLUMN = "sbtaws_active_listing"
+ACTIVE_LISTING_SHARDS = 8
+# a BatchGetItem call reads at most 100 keys, a BatchWriteItem call writes
+# at most 25 items. Batches are kept to 100 tenants so that the response
+# stays well below Lambda's 6 MB response payload limit.
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+MAX_BATCH_TENANTS = 100
+MAX_BATCH_GET_ATTEMPTS = 5
+# times a tenant is read and updated again when it changed in between
+MAX_UPDATE_ATTEMPTS = 3
+BASE_RETRY_DELAY = 0.05
+# Every write of a tenant increments its VERSION_COLUMN, which is exposed
+# as the tenant's ETag. Tenants written before versioning have version 0.
+VERSION_COLUMN = "sbtaws_version"
+# Every tenant is in one of the CHANGE_FEED_SHARDS partitions of the changes
+# index, sorted by the time it was last written, which is kept in
+# UPDATED_AT_COLUMN. The index only exists when the change feed is enabled,
+# but the attributes are always written, so it covers every tenant written
+# since they were introduced.
+tenant_changes_index_name = os.environ.get("TENANT_CHANGES_INDEX_NAME")
+UPDATED_AT_COLUMN = "updatedAt"
+CHANGE_FEED_COLUMN = "sbtaws_change_feed"
+CHANGE_FEED_SHARDS = 8
+# The index is eventually consistent and writes may land after the time they
+# recorded, so the feed only returns changes older than this.
+CHANGE_FEED_SETTLE_TIME = timedelta(seconds=5)
+# the tenant counters kept by stats.py from the tenant table's stream
+tenant_stats_table = dynamodb.Table(os.environ["TENANT_STATS_TABLE"])
+STATS_ID = "TENANTS"
 
 
 @app.post("/tenants")
 @tracer.capture_method
 def create_tenant():
-    input_details = app.current_event.json_body
-    input_details["tenantId"] = str(uuid.uuid4())
-    input_details["sbtaws_active"] = True
+    input_details = __new_tenant(app.current_event.json_body)
 
     logger.info("Request received to create new tenant")
 
@@ -49,19 +107,144 @@ def create_tenant():
         return {"data": input_details}, HTTPStatus.CREATED
 
 
+@app.post("/tenants/batch")
+@tracer.capture_method
+def create_tenants():
+    tenants = __json_object_body().get("tenants")
+    if not isinstance(tenants, list) or not 0 < len(tenants) <= MAX_BATCH_TENANTS:
+        raise BadRequestError(f"tenants must be a list of 1 to {MAX_BATCH_TENANTS} tenants")
+
+    logger.info(f"Request received to create {len(tenants)} tenants")
+
+    results = [None] * len(tenants)
+    valid = []
+    for index, tenant in enumerate(tenants):
+        if not isinstance(tenant, dict):
+            results[index] = {"status": HTTPStatus.BAD_REQUEST, "message": "A tenant must be an object"}
+            continue
+        # a tenant DynamoDB cannot store would fail the batch writer, and with
+        # it every tenant of its chunk, so it is rejected on its own here.
+        # Numbers with a fraction are parsed as floats, which DynamoDB only
+        # takes as Decimals.
+        tenant = __new_tenant(json.loads(json.dumps(tenant), parse_float=Decimal))
+        try:
+            serializer.serialize(tenant)
+        except (TypeError, ArithmeticError):
+            results[index] = {
+                "status": HTTPStatus.BAD_REQUEST,
+                "message": "A tenant has a value that cannot be stored",
+            }
+        else:
+            valid.append((index, tenant))
+
+    # every chunk is written by its own batch writer, so a failure is
+    # reported for the tenants of that chunk only
+    for start in range(0, len(valid), BATCH_WRITE_SIZE):
+        chunk = valid[start : start + BATCH_WRITE_SIZE]
+        try:
+            with tenant_details_table.batch_writer() as batch:
+                for _, tenant in chunk:
+                    batch.put_item(Item=tenant)
+        except botocore.exceptions.ClientError as error:
+            logger.error(error)
+            for index, _ in chunk:
+                results[index] = {
+                    "status": HTTPStatus.INTERNAL_SERVER_ERROR,
+                    "message": "Unknown error during processing!",
+                }
+        else:
+            for index, tenant in chunk:
+                results[index] = {"status": HTTPStatus.CREATED, "data": tenant}
+
+    failed = any(result["status"] != HTTPStatus.CREATED for result in results)
+    return {"data": results}, HTTPStatus.MULTI_STATUS if failed else HTTPStatus.CREATED
+
+
+@app.post("/tenants/batch-get")
+@tracer.capture_method
+def batch_get_tenants():
+    json_body = __json_object_body()
+    tenant_ids = json_body.get("tenantIds")
+    if (
+        not isinstance(tenant_ids, list)
+        or not 0 < len(tenant_ids) <= MAX_BATCH_TENANTS
+        or not all(isinstance(tenant_id, str) and tenant_id for tenant_id in tenant_ids)
+    ):
+        raise BadRequestError(f"tenantIds must be a list of 1 to {MAX_BATCH_TENANTS} tenant ids")
+
+    logger.info(f"Request received to get {len(tenant_ids)} tenants")
+
+    # a batch may not hold the same key twice
+    tenant_ids = list(dict.fromkeys(tenant_ids))
+    fields = json_body.get("fields")
+    if fields is not None and not isinstance(fields, str):
+        raise BadRequestError("fields must be a comma separated list of attributes")
+    projection = __projection(fields)
+    tenants = []
+    unprocessed = []
+    try:
+        for start in range(0, len(tenant_ids), BATCH_GET_SIZE):
+            request = {
+                "Keys": [{"tenantId": tenant_id} for tenant_id in tenant_ids[start : start + BATCH_GET_SIZE]],
+                **projection,
+            }
+            for attempt in range(MAX_BATCH_GET_ATTEMPTS):
+                response = dynamodb.batch_get_item(RequestItems={tenant_details_table.name: request})
+                tenants.extend(response["Responses"].get(tenant_details_table.name, []))
+                request = response.get("UnprocessedKeys", {}).get(tenant_details_table.name)
+                if not request:
+                    break
+                time.sleep(random.uniform(0, BASE_RETRY_DELAY * 2**attempt))
+            if request:
+                unprocessed.extend(key["tenantId"] for key in request["Keys"])
+    except botocore.exceptions.ClientError as error:
+        logger.error(error)
+        raise InternalServerError("Unknown error during processing!")
+
+    found = {tenant["tenantId"] for tenant in tenants} | set(unprocessed)
+    return_response = {
+        "data": tenants,
+        "notFound": [tenant_id for tenant_id in tenant_ids if tenant_id not in found],
+    }
+    # tenants that were still throttled after retrying can be asked for again
+    if unprocessed:
+        return_response["unprocessedTenantIds"] = unprocessed
+    return return_response, HTTPStatus.OK
+
+
 @app.get("/tenants")
 @tracer.capture_method
 def get_tenants(
     limit: Annotated[Optional[int], Query(gt=0)] = 10,
     next_token: Annotated[Optional[str], Query(min_length=0)] = None,
+    active: Annotated[Optional[bool], Query()] = None,
+    tier: Annotated[Optional[str], Query(min_length=1)] = None,
+    tenantName: Annotated[Optional[str], Query(min_length=1)] = None,
+    fields: Annotated[Optional[str], Query(min_length=1)] = None,
 ):
+    """
+    Return a page of tenants, with the next_token of the next page if there
+    is one. With active=true only active tenants are read, through the
+    active tenants index. tier and tenantName (a prefix) are filters on the
+    tenants read: without active=true every tenant of the table is read to
+    find them, which is a full table scan.
+    """
     logger.info("Request received to get all tenants")
+    if active:
+        return __get_active_tenants(limit, next_token, tier, tenantName, fields)
+
     tenants = None
     last_evaluated_key = None
 
-    kwargs = {"Limit": limit}
+    kwargs = {"Limit": limit, **__projection(fields)}
     if next_token:
-        kwargs["ExclusiveStartKey"] = {"tenantId": next_token}
+        kwargs["ExclusiveStartKey"] = __decode_next_token(next_token)
+
+    filters = __tenant_filters(tier, tenantName)
+    if active is False:
+        filters.append(Attr("sbtaws_active").eq(False))
+    if filters:
+        kwargs["FilterExpression"] = reduce(lambda a, b: a & b, filters)
 
     try:
         response = tenant_details_table.scan(**kwargs)
@@ -76,18 +259,286 @@ def get_tenants(
         return_response = {"data": tenants}
 
         if last_evaluated_key:
-            return_response["next_token"] = last_evaluated_key["tenantId"]
+            return_response["next_token"] = __encode_next_token(last_evaluated_key)
 
         return return_response, HTTPStatus.OK
 
 
+def __get_active_tenants(limit, next_token, tier, tenantName, fields):
+    # The token holds the index key of the last tenant returned from each
+    # shard, or None for a shard that was not read yet. Shards that were
+    # read to the end are left out of it.
+    shards = [__active_listing_partition(shard) for shard in range(ACTIVE_LISTING_SHARDS)]
+    positions = __decode_next_token(next_token) if next_token else dict.fromkeys(shards)
+    if not isinstance(positions, dict) or not all(
+        shard in shards and (position is None or __is_active_listing_position(position, shard))
+        for shard, position in positions.items()
+    ):
+        raise BadRequestError("Invalid next_token")
+
+    kwargs = {"Limit": limit, **__projection(fields)}
+    filters = __tenant_filters(tier, tenantName)
+    if filters:
+        kwargs["FilterExpression"] = reduce(lambda a, b: a & b, filters)
+
+    responses = {}
+    try:
+        for shard, position in positions.items():
+            shard_kwargs = {**kwargs, "ExclusiveStartKey": position} if position else kwargs
+            responses[shard] = tenant_details_table.query(
+                IndexName=active_tenants_index_name,
+                KeyConditionExpression=Key(ACTIVE_LISTING_COLUMN).eq(shard),
+                **shard_kwargs,
+            )
+    except botocore.exceptions.ClientError as error:
+        logger.error(error)
+        raise InternalServerError("Unknown error during processing!")
+
+    # every shard is sorted by tenantId, so the first limit tenants are
+    # among the first limit of each shard
+    read = [
+        [(tenant["tenantId"], shard, tenant) for tenant in response["Items"]]
+        for shard, response in responses.items()
+    ]
+    page = list(islice(heapq.merge(*read), limit))
+    returned = dict.fromkeys(responses, 0)
+    last_returned = {}
+    for tenantId, shard, _ in page:
+        returned[shard] += 1
+        last_returned[shard] = tenantId
+    for shard, response in responses.items():
+        if returned[shard] < len(response["Items"]):
+            # the shard goes on after the last tenant returned from it, if any
+            if shard in last_returned:
+                positions[shard] = {"tenantId": last_returned[shard], ACTIVE_LISTING_COLUMN: shard}
+        elif "LastEvaluatedKey" in response:
+            positions[shard] = response["LastEvaluatedKey"]
+        else:
+            del positions[shard]
+
+    return_response = {"data": [tenant for _, _, tenant in page]}
+    if positions:
+        return_response["next_token"] = __encode_next_token(positions)
+    return return_response, HTTPStatus.OK
+
+
+@app.get("/tenants/changes")
+@tracer.capture_method
+def get_tenant_changes(
+    since: Annotated[Optional[str], Query(min_length=1)] = None,
+    limit: Annotated[Optional[int], Query(gt=0)] = 100,
+    fields: Annotated[Optional[str], Query(min_length=1)] = None,
+):
+    """
+    Return the tenants written after the cursor since, oldest first, with the
+    cursor to pass as since to read the changes after them. Without since,
+    every tenant written since updatedAt was introduced is returned.
+    """
+    logger.info("Request received to get tenant changes")
+    if not tenant_changes_index_name:
+        raise NotFoundError("The tenant change feed is not enabled")
+
+    # the cursor holds the index key of the last tenant returned from each
+    # shard, so tenants written at the same time are neither skipped nor
+    # returned twice
+    positions = __decode_next_token(since) if since else {}
+    shards = [__change_feed_partition(shard) for shard in range(CHANGE_FEED_SHARDS)]
+    if not isinstance(positions, dict) or not all(
+        shard in shards and __is_change_feed_position(position, shard)
+        for shard, position in positions.items()
+    ):
+        raise BadRequestError("Invalid since")
+
+    settled = (datetime.now(timezone.utc) - CHANGE_FEED_SETTLE_TIME).isoformat()
+    projection = __projection(fields, required=["tenantId", UPDATED_AT_COLUMN, CHANGE_FEED_COLUMN])
+    responses = []
+    try:
+        for shard in shards:
+            kwargs = {
+                "IndexName": tenant_changes_index_name,
+                "KeyConditionExpression": Key(CHANGE_FEED_COLUMN).eq(shard)
+                & Key(UPDATED_AT_COLUMN).lte(settled),
+                "Limit": limit,
+                **projection,
+            }
+            if shard in positions:
+                kwargs["ExclusiveStartKey"] = positions[shard]
+            responses.append(tenant_details_table.query(**kwargs))
+    except botocore.exceptions.ClientError as error:
+        logger.error(error)
+        raise InternalServerError("Unknown error during processing!")
+
+    # every shard is sorted by updatedAt, so the oldest limit changes are
+    # among the first limit of each shard
+    read = [response["Items"] for response in responses]
+    tenants = list(
+        islice(heapq.merge(*read, key=lambda tenant: tenant[UPDATED_AT_COLUMN]), limit)
+    )
+    for tenant in tenants:
+        positions[tenant[CHANGE_FEED_COLUMN]] = {
+            "tenantId": tenant["tenantId"],
+            CHANGE_FEED_COLUMN: tenant[CHANGE_FEED_COLUMN],
+            UPDATED_AT_COLUMN: tenant[UPDATED_AT_COLUMN],
+        }
+    has_more = len(tenants) < sum(len(items) for items in read) or any(
+        "LastEvaluatedKey" in response for response in responses
+    )
+    return {
+        "data": tenants,
+        "cursor": __encode_next_token(positions),
+        "has_more": has_more,
+    }, HTTPStatus.OK
+
+
+@app.get("/tenants/stats")
+@tracer.capture_method
+def get_tenant_stats():
+    """
+    Return the number of tenants, and the number of tenants per value of
+    the counted attributes, e.g. {"total": 3, "tier": {"basic": 2, ...}}.
+    """
+    logger.info("Request received to get tenant statistics")
+    try:
+        response = tenant_stats_table.get_item(Key={"statsId": STATS_ID})
+    except botocore.exceptions.ClientError as error:
+        logger.error(error)
+        raise InternalServerError("Unknown error during processing!")
+
+    stats = {"total": 0}
+    for counter, count in response.get("Item", {}).items():
+        if counter == "statsId":
+            continue
+        # counters of attribute values are named attribute#value
+        attribute, _, value = counter.partition("#")
+        if not value:
+            stats[attribute] = count
+        elif count:
+            stats.setdefault(attribute, {})[value] = count
+    return {"data": stats}, HTTPStatus.OK
+
+
+def __json_object_body():
+    try:
+        json_body = app.current_event.json_body
+    except ValueError:
+        raise BadRequestError("The request body must be a JSON object")
+    if not isinstance(json_body, dict):
+        raise BadRequestError("The request body must be a JSON object")
+    return json_body
+
+
+def __new_tenant(input_details):
+    input_details["tenantId"] = str(uuid.uuid4())
+    input_details["sbtaws_active"] = True
+    input_details[ACTIVE_LISTING_COLUMN] = __active_listing(input_details["tenantId"])
+    input_details[VERSION_COLUMN] = 1
+    input_details[UPDATED_AT_COLUMN] = datetime.now(timezone.utc).isoformat()
+    input_details[CHANGE_FEED_COLUMN] = __change_feed_shard(input_details["tenantId"])
+    return input_details
+
+
+def __change_feed_shard(tenantId):
+    # a tenant always stays in the same shard
+    return __change_feed_partition(zlib.crc32(tenantId.encode()) % CHANGE_FEED_SHARDS)
+
+
+def __change_feed_partition(shard):
+    return f"TENANTS#{shard}"
+
+
+def __is_change_feed_position(position, shard):
+    # a position is used as the ExclusiveStartKey of its shard's query, so it
+    # must be exactly an index key of that shard
+    return (
+        isinstance(position, dict)
+        and position.keys() == {"tenantId", CHANGE_FEED_COLUMN, UPDATED_AT_COLUMN}
+        and all(isinstance(value, str) for value in position.values())
+        and position[CHANGE_FEED_COLUMN] == shard
+    )
+
+
+def __tenant_filters(tier, tenantName):
+    # applied to the tenants read, tenantName is a prefix
+    filters = []
+    if tier:
+        filters.append(Attr("tier").eq(tier))
+    if tenantName:
+        filters.append(Attr("tenantName").begins_with(tenantName))
+    return filters
+
+
+def __active_listing(tenantId):
+    # a tenant is always listed in the same shard
+    return __active_listing_partition(zlib.crc32(tenantId.encode()) % ACTIVE_LISTING_SHARDS)
+
+
+def __active_listing_partition(shard):
+    return f"ACTIVE#{shard}"
+
+
+def __is_active_listing_position(position, shard):
+    # a position is used as the ExclusiveStartKey of its shard's query, so it
+    # must be exactly an index key of that shard
+    return (
+        isinstance(position, dict)
+        and position.keys() == {"tenantId", ACTIVE_LISTING_COLUMN}
+        and isinstance(position["tenantId"], str)
+        and position[ACTIVE_LISTING_COLUMN] == shard
+    )
+
+
+def __projection(fields, required=("tenantId",)):
+    """
+    Return the ProjectionExpression arguments that read only the comma
+    separated top-level attributes in fields (and the required ones), or
+    nothing when it is not set.
+    """
+    if not fields:
+        return {}
+
+    # the tenantId is always read, so that a tenant without any of the
+    # fields is still found
+    names = list(required)
+    for field in fields.split(","):
+        field = field.strip()
+        if not field:
+            raise BadRequestError("Invalid fields")
+        if field not in names:
+            names.append(field)
+
+    # attribute names are passed as placeholders, as they may be reserved words
+    return {
+        "ProjectionExpression": ", ".join(f"#f{index}" for index in range(len(names))),
+        "ExpressionAttributeNames": {f"#f{index}": name for index, name in enumerate(names)},
+    }
+
+
+def __encode_next_token(last_evaluated_key):
+    # index queries stop at a key that includes the index's key attributes,
+    # so the whole key is handed out as an opaque token
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode()).decode()
+
+
+def __decode_next_token(next_token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(next_token.encode()))
+    except (binascii.Error, ValueError):
+        raise BadRequestError("Invalid next_token")
+
+
 @app.get("/tenants/<tenantId>")
 @tracer.capture_method
-def get_tenant(tenantId: Annotated[str, Path(min_length=0)]):
+def get_tenant(
+    tenantId: Annotated[str, Path(min_length=0)],
+    fields: Annotated[Optional[str], Query(min_length=1)] = None,
+):
     logger.info(f"Request received to get a tenant: {tenantId}")
     tenant = None
     try:
-        response = tenant_details_table.get_item(Key={"tenantId": tenantId})
+        response = tenant_details_table.get_item(
+            Key={"tenantId": tenantId},
+            **__projection(fields, required=["tenantId", VERSION_COLUMN]),
+        )
         tenant = response.get("Item")
         if not tenant:
             raise NotFoundError(f"Tenant not found for id {tenantId}")
@@ -95,26 +546,36 @@ def get_tenant(tenantId: Annotated[str, Path(min_length=0)]):
         logger.error(error)
         raise InternalServerError("Unknown error during processing!")
     else:
-        return {"data": tenant}, HTTPStatus.OK
+        version = tenant.get(VERSION_COLUMN, 0)
+        # pollers that already have this version get an empty response
+        if_none_match = app.current_event.get_header_value("If-None-Match")
+        if if_none_match and __matches(if_none_match, version):
+            return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={"ETag": __etag(version)})
+        return __tenant_response(tenant, HTTPStatus.OK)
 
 
 @app.put("/tenants/<tenantId>")
 @tracer.capture_method
 def update_tenant(tenantId: Annotated[str, Path(min_length=0)]):
     logger.info("Request received to update a tenant")
-    input_details = app.current_event.json_body
+    input_details = __json_object_body()
     updated_tenant = None
     try:
-        response = __update_tenant(tenantId, input_details)
+        response = __update_tenant(
+            tenantId, input_details, app.current_event.get_header_value("If-Match")
+        )
         updated_tenant = response["Attributes"]
-    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
-        logger.info(f"received request to update non-existing tenant {tenantId}")
-        raise NotFoundError(f"Tenant {tenantId} not found.")
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException as error:
+        __raise_condition_failed(tenantId, error)
     except botocore.exceptions.ClientError as error:
+        # e.g. a dotted key such as tenantConfig.plan whose map does not exist
+        if error.response["Error"]["Code"] == "ValidationException":
+            logger.info(f"received invalid update for tenant {tenantId}: {error}")
+            raise BadRequestError(f"Invalid update: {error.response['Error']['Message']}")
         logger.error(error)
         raise InternalServerError("Unknown error during processing!")
     else:
-        return {"data": updated_tenant}, HTTPStatus.OK
+        return __tenant_response(updated_tenant, HTTPStatus.OK)
 
 
 @app.delete("/tenants/<tenantId>")
@@ -124,44 +585,119 @@ def delete_tenant(tenantId: Annotated[str, Path(min_length=0)]):
     deleted_tenant = None
 
     try:
-        response = __update_tenant(tenantId, {"sbtaws_active": False})
+        response = __update_tenant(
+            tenantId,
+            {"sbtaws_active": False},
+            app.current_event.get_header_value("If-Match"),
+        )
         deleted_tenant = response["Attributes"]
-    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
-        logger.info(f"received request to update non-existing tenant {tenantId}")
-        raise NotFoundError(f"Tenant {tenantId} not found.")
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException as error:
+        __raise_condition_failed(tenantId, error)
     except botocore.exceptions.ClientError as error:
         logger.error(error)
         raise InternalServerError("Unknown error during processing!")
     else:
-        return {"data": deleted_tenant}, HTTPStatus.OK
-
-
-def __update_tenant(tenantId, tenant):
-    # Remove the tenantId if the incoming object has one
-    input_details = {key: tenant[key] for key in tenant if key != "tenantId"}
-    update_expression = []
-    update_expression.append("set ")
-    expression_attribute_values = {}
-    for key, value in input_details.items():
-        key_variable = f":{key}Variable"
-        update_expression.append("".join([key, " = ", key_variable]))
-        update_expression.append(",")
-        expression_attribute_values[key_variable] = value
-
-    # remove the last comma
-    update_expression.pop()
-
-    return tenant_details_table.update_item(
-        Key={
-            "tenantId": tenantId,
-        },
-        ConditionExpression=Attr("tenantId").eq(tenantId),
-        UpdateExpression="".join(update_expression),
-        ExpressionAttributeValues=expression_attribute_values,
-        ReturnValues="ALL_NEW",
+        return __tenant_response(deleted_tenant, HTTPStatus.OK)
+
+
+def __etag(version):
+    return f'"{version}"'
+
+
+def __parse_etags(header):
+    """Return the versions listed in an If-Match or If-None-Match header, or None for *."""
+    if header.strip() == "*":
+        return None
+    versions = set()
+    for etag in header.split(","):
+        etag = etag.strip().removeprefix("W/").strip('"')
+        # ETags of other representations can never match a version
+        if etag.isdigit():
+            versions.add(int(etag))
+    return versions
+
+
+def __matches(header, version):
+    versions = __parse_etags(header)
+    return versions is None or version in versions
+
+
+def __tenant_response(tenant, status_code):
+    return Response(
+        status_code=status_code,
+        content_type=content_types.APPLICATION_JSON,
+        body={"data": tenant},
+        headers={"ETag": __etag(tenant.get(VERSION_COLUMN, 0))},
     )
 
 
+def __raise_condition_failed(tenantId, error):
+    # the tenant as it was is returned when it exists but has another version
+    if "Item" not in error.response:
+        logger.info(f"received request to update non-existing tenant {tenantId}")
+        raise NotFoundError(f"Tenant {tenantId} not found.")
+    logger.info(f"received request to update tenant {tenantId} with an outdated version")
+    raise ServiceError(HTTPStatus.PRECONDITION_FAILED, f"Tenant {tenantId} has changed.")
+
+
+def __update_tenant(tenantId, tenant, if_match=None):
+    # Remove the tenantId (and the attributes only written here, such as the
+    # index keys) if the incoming object has one
+    managed = ("tenantId", VERSION_COLUMN, UPDATED_AT_COLUMN, CHANGE_FEED_COLUMN, ACTIVE_LISTING_COLUMN)
+    input_details = {key: value for key, value in tenant.items() if key not in managed}
+    input_details[UPDATED_AT_COLUMN] = datetime.now(timezone.utc).isoformat()
+    # tenants created before the change feed join it on their next write
+    input_details[CHANGE_FEED_COLUMN] = __change_feed_shard(tenantId)
+    remove_listing = False
+    if "sbtaws_active" in input_details:
+        # keep the tenant in the active tenants index only while it is active
+        if input_details["sbtaws_active"]:
+            input_details[ACTIVE_LISTING_COLUMN] = __active_listing(tenantId)
+        else:
+            remove_listing = True
+
+    # The update is built from the tenant as it is, so that only the
+    # attributes (and attributes of maps) that change are written, and it is
+    # only applied if the tenant has not changed since it was read. A tenant
+    # that changed in between is read again.
+    for attempt in range(MAX_UPDATE_ATTEMPTS):
+        current = tenant_details_table.get_item(Key={"tenantId": tenantId}, ConsistentRead=True).get("Item")
+        if current is None:
+            logger.info(f"received request to update non-existing tenant {tenantId}")
+            raise NotFoundError(f"Tenant {tenantId} not found.")
+        version = current.get(VERSION_COLUMN, 0)
+        if if_match and not __matches(if_match, version):
+            logger.info(f"received request to update tenant {tenantId} with an outdated version")
+            raise ServiceError(HTTPStatus.PRECONDITION_FAILED, f"Tenant {tenantId} has changed.")
+        # tenants listed before the index was sharded move to their shard
+        # on their next write
+        if ACTIVE_LISTING_COLUMN in current and not remove_listing:
+            input_details[ACTIVE_LISTING_COLUMN] = __active_listing(tenantId)
+
+        # dotted keys such as tenantConfig.plan update one attribute of a map
+        update = build_update(
+            input_details,
+            remove=[ACTIVE_LISTING_COLUMN] if remove_listing else [],
+            add={VERSION_COLUMN: 1},
+            current=current,
+        )
+        unchanged = Attr(VERSION_COLUMN).eq(version) if version else Attr(VERSION_COLUMN).not_exists()
+        try:
+            return tenant_details_table.update_item(
+                Key={
+                    "tenantId": tenantId,
+                },
+                ConditionExpression=Attr("tenantId").eq(tenantId) & unchanged,
+                ReturnValues="ALL_NEW",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                **update,
+            )
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException as error:
+            if "Item" not in error.response or attempt + 1 == MAX_UPDATE_ATTEMPTS:
+                raise
+            time.sleep(random.uniform(0, BASE_RETRY_DELAY * 2**attempt))
+
+
 @logger.inject_lambda_context(
     correlation_id_path=correlation_paths.API_GATEWAY_HTTP, log_event=True
 )
@@ -0,0 +1,92 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+from collections import Counter
+from decimal import Decimal
+
+import boto3
+from aws_lambda_powertools import Logger, Tracer
+from aws_lambda_powertools.utilities.data_classes import DynamoDBStreamEvent
+from aws_lambda_powertools.utilities.typing import LambdaContext
+
+tracer = Tracer()
+logger = Logger()
+
+dynamodb = boto3.resource("dynamodb")
+tenant_details_table = dynamodb.Table(os.environ["TENANT_DETAILS_TABLE"])
+tenant_stats_table = dynamodb.Table(os.environ["TENANT_STATS_TABLE"])
+# all counters are attributes of a single item, so they are read with one
+# GetItem and every batch of changes is applied with one UpdateItem
+STATS_ID = "TENANTS"
+TOTAL_COUNTER = "total"
+# tenants are counted per value of each of these attributes, in counters
+# named e.g. tier#basic
+COUNTED_ATTRIBUTES = ("sbtaws_active", "tier", "status")
+
+
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def handler(event: dict, context: LambdaContext):
+    """
+    Keep the tenant counters up to date with the changes on the tenant
+    table's stream. Invoked with {"rebuild": true} instead, the counters are
+    recounted from a scan of the table, e.g. for tenants created before the
+    counters existed; tenants should not be written while that runs.
+    """
+    if event.get("rebuild"):
+        return rebuild()
+
+    deltas = Counter()
+    for record in DynamoDBStreamEvent(event).records:
+        deltas.subtract(counters(record.dynamodb.old_image))
+        deltas.update(counters(record.dynamodb.new_image))
+
+    # updates that change no counted attribute cancel out
+    deltas = {counter: delta for counter, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    # the whole batch is applied at once, so a retried batch is only counted
+    # twice if it fails after this call
+    tenant_stats_table.update_item(
+        Key={"statsId": STATS_ID},
+        UpdateExpression="ADD " + ", ".join(f"#c{index} :c{index}" for index in range(len(deltas))),
+        ExpressionAttributeNames={f"#c{index}": counter for index, counter in enumerate(deltas)},
+        ExpressionAttributeValues={f":c{index}": delta for index, delta in enumerate(deltas.values())},
+    )
+    logger.info("Updated tenant counters", extra={"deltas": deltas})
+
+
+def rebuild():
+    totals = Counter()
+    attributes = ("tenantId", *COUNTED_ATTRIBUTES)
+    scan_kwargs = {
+        "ProjectionExpression": ", ".join(f"#a{index}" for index in range(len(attributes))),
+        "ExpressionAttributeNames": {f"#a{index}": attribute for index, attribute in enumerate(attributes)},
+    }
+    while True:
+        response = tenant_details_table.scan(**scan_kwargs)
+        for tenant in response["Items"]:
+            totals.update(counters(tenant))
+        if "LastEvaluatedKey" not in response:
+            break
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    tenant_stats_table.put_item(Item={"statsId": STATS_ID, TOTAL_COUNTER: 0, **totals})
+    logger.info("Rebuilt tenant counters", extra={"counters": totals})
+    return dict(totals)
+
+
+def counters(tenant):
+    """Return the counters a tenant is counted in, none for no tenant."""
+    if not tenant:
+        return []
+    names = [TOTAL_COUNTER]
+    for attribute in COUNTED_ATTRIBUTES:
+        value = tenant.get(attribute)
+        if isinstance(value, bool):
+            names.append(f"{attribute}#{str(value).lower()}")
+        elif isinstance(value, (str, Decimal)):
+            names.append(f"{attribute}#{value}")
+    return names
@@ -5,7 +5,6 @@ from http import HTTPStatus
 from boto3.dynamodb.conditions import Attr
 from aws_lambda_powertools import Logger, Tracer
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from aws_requests_auth.boto_utils import BotoAWSRequestsAuth
 from aws_lambda_powertools.event_handler import APIGatewayHttpResolver
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.event_handler.openapi.params import Query, Path
@@ -15,6 +14,8 @@ from aws_lambda_powertools.event_handler.exceptions import (
     NotFoundError,
 )
 from typing import Optional
+from signed_client import SignedApiClient
+from update_expression import build_update
 import requests
 import uuid
 import json
@@ -31,15 +32,22 @@ event_source = os.environ["EVENT_SOURCE"]
 onboarding_detail_type = os.environ["ONBOARDING_DETAIL_TYPE"]
 offboarding_detail_type = os.environ["OFFBOARDING_DETAIL_TYPE"]
 
-tenant_api_url = os.environ["TENANT_API_URL"]
-auth = BotoAWSRequestsAuth(
-    # '${API_ID}.execute-api.${REGION}.amazonaws.com'
-    aws_host=tenant_api_url.split("/")[-2],
-    aws_region=os.environ["AWS_REGION"],
-    aws_service="execute-api",
+# created once per execution environment, so warm invocations reuse its
+# connections to the tenant API
+tenant_api = SignedApiClient(
+    os.environ["TENANT_API_URL"],
+    os.environ["AWS_REGION"],
+    metrics_namespace=os.environ.get("SERVICE_NAME"),
 )
 
 
+@app.exception_handler(requests.exceptions.RequestException)
+def handle_tenant_api_error(error: requests.exceptions.RequestException):
+    # the tenant API could not be reached, or did not answer in time
+    logger.error(f"Error calling the tenant API: {str(error)}")
+    raise InternalServerError("Unknown error during processing!")
+
+
 @app.post("/tenant-registrations")
 @tracer.capture_method
 def create_tenant_registration():
@@ -64,7 +72,7 @@ def create_tenant_registration():
         logger.error(f"Error creating tenant registration: {str(e)}")
         raise InternalServerError("Unknown error during processing!")
 
-    response = requests.post(f"{tenant_api_url}tenants", json=tenant_data, auth=auth)
+    response = tenant_api.post("tenants", json=tenant_data)
     if response.status_code != HTTPStatus.CREATED:
         raise InternalServerError("Failed to create tenant")
 
@@ -166,10 +174,8 @@ def update_tenant_registration(
             tenant_registration = tenant_registration_response["Attributes"]
 
         if update_data.get("tenantData", {}) != {}:
-            update_response = requests.put(
-                f"{tenant_api_url}tenants/{tenant_id}",
-                json=update_data.get("tenantData"),
-                auth=auth,
+            update_response = tenant_api.put(
+                f"tenants/{tenant_id}", json=update_data.get("tenantData")
             )
             tenant = update_response.json()
             if update_response.status_code != 200:
@@ -206,9 +212,7 @@ def delete_tenant_registration(
         if not tenant_id:
             raise NotFoundError("Tenant ID not found for this registration")
 
-        delete_response = requests.delete(
-            f"{tenant_api_url}tenants/{tenant_id}", auth=auth
-        )
+        delete_response = tenant_api.delete(f"tenants/{tenant_id}")
         if delete_response.status_code != 200:
             raise InternalServerError("Failed to delete tenant")
 
@@ -217,6 +221,7 @@ def delete_tenant_registration(
             {
                 "sbtaws_active": False,
             },
+            current=response["Item"],
         )
 
         __create_control_plane_event(
@@ -232,18 +237,17 @@ def delete_tenant_registration(
         raise InternalServerError("Unknown error during processing!")
 
 
-def __update_tenant_registration(tenant_registration_id, update_data):
-    update_expression = "SET " + ", ".join(f"#{k}=:{k}" for k in update_data.keys())
-    expression_attribute_names = {f"#{k}": k for k in update_data.keys()}
-    expression_attribute_values = {f":{k}": v for k, v in update_data.items()}
+def __update_tenant_registration(tenant_registration_id, update_data, current=None):
+    # with the current registration, only the values that changed are written
+    update = build_update(update_data, current=current)
+    if update is None:
+        return {"Attributes": current}
 
     return tenant_registration_table.update_item(
         Key={"tenantRegistrationId": tenant_registration_id},
-        UpdateExpression=update_expression,
-        ExpressionAttributeNames=expression_attribute_names,
-        ExpressionAttributeValues=expression_attribute_values,
         ConditionExpression=Attr("tenantRegistrationId").exists(),
         ReturnValues="ALL_NEW",
+        **update,
     )
 
 
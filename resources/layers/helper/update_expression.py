@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from functools import lru_cache
+
+# boto3 names the placeholders of the condition expressions it builds #n0
+# and :v0, so these use a prefix of their own
+NAME_PLACEHOLDER = "#upd"
+VALUE_PLACEHOLDER = ":upd"
+_MISSING = object()
+
+
+def build_update(set_values=None, remove=(), add=None, current=None):
+    """
+    Return the UpdateExpression, ExpressionAttributeNames and
+    ExpressionAttributeValues arguments of an update_item call that sets the
+    attributes in set_values, removes the attributes in remove and adds the
+    numbers in add to the attributes they name. Attributes are named by
+    paths: a dotted path such as tenantConfig.plan is an attribute of a map,
+    which must already exist, and a tuple of names such as
+    ("tenantConfig", "example.com") is one whose names may contain dots.
+
+    Given the current item, values it already has are skipped and maps it
+    already has are updated attribute by attribute, which still leaves them
+    equal to the values set. Returns None when there is nothing to update.
+    """
+    set_values = {_path(path): value for path, value in (set_values or {}).items()}
+    remove = [_path(path) for path in remove]
+    add = {_path(path): value for path, value in (add or {}).items()}
+    if current is not None:
+        set_values, removed = _changed_values(set_values, current)
+        remove = [path for path in remove if _get_path(current, path) is not _MISSING] + removed
+    if not (set_values or remove or add):
+        return None
+
+    expression, names = _expression(tuple(set_values), tuple(remove), tuple(add))
+    update = {"UpdateExpression": expression, "ExpressionAttributeNames": dict(names)}
+    values = [*set_values.values(), *add.values()]
+    if values:
+        update["ExpressionAttributeValues"] = {
+            f"{VALUE_PLACEHOLDER}{index}": value for index, value in enumerate(values)
+        }
+    return update
+
+
+def _path(path):
+    """Return a path as the tuple of the names of its attributes."""
+    return tuple(path) if isinstance(path, tuple) else tuple(path.split("."))
+
+
+@lru_cache(maxsize=256)
+def _expression(set_paths, remove_paths, add_paths):
+    # the expression only depends on the paths, so it is built once for
+    # every shape of update a function makes
+    names = {}
+
+    def placeholder(path):
+        # every name gets a placeholder of its own, so names may hold any
+        # character, dots included
+        parts = []
+        for name in path:
+            if name not in names:
+                names[name] = f"{NAME_PLACEHOLDER}{len(names)}"
+            parts.append(names[name])
+        return ".".join(parts)
+
+    clauses = []
+    if set_paths:
+        clauses.append(
+            "SET "
+            + ", ".join(
+                f"{placeholder(path)} = {VALUE_PLACEHOLDER}{index}"
+                for index, path in enumerate(set_paths)
+            )
+        )
+    if remove_paths:
+        clauses.append("REMOVE " + ", ".join(placeholder(path) for path in remove_paths))
+    if add_paths:
+        clauses.append(
+            "ADD "
+            + ", ".join(
+                f"{placeholder(path)} {VALUE_PLACEHOLDER}{index}"
+                for index, path in enumerate(add_paths, start=len(set_paths))
+            )
+        )
+    return " ".join(clauses), {name_placeholder: name for name, name_placeholder in names.items()}
+
+
+def _changed_values(set_values, current):
+    """Return the paths of set_values to set and to remove to update current."""
+    changed = {}
+    removed = []
+    for path, value in set_values.items():
+        current_value = _get_path(current, path)
+        if current_value == value:
+            continue
+        if isinstance(value, dict) and isinstance(current_value, dict):
+            # only the attributes of the map that changed are set, and the
+            # ones it no longer has removed
+            map_changed, map_removed = _changed_values(
+                {(*path, key): item for key, item in value.items()}, current
+            )
+            changed.update(map_changed)
+            removed += map_removed + [(*path, key) for key in current_value if key not in value]
+        else:
+            changed[path] = value
+    return changed, removed
+
+
+def _get_path(item, path):
+    for name in path:
+        if not isinstance(item, dict) or name not in item:
+            return _MISSING
+        item = item[name]
+    return item
@@ -13,7 +13,7 @@
 
 import { Schedule } from 'aws-cdk-lib/aws-events';
 import { IFunction } from 'aws-cdk-lib/aws-lambda';
-import { IASyncFunction } from '../../utils';
+import { IASyncFunction, ISyncFunction } from '../../utils';
 import { IDataIngestorAggregator } from '../ingestor-aggregator/ingestor-aggregator-interface';
 
 /**
@@ -94,6 +94,13 @@ export interface IBilling {
    */
   putUsageFunction?: IFunctionSchedule;
 
+  /**
+   * The function responsible for fetching the billed usage of a tenant,
+   * per billing period or rolled up per month or year.
+   * -- GET /billing/usage/{tenantId}
+   */
+  fetchUsageFunction?: ISyncFunction; // use 'fetch*' instead of 'get*' to avoid error JSII5000
+
   /**
    * The function to trigger when a webhook request is received.
    * -- POST /billing/{$webhookPath}
@@ -13,13 +13,20 @@
 
 import * as cdk from 'aws-cdk-lib';
 import * as apigatewayV2 from 'aws-cdk-lib/aws-apigatewayv2';
+import * as apigatewayV2Authorizers from 'aws-cdk-lib/aws-apigatewayv2-authorizers';
 import * as apigatewayV2Integrations from 'aws-cdk-lib/aws-apigatewayv2-integrations';
 import * as events from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 import { NagSuppressions } from 'cdk-nag';
 import { Construct } from 'constructs';
 import { IBilling } from './billing-interface';
-import { IEventManager, addTemplateTag } from '../../utils';
+import {
+  IEventManager,
+  IRoute,
+  addTemplateTag,
+  createAsyncFunctionTarget,
+  generateRoutes,
+} from '../../utils';
 
 /**
  * Encapsulates the list of properties for a BillingProvider.
@@ -40,13 +47,20 @@ export interface BillingProviderProps {
    * when setting up API endpoints.
    */
   readonly controlPlaneAPI: apigatewayV2.HttpApi;
+
+  /**
+   * The authorizer of the BillingProvider's API endpoints, other than the webhook.
+   * @default - the endpoints are authorized with IAM
+   */
+  readonly authorizer?: apigatewayV2.IHttpRouteAuthorizer;
 }
 
 /**
  * Represents a Billing Provider that handles billing-related operations.
  *
  * This construct sets up event targets for various billing-related events
- * and optionally creates an API Gateway resource for a webhook function.
+ * and optionally creates API Gateway resources for a webhook function and
+ * for fetching usage.
  */
 export class BillingProvider extends Construct {
   /**
@@ -87,7 +101,7 @@ export class BillingProvider extends Construct {
       if (target.functionDefinition?.handler) {
         props.eventManager.addTargetToEvent(this, {
           eventDefinition: target.functionDefinition?.trigger || target.defaultFunctionTrigger,
-          target: new targets.LambdaFunction(target.functionDefinition?.handler),
+          target: createAsyncFunctionTarget(target.functionDefinition),
         });
       }
     });
@@ -107,6 +121,25 @@ export class BillingProvider extends Construct {
       });
     }
 
+    if (props.billing.fetchUsageFunction) {
+      const routes: IRoute[] = [
+        {
+          path: '/billing/usage/{tenantId}',
+          method: apigatewayV2.HttpMethod.GET,
+          integration: new apigatewayV2Integrations.HttpLambdaIntegration(
+            'fetchBillingUsageHttpLambdaIntegration',
+            props.billing.fetchUsageFunction.handler
+          ),
+          scope: props.billing.fetchUsageFunction.scope,
+        },
+      ];
+      generateRoutes(
+        props.controlPlaneAPI,
+        routes,
+        props.authorizer ?? new apigatewayV2Authorizers.HttpIamAuthorizer()
+      );
+    }
+
     if (props.billing.webhookFunction) {
       this.controlPlaneAPIBillingWebhookResourcePath = `/billing/${props.billing.webhookFunction.path}`;
 
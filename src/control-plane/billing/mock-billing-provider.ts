@@ -15,24 +15,84 @@ import * as path from 'path';
 import * as lambda_python from '@aws-cdk/aws-lambda-python-alpha';
 import * as cdk from 'aws-cdk-lib';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
+import * as iam from 'aws-cdk-lib/aws-iam';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
 import { Architecture } from 'aws-cdk-lib/aws-lambda';
+import * as lambda_event_sources from 'aws-cdk-lib/aws-lambda-event-sources';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
 import { NagSuppressions } from 'cdk-nag';
 import { Construct } from 'constructs';
 import { IBilling, IFunctionSchedule } from './billing-interface';
-import { IASyncFunction } from '../../utils';
-import { FirehoseAggregator, IDataIngestorAggregator } from '../ingestor-aggregator';
+import { IASyncFunction, ISyncFunction } from '../../utils';
+import { FirehoseAggregator, IDataIngestorAggregator, UsageWindow } from '../ingestor-aggregator';
+
+/**
+ * Encapsulates the list of properties for a MockBillingProvider construct.
+ */
+export interface MockBillingProviderProps {
+  /**
+   * The number of items the usage of a very active tenant is spread over
+   * in the ingestor's data table. The PutUsage function merges them.
+   * Must be an integer from 1 to 96.
+   * @default - usage is not sharded
+   */
+  readonly shardCount?: number;
+
+  /**
+   * The number of usage records a tenant must have in a single checkpoint of an
+   * ingested s3 object before its usage is sharded. Only used when shardCount is set.
+   * @default 1000
+   */
+  readonly shardThreshold?: number;
+
+  /**
+   * The length of the windows tenant usage is aggregated and billed in. When set,
+   * ingested records must have a `timestamp` (epoch seconds or milliseconds, or an
+   * ISO 8601 string) and the PutUsage function writes one billing record per tenant
+   * and ended window, with the window as its billingPeriod. Windows that ended in the
+   * last 48 hours are billed again on every run so that late records are included.
+   * @default - usage is aggregated and billed per run of the PutUsage function
+   */
+  readonly usageWindow?: UsageWindow;
+
+  /**
+   * The number of segments the PutUsage function splits its scan of the ingestor's
+   * data table into. Segments are scanned and billed in parallel, which shortens
+   * the billing run on tables with many tenants. Not used when usageWindow is set.
+   * @default 1
+   */
+  readonly scanSegments?: number;
+
+  /**
+   * When set, the PutUsage function only bills tenants whose usage changed since
+   * they were last billed, instead of scanning all of the ingestor's data. Changed
+   * tenants are tracked from the data table's DynamoDB stream, so usage already in
+   * the table when this is turned on is only billed once the tenant's usage changes.
+   * Not used when usageWindow is set.
+   * @default false
+   */
+  readonly incrementalBilling?: boolean;
+
+  /**
+   * When set, onboarding and offboarding events are buffered in SQS queues and
+   * the CreateCustomer and DeleteCustomer functions process up to this many of
+   * them per invocation. Events that fail are retried on their own.
+   * @default - every event invokes its function directly
+   */
+  readonly customerBatchSize?: number;
+}
 
 export class MockBillingProvider extends Construct implements IBilling {
   public createCustomerFunction: IASyncFunction;
   public deleteCustomerFunction: IASyncFunction;
   public ingestor?: IDataIngestorAggregator;
   public putUsageFunction?: IFunctionSchedule;
+  public fetchUsageFunction?: ISyncFunction;
   private billingTable: dynamodb.Table;
   private customersTable: dynamodb.Table;
   private lambdaPowertoolsLayer: lambda.ILayerVersion;
 
-  constructor(scope: Construct, id: string) {
+  constructor(scope: Construct, id: string, props?: MockBillingProviderProps) {
     super(scope, id);
 
     // Create DynamoDB table for billing records
@@ -76,6 +136,15 @@ export class MockBillingProvider extends Construct implements IBilling {
       aggregateKeyPath: 'metric.name',
       aggregateValuePath: 'metric.value',
       autoDeleteObjects: true,
+      shardCount: props?.shardCount,
+      shardThreshold: props?.shardThreshold,
+      ...(props?.incrementalBilling && {
+        dataRepositoryStream: dynamodb.StreamViewType.NEW_IMAGE,
+      }),
+      ...(props?.usageWindow && {
+        timestampPath: 'timestamp',
+        usageWindow: props.usageWindow,
+      }),
     });
 
     new cdk.CfnOutput(this, 'IngestorTableName', {
@@ -90,18 +159,76 @@ export class MockBillingProvider extends Construct implements IBilling {
     );
 
     // Create Lambda functions
-    this.createCustomerFunction = {
-      handler: this.createPythonFunction('CreateCustomer', 'create-customer'),
-    };
+    this.createCustomerFunction = this.createCustomerHandler(
+      'CreateCustomer',
+      'create-customer',
+      {},
+      props?.customerBatchSize
+    );
 
-    this.deleteCustomerFunction = {
-      handler: this.createPythonFunction('DeleteCustomer', 'delete-customer', {
-        TENANT_INDEX_NAME: tenantIndexName,
-      }),
-    };
+    this.deleteCustomerFunction = this.createCustomerHandler(
+      'DeleteCustomer',
+      'delete-customer',
+      { TENANT_INDEX_NAME: tenantIndexName },
+      props?.customerBatchSize
+    );
+
+    // Tenants whose usage changed since they were last billed, tracked from the
+    // ingestor's data stream so that the PutUsage function only visits those.
+    let dirtyTenantsTable: dynamodb.Table | undefined;
+    if (props?.incrementalBilling) {
+      dirtyTenantsTable = new dynamodb.Table(this, 'DirtyTenantsTable', {
+        partitionKey: { name: 'tenantId', type: dynamodb.AttributeType.STRING },
+        billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+        pointInTimeRecoverySpecification: {
+          pointInTimeRecoveryEnabled: true,
+        },
+      });
+
+      const trackUsageHandler = this.createPythonFunction('TrackUsage', 'track-usage', {
+        DIRTY_TENANTS_TABLE: dirtyTenantsTable.tableName,
+      });
+      trackUsageHandler.addEventSource(
+        new lambda_event_sources.DynamoEventSource(this.ingestor.dataRepository, {
+          startingPosition: lambda.StartingPosition.TRIM_HORIZON,
+          batchSize: 1000,
+          maxBatchingWindow: cdk.Duration.seconds(10),
+          // items removed by the PutUsage function do not need tracking
+          filters: [
+            lambda.FilterCriteria.filter({ eventName: lambda.FilterRule.or('INSERT', 'MODIFY') }),
+          ],
+        })
+      );
+      dirtyTenantsTable.grantReadWriteData(trackUsageHandler);
+
+      NagSuppressions.addResourceSuppressions(
+        trackUsageHandler,
+        [
+          {
+            id: 'AwsSolutions-IAM5',
+            reason: 'dynamodb:ListStreams does not support resource-level permissions.',
+            appliesTo: ['Resource::*'],
+          },
+        ],
+        true
+      );
+    }
 
     // Create PutUsage function
-    const putUsageHandler = this.createPythonFunction('PutUsage', 'put-usage');
+    const putUsageHandler = this.createPythonFunction('PutUsage', 'put-usage', {
+      ...(dirtyTenantsTable && { DIRTY_TENANTS_TABLE: dirtyTenantsTable.tableName }),
+      ...(props?.shardCount && { SHARD_COUNT: props.shardCount.toString() }),
+      ...(props?.usageWindow && { USAGE_WINDOW: props.usageWindow }),
+      ...(props?.scanSegments && { SCAN_SEGMENTS: props.scanSegments.toString() }),
+    });
+
+    // A billing run that is about to time out continues in a follow-up invocation.
+    // The permission is granted by the function's resource policy, as granting it
+    // through the function's own role would make the role depend on the function.
+    putUsageHandler.addPermission('ContinueBillingRun', {
+      principal: new iam.ArnPrincipal(putUsageHandler.role!.roleArn),
+      action: 'lambda:InvokeFunction',
+    });
 
     new cdk.CfnOutput(this, 'PutUsageFunctionName', {
       value: putUsageHandler.functionName,
@@ -112,6 +239,14 @@ export class MockBillingProvider extends Construct implements IBilling {
       schedule: cdk.aws_events.Schedule.rate(cdk.Duration.hours(24)),
     };
 
+    // Create FetchUsage function, which reads back billing records and their rollups.
+    // Billing records are named by their usage window if there is one.
+    this.fetchUsageFunction = {
+      handler: this.createPythonFunction('FetchUsage', 'fetch-usage', {
+        ...(props?.usageWindow && { USAGE_WINDOW: props.usageWindow }),
+      }),
+    };
+
     // Grant permissions
     this.customersTable.grantReadWriteData(this.createCustomerFunction.handler);
     this.customersTable.grantReadWriteData(this.deleteCustomerFunction.handler);
@@ -132,6 +267,60 @@ export class MockBillingProvider extends Construct implements IBilling {
 
     this.billingTable.grantReadWriteData(putUsageHandler);
     this.ingestor.dataRepository.grantReadWriteData(putUsageHandler);
+    dirtyTenantsTable?.grantReadWriteData(putUsageHandler);
+    this.billingTable.grantReadData(this.fetchUsageFunction.handler);
+
+    if (props?.usageWindow) {
+      NagSuppressions.addResourceSuppressions(
+        putUsageHandler,
+        [
+          {
+            id: 'AwsSolutions-IAM5',
+            reason: 'grantReadWriteData grants access to all indices for table.',
+            appliesTo: [
+              `Resource::<${cdk.Stack.of(this).getLogicalId(this.ingestor.dataRepository.node.defaultChild as dynamodb.CfnTable)}.Arn>/index/*`,
+            ],
+          },
+        ],
+        true
+      );
+    }
+  }
+
+  /**
+   * Creates a function handling onboarding or offboarding events. With a batch
+   * size, the events are buffered in a queue that the function consumes in batches.
+   */
+  private createCustomerHandler(
+    id: string,
+    entry: string,
+    additionalEnv: Record<string, string>,
+    batchSize?: number
+  ): IASyncFunction {
+    const handler = this.createPythonFunction(id, entry, additionalEnv);
+    if (!batchSize) {
+      return { handler };
+    }
+
+    const queue = new sqs.Queue(this, `${id}Queue`, {
+      enforceSSL: true,
+      // at least six times the function timeout, as recommended for event sources
+      visibilityTimeout: cdk.Duration.minutes(30),
+      deadLetterQueue: {
+        maxReceiveCount: 5,
+        queue: new sqs.Queue(this, `${id}DLQ`, {
+          enforceSSL: true,
+        }),
+      },
+    });
+    handler.addEventSource(
+      new lambda_event_sources.SqsEventSource(queue, {
+        batchSize,
+        maxBatchingWindow: cdk.Duration.seconds(5),
+        reportBatchItemFailures: true,
+      })
+    );
+    return { handler, queue };
   }
 
   private createPythonFunction(
@@ -13,6 +13,7 @@
 
 import * as cdk from 'aws-cdk-lib';
 import { CorsPreflightOptions } from 'aws-cdk-lib/aws-apigatewayv2';
+import { IBucket } from 'aws-cdk-lib/aws-s3';
 import { NagSuppressions } from 'cdk-nag';
 import { Construct } from 'constructs';
 import { IAuth } from './auth/auth-interface';
@@ -77,6 +78,24 @@ export interface ControlPlaneProps {
    * Settings for Cors Configuration for the ControlPlane API.
    */
   readonly apiCorsConfig?: CorsPreflightOptions;
+
+  /**
+   * The bucket that exports of the tenant details are written to. When set, a
+   * tenant export function is created that writes every tenant to the bucket as
+   * NDJSON (optionally gzip compressed) and returns the manifest of the export.
+   * @default - no tenant export function is created
+   */
+  readonly tenantExportBucket?: IBucket;
+
+  /**
+   * If true, the tenant change feed is served at GET /tenants/changes, backed by a
+   * new global secondary index on the tenant details table. CloudFormation creates at
+   * most one index per table update, so when upgrading a deployed control plane that
+   * does not have the activeTenantsIndex yet, deploy the upgrade first and enable this
+   * in a second deployment.
+   * @default false
+   */
+  readonly enableTenantChangeFeed?: boolean;
 }
 
 export class ControlPlane extends Construct {
@@ -120,6 +139,8 @@ export class ControlPlane extends Construct {
       auth,
       authorizer: api.jwtAuthorizer,
       eventManager,
+      exportBucket: props.tenantExportBucket,
+      enableChangeFeed: props.enableTenantChangeFeed,
     });
 
     new TenantRegistrationService(this, 'tenantRegistrationService', {
@@ -153,6 +174,7 @@ export class ControlPlane extends Construct {
         billing: props.billing,
         eventManager: eventManager,
         controlPlaneAPI: api.api,
+        authorizer: api.jwtAuthorizer,
       });
 
       if (billingTemplate.controlPlaneAPIBillingWebhookResourcePath) {
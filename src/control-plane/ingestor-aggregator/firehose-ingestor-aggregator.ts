@@ -25,6 +25,23 @@ import { Construct } from 'constructs';
 import { IDataIngestorAggregator } from './ingestor-aggregator-interface';
 import { addTemplateTag } from '../../utils';
 
+// Readers fetch a primary key's shards together with its own item in one
+// BatchGetItem call (at most 100 keys), and the billing of a sharded tenant
+// writes them in one transaction next to a few records of its own (at most
+// 100 items).
+const MAX_SHARD_COUNT = 96;
+
+/**
+ * The time windows aggregated data can be kept in.
+ */
+export enum UsageWindow {
+  /** One item per primary key and hour (UTC), e.g. `2024-05-01T13` */
+  HOURLY = 'HOURLY',
+
+  /** One item per primary key and day (UTC), e.g. `2024-05-01` */
+  DAILY = 'DAILY',
+}
+
 /**
  * Encapsulates the list of properties for a FirehoseAggregator construct.
  */
@@ -53,6 +70,89 @@ export interface FirehoseAggregatorProps {
    * Flag to delete objects in the firehoseDestinationBucket when deleting the bucket.
    */
   readonly autoDeleteObjects?: boolean;
+
+  /**
+   * The operations applied to the values of each aggregate key: `sum`, `count`, `min`,
+   * `max` and `distinct` (an approximate distinct count). Operations other than `sum`
+   * are stored in a `<aggregateKey>_<operation>` attribute. The `*` entry applies to
+   * aggregate keys that are not listed.
+   * @default - the values of every aggregate key are summed
+   */
+  readonly aggregateOperations?: { [key: string]: string[] };
+
+  /**
+   * The maximum number of s3 objects the aggregator processes concurrently
+   * when a single notification delivers more than one object.
+   * @default 4
+   */
+  readonly maxWorkers?: number;
+
+  /**
+   * The write capacity units per second each aggregator invocation may consume
+   * when updating the dataRepository. Writes are paced to this budget and
+   * throttled writes are retried with backoff.
+   * @default - writes are not paced
+   */
+  readonly writeCapacityBudget?: number;
+
+  /**
+   * The number of items the aggregated data of a very active primary key is spread over.
+   * Sharded items use `<primaryKey>#<n>` as their primary key and hold the original
+   * primary key in the `sbtaws_shard_of` attribute, so readers must merge them.
+   * Must be an integer from 1 to 96, so that a primary key's items can be read in
+   * one BatchGetItem call and written in one transaction.
+   * @default - aggregated data is not sharded
+   */
+  readonly shardCount?: number;
+
+  /**
+   * The number of records a primary key must have in a single checkpoint of an
+   * s3 object before its aggregated data is sharded. Only used when shardCount is set.
+   * @default 1000
+   */
+  readonly shardThreshold?: number;
+
+  /**
+   * A layer that provides pyarrow, such as the AWS SDK for pandas layer. When set,
+   * objects with a `.parquet` suffix (e.g. written by Firehose record format conversion)
+   * are aggregated from their primary key, aggregate key and aggregate value columns.
+   * These columns are found using the same paths as the JSON records, so the paths must
+   * be plain field paths such as `metric.name`.
+   * @default - Parquet objects cannot be aggregated
+   */
+  readonly parquetLayer?: lambda.ILayerVersion;
+
+  /**
+   * The JMESPath to find the time of a record in the incoming data stream, as epoch
+   * seconds or milliseconds or as an ISO 8601 string. When set, data is aggregated
+   * per usageWindow: the dataRepository gets a `usageWindow` sort key holding the
+   * window's start (UTC), and a `UsageWindowIndex` index for querying all of the
+   * items of a window. Records land in the window they were recorded in, however
+   * late they are processed.
+   * @default - data is aggregated into a single item per primary key
+   */
+  readonly timestampPath?: string;
+
+  /**
+   * The length of the windows data is aggregated in. Only used when timestampPath is set.
+   * @default UsageWindow.DAILY
+   */
+  readonly usageWindow?: UsageWindow;
+
+  /**
+   * How long the items of a window are kept after the window starts, when timestampPath
+   * is set. Windowed items are left in place once they are billed, and are deleted by the
+   * dataRepository's time to live (the `sbtaws_expires_at` attribute) after this time, so
+   * it must be longer than billing looks back for late records (48 hours by default).
+   * @default Duration.days(30)
+   */
+  readonly usageRetention?: cdk.Duration;
+
+  /**
+   * The information written to the dataRepository's DynamoDB stream when its items change.
+   * @default - the dataRepository has no stream
+   */
+  readonly dataRepositoryStream?: dynamodb.StreamViewType;
 }
 
 /**
@@ -86,6 +186,17 @@ export class FirehoseAggregator extends Construct implements IDataIngestorAggreg
     super(scope, id);
     addTemplateTag(this, 'FirehoseAggregator');
 
+    if (
+      props.shardCount !== undefined &&
+      (!Number.isInteger(props.shardCount) ||
+        props.shardCount < 1 ||
+        props.shardCount > MAX_SHARD_COUNT)
+    ) {
+      throw new Error(
+        `shardCount must be an integer from 1 to ${MAX_SHARD_COUNT}, got ${props.shardCount}`
+      );
+    }
+
     const serviceName = 'FirehoseAggregator';
 
     const firehoseDestinationBucket = new s3.Bucket(this, 'FirehoseDestinationBucket', {
@@ -124,8 +235,35 @@ export class FirehoseAggregator extends Construct implements IDataIngestorAggreg
       true // applyToChildren = true, so that it applies to policies created for the role.
     );
 
-    this.dataRepository = new dynamodb.Table(this, 'Data', {
+    const dataRepository = new dynamodb.Table(this, 'Data', {
       partitionKey: { name: props.primaryKeyColumn, type: dynamodb.AttributeType.STRING },
+      ...(props.timestampPath && {
+        sortKey: { name: 'usageWindow', type: dynamodb.AttributeType.STRING },
+        // windowed items are not deleted when they are billed
+        timeToLiveAttribute: 'sbtaws_expires_at',
+      }),
+      stream: props.dataRepositoryStream,
+      pointInTimeRecoverySpecification: {
+        pointInTimeRecoveryEnabled: true,
+      },
+    });
+
+    if (props.timestampPath) {
+      // lists the items of a window, so that billing and reporting never scan
+      dataRepository.addGlobalSecondaryIndex({
+        indexName: 'UsageWindowIndex',
+        partitionKey: { name: 'usageWindow', type: dynamodb.AttributeType.STRING },
+        sortKey: { name: props.primaryKeyColumn, type: dynamodb.AttributeType.STRING },
+      });
+    }
+    this.dataRepository = dataRepository;
+
+    // Records how far each s3 object has been applied to the dataRepository
+    // so that retried invocations do not count the same data twice.
+    const processingLedger = new dynamodb.Table(this, 'ProcessingLedger', {
+      partitionKey: { name: 'objectId', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expiresAt',
       pointInTimeRecoverySpecification: {
         pointInTimeRecoveryEnabled: true,
       },
@@ -144,16 +282,34 @@ export class FirehoseAggregator extends Construct implements IDataIngestorAggreg
       environment: {
         SERVICE_NAME: serviceName,
         DATA_TABLE: this.dataRepository.tableName,
+        LEDGER_TABLE: processingLedger.tableName,
         PRIMARY_KEY_COLUMN: props.primaryKeyColumn,
         PRIMARY_KEY_PATH: props.primaryKeyPath,
         AGGREGATE_KEY_PATH: props.aggregateKeyPath,
         AGGREGATE_VALUE_PATH: props.aggregateValuePath,
+        ...(props.aggregateOperations && {
+          AGGREGATE_OPERATIONS: JSON.stringify(props.aggregateOperations),
+        }),
+        ...(props.maxWorkers && { MAX_WORKERS: props.maxWorkers.toString() }),
+        ...(props.writeCapacityBudget && {
+          WRITE_CAPACITY_BUDGET: props.writeCapacityBudget.toString(),
+        }),
+        ...(props.shardCount && { SHARD_COUNT: props.shardCount.toString() }),
+        ...(props.shardThreshold && { SHARD_THRESHOLD: props.shardThreshold.toString() }),
+        ...(props.timestampPath && {
+          TIMESTAMP_PATH: props.timestampPath,
+          USAGE_WINDOW: props.usageWindow ?? UsageWindow.DAILY,
+          USAGE_RETENTION_HOURS: (props.usageRetention ?? cdk.Duration.days(30))
+            .toHours()
+            .toString(),
+        }),
       },
       logGroup: new cdk.aws_logs.LogGroup(this, 'DataAggregatorLambdaLogGroup', {
         retention: cdk.aws_logs.RetentionDays.FIVE_DAYS,
       }),
       layers: [
         lambda.LayerVersion.fromLayerVersionArn(this, 'LambdaPowerTools', lambdaPowerToolsLayerARN),
+        ...(props.parquetLayer ? [props.parquetLayer] : []),
       ],
       architecture: Architecture.ARM_64,
     });
@@ -180,6 +336,9 @@ export class FirehoseAggregator extends Construct implements IDataIngestorAggreg
             `Resource::<${cdk.Stack.of(this).getLogicalId(
               firehoseDestinationBucket.node.defaultChild as s3.CfnBucket
             )}.Arn>/*`,
+            `Resource::<${cdk.Stack.of(this).getLogicalId(
+              dataRepository.node.defaultChild as dynamodb.CfnTable
+            )}.Arn>/index/*`,
           ],
         },
       ],
@@ -187,6 +346,7 @@ export class FirehoseAggregator extends Construct implements IDataIngestorAggreg
     );
 
     this.dataRepository.grantReadWriteData(this.dataAggregator);
+    processingLedger.grantReadWriteData(this.dataAggregator);
     firehoseDestinationBucket.grantRead(this.dataAggregator);
 
     firehoseDestinationBucket.addObjectCreatedNotification(
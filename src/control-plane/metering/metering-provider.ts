@@ -13,7 +13,6 @@
 
 import * as apigatewayV2 from 'aws-cdk-lib/aws-apigatewayv2';
 import * as apigatewayV2Integrations from 'aws-cdk-lib/aws-apigatewayv2-integrations';
-import * as targets from 'aws-cdk-lib/aws-events-targets';
 import { Construct } from 'constructs';
 import { IMetering } from './metering-interface';
 import * as utils from '../../utils';
@@ -76,7 +75,7 @@ export class MeteringProvider extends Construct {
       if (target.functionDefinition?.handler) {
         props.eventManager.addTargetToEvent(this, {
           eventDefinition: target.functionDefinition?.trigger || target.defaultFunctionTrigger,
-          target: new targets.LambdaFunction(target.functionDefinition?.handler),
+          target: utils.createAsyncFunctionTarget(target.functionDefinition),
         });
       }
     });
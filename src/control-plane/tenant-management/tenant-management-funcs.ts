@@ -12,11 +12,14 @@
  */
 
 import * as path from 'path';
-import { PythonFunction } from '@aws-cdk/aws-lambda-python-alpha';
-import { Duration, Stack } from 'aws-cdk-lib';
+import { PythonFunction, PythonLayerVersion } from '@aws-cdk/aws-lambda-python-alpha';
+import { CfnOutput, Duration, Stack } from 'aws-cdk-lib';
 import { CfnTable } from 'aws-cdk-lib/aws-dynamodb';
 import { ManagedPolicy, Role, ServicePrincipal } from 'aws-cdk-lib/aws-iam';
-import { Function, LayerVersion, Runtime, Architecture } from 'aws-cdk-lib/aws-lambda';
+import { Function, LayerVersion, Runtime, Architecture, StartingPosition } from 'aws-cdk-lib/aws-lambda';
+import { DynamoEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
+import { IBucket } from 'aws-cdk-lib/aws-s3';
+import { InvocationType, Trigger } from 'aws-cdk-lib/triggers';
 import { NagSuppressions } from 'cdk-nag';
 import { Construct } from 'constructs';
 import { TenantManagementTable } from './tenant-management.table';
@@ -26,10 +29,12 @@ import { IEventManager } from '../../utils';
 Represents the properties required for the Tenant Management Lambda function.
 @interface TenantManagementLambdaProps
 @property {TenantManagementTable} table - The table used for Tenant Management.
-@property {IEventManager} eventManager - The event manager used for handling events in Tenant Management. */
+@property {IEventManager} eventManager - The event manager used for handling events in Tenant Management.
+@property {IBucket} exportBucket - The bucket that exports of the Tenant Management table are written to. */
 export interface TenantManagementLambdaProps {
   readonly table: TenantManagementTable;
   readonly eventManager: IEventManager;
+  readonly exportBucket?: IBucket;
 }
 
 /**
@@ -37,12 +42,18 @@ Represents the Tenant Management Lambda construct.
 @class TenantManagementLambda
 @extends {Construct}
 @property {Function} tenantManagementFunc - The Tenant Management Lambda function.
+@property {Function} tenantStatsFunc - The function that keeps the tenant counters up to date.
+@property {Function} tenantBackfillFunc - The function that lists the active tenants created before the active tenants index in it.
+@property {Function} tenantExportFunc - The function that exports the Tenant Management table, if there is an exportBucket.
 @param {Construct} scope - The scope in which this construct is defined.
 @param {string} id - The construct's identifier.
 @param {TenantManagementLambdaProps} props - The properties required for the Tenant Management Lambda.
 */
 export class TenantManagementLambda extends Construct {
   tenantManagementFunc: Function;
+  tenantStatsFunc: Function;
+  tenantBackfillFunc: Function;
+  tenantExportFunc?: Function;
 
   constructor(scope: Construct, id: string, props: TenantManagementLambdaProps) {
     super(scope, id);
@@ -60,6 +71,7 @@ export class TenantManagementLambda extends Construct {
     });
 
     props.table.tenantDetails.grantReadWriteData(tenantManagementExecRole);
+    props.table.tenantStats.grantReadData(tenantManagementExecRole);
     props.eventManager.grantPutEventsTo(tenantManagementExecRole);
 
     tenantManagementExecRole.addManagedPolicy(
@@ -98,6 +110,20 @@ export class TenantManagementLambda extends Construct {
 
     // https://docs.powertools.aws.dev/lambda/python/3.6.0/#lambda-layer
     const lambdaPowerToolsLayerARN = `arn:aws:lambda:${Stack.of(this).region}:017000801446:layer:AWSLambdaPowertoolsPythonV3-python313-arm64:7`;
+    const lambdaPowerToolsLayer = LayerVersion.fromLayerVersionArn(
+      this,
+      'LambdaPowerTools',
+      lambdaPowerToolsLayerARN
+    );
+
+    const helperLayer = new PythonLayerVersion(this, 'HelperLayer', {
+      entry: path.join(__dirname, '../../../resources/layers/helper'),
+      compatibleRuntimes: [Runtime.PYTHON_3_13],
+      compatibleArchitectures: [Architecture.ARM_64],
+      bundling: {
+        platform: 'linux/arm64',
+      },
+    });
 
     /**
      * Creates the Tenant Management Lambda function.
@@ -111,15 +137,209 @@ export class TenantManagementLambda extends Construct {
       handler: 'lambda_handler',
       timeout: Duration.seconds(60),
       role: tenantManagementExecRole,
-      layers: [
-        LayerVersion.fromLayerVersionArn(this, 'LambdaPowerTools', lambdaPowerToolsLayerARN),
-      ],
+      layers: [lambdaPowerToolsLayer, helperLayer],
       environment: {
         TENANT_DETAILS_TABLE: props.table.tenantDetails.tableName,
+        ACTIVE_TENANTS_INDEX_NAME: props.table.activeTenantsIndexName,
+        ...(props.table.tenantChangesIndexName && {
+          TENANT_CHANGES_INDEX_NAME: props.table.tenantChangesIndexName,
+        }),
+        TENANT_STATS_TABLE: props.table.tenantStats.tableName,
       },
       architecture: Architecture.ARM_64,
     });
 
     this.tenantManagementFunc = tenantManagementFunc;
+
+    /**
+     * Creates the Tenant Backfill Lambda function, which gives the active tenants
+     * created before the active tenants index the attribute that lists them in it,
+     * and moves the ones listed before the index was sharded to their shard.
+     * Until it has run, those tenants are missing from GET /tenants?active=true, so
+     * it is triggered (asynchronously) when it is first deployed and whenever it changes.
+     * It only writes tenants that are not listed in their shard yet, and can be invoked
+     * again at any time.
+     */
+    const tenantBackfillExecRole = new Role(this, 'tenantBackfillExecRole', {
+      assumedBy: new ServicePrincipal('lambda.amazonaws.com'),
+    });
+
+    props.table.tenantDetails.grantReadWriteData(tenantBackfillExecRole);
+
+    tenantBackfillExecRole.addManagedPolicy(
+      ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole')
+    );
+    tenantBackfillExecRole.addManagedPolicy(
+      ManagedPolicy.fromAwsManagedPolicyName('AWSXrayWriteOnlyAccess')
+    );
+
+    NagSuppressions.addResourceSuppressions(
+      tenantBackfillExecRole,
+      [
+        {
+          id: 'AwsSolutions-IAM5',
+          reason: 'Index name(s) not known beforehand.',
+          appliesTo: [
+            `Resource::<${Stack.of(this).getLogicalId(props.table.tenantDetails.node.defaultChild as CfnTable)}.Arn>/index/*`,
+          ],
+        },
+        {
+          id: 'AwsSolutions-IAM4',
+          reason: 'Suppress usage of AWSLambdaBasicExecutionRole and AWSXrayWriteOnlyAccess.',
+          appliesTo: [
+            'Policy::arn:<AWS::Partition>:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole',
+            'Policy::arn:<AWS::Partition>:iam::aws:policy/AWSXrayWriteOnlyAccess',
+          ],
+        },
+      ],
+      true // applyToChildren = true, so that it applies to policies created for the role.
+    );
+
+    this.tenantBackfillFunc = new PythonFunction(this, 'TenantBackfill', {
+      entry: path.join(__dirname, '../../../resources/functions/tenant-management'),
+      runtime: Runtime.PYTHON_3_13,
+      index: 'backfill.py',
+      handler: 'handler',
+      timeout: Duration.minutes(15),
+      role: tenantBackfillExecRole,
+      layers: [lambdaPowerToolsLayer],
+      environment: {
+        TENANT_DETAILS_TABLE: props.table.tenantDetails.tableName,
+      },
+      architecture: Architecture.ARM_64,
+    });
+
+    new Trigger(this, 'TenantBackfillTrigger', {
+      handler: this.tenantBackfillFunc,
+      invocationType: InvocationType.EVENT,
+      executeAfter: [props.table.tenantDetails],
+    });
+
+    new CfnOutput(this, 'tenantBackfillFunctionName', {
+      value: this.tenantBackfillFunc.functionName,
+      key: 'tenantBackfillFunctionName',
+    });
+
+    /**
+     * Creates the Tenant Stats Lambda function, which applies the changes on
+     * the Tenant Details table's stream to the tenant counters. It can also be
+     * invoked directly with {"rebuild": true} to recount every tenant.
+     */
+    const tenantStatsExecRole = new Role(this, 'tenantStatsExecRole', {
+      assumedBy: new ServicePrincipal('lambda.amazonaws.com'),
+    });
+
+    props.table.tenantDetails.grantReadData(tenantStatsExecRole);
+    props.table.tenantStats.grantReadWriteData(tenantStatsExecRole);
+
+    tenantStatsExecRole.addManagedPolicy(
+      ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole')
+    );
+    tenantStatsExecRole.addManagedPolicy(
+      ManagedPolicy.fromAwsManagedPolicyName('AWSXrayWriteOnlyAccess')
+    );
+
+    this.tenantStatsFunc = new PythonFunction(this, 'TenantStats', {
+      entry: path.join(__dirname, '../../../resources/functions/tenant-management'),
+      runtime: Runtime.PYTHON_3_13,
+      index: 'stats.py',
+      handler: 'handler',
+      timeout: Duration.minutes(5),
+      role: tenantStatsExecRole,
+      layers: [lambdaPowerToolsLayer],
+      environment: {
+        TENANT_DETAILS_TABLE: props.table.tenantDetails.tableName,
+        TENANT_STATS_TABLE: props.table.tenantStats.tableName,
+      },
+      architecture: Architecture.ARM_64,
+    });
+    this.tenantStatsFunc.addEventSource(
+      new DynamoEventSource(props.table.tenantDetails, {
+        startingPosition: StartingPosition.TRIM_HORIZON,
+        batchSize: 1000,
+        maxBatchingWindow: Duration.seconds(10),
+      })
+    );
+
+    NagSuppressions.addResourceSuppressions(
+      tenantStatsExecRole,
+      [
+        {
+          id: 'AwsSolutions-IAM5',
+          reason:
+            'Index name(s) not known beforehand, and dynamodb:ListStreams does not support resource-level permissions.',
+        },
+        {
+          id: 'AwsSolutions-IAM4',
+          reason: 'Suppress usage of AWSLambdaBasicExecutionRole and AWSXrayWriteOnlyAccess.',
+          appliesTo: [
+            'Policy::arn:<AWS::Partition>:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole',
+            'Policy::arn:<AWS::Partition>:iam::aws:policy/AWSXrayWriteOnlyAccess',
+          ],
+        },
+      ],
+      true // applyToChildren = true, so that it applies to policies created for the role.
+    );
+
+    if (props.exportBucket) {
+      /**
+       * Creates the Tenant Export Lambda function, which writes every tenant
+       * to the export bucket as NDJSON with a parallel scan of the table.
+       * It is invoked directly and returns the manifest of the export.
+       */
+      const tenantExportExecRole = new Role(this, 'tenantExportExecRole', {
+        assumedBy: new ServicePrincipal('lambda.amazonaws.com'),
+      });
+
+      props.table.tenantDetails.grantReadData(tenantExportExecRole);
+      props.exportBucket.grantPut(tenantExportExecRole);
+
+      tenantExportExecRole.addManagedPolicy(
+        ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole')
+      );
+      tenantExportExecRole.addManagedPolicy(
+        ManagedPolicy.fromAwsManagedPolicyName('AWSXrayWriteOnlyAccess')
+      );
+
+      NagSuppressions.addResourceSuppressions(
+        tenantExportExecRole,
+        [
+          {
+            id: 'AwsSolutions-IAM5',
+            reason: 'Index name(s) and export object keys not known beforehand.',
+          },
+          {
+            id: 'AwsSolutions-IAM4',
+            reason: 'Suppress usage of AWSLambdaBasicExecutionRole and AWSXrayWriteOnlyAccess.',
+            appliesTo: [
+              'Policy::arn:<AWS::Partition>:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole',
+              'Policy::arn:<AWS::Partition>:iam::aws:policy/AWSXrayWriteOnlyAccess',
+            ],
+          },
+        ],
+        true // applyToChildren = true, so that it applies to policies created for the role.
+      );
+
+      this.tenantExportFunc = new PythonFunction(this, 'TenantExport', {
+        entry: path.join(__dirname, '../../../resources/functions/tenant-management'),
+        runtime: Runtime.PYTHON_3_13,
+        index: 'export.py',
+        handler: 'handler',
+        timeout: Duration.minutes(15),
+        memorySize: 1024,
+        role: tenantExportExecRole,
+        layers: [lambdaPowerToolsLayer],
+        environment: {
+          TENANT_DETAILS_TABLE: props.table.tenantDetails.tableName,
+          EXPORT_BUCKET: props.exportBucket.bucketName,
+        },
+        architecture: Architecture.ARM_64,
+      });
+
+      new CfnOutput(this, 'tenantExportFunctionName', {
+        value: this.tenantExportFunc.functionName,
+        key: 'tenantExportFunctionName',
+      });
+    }
   }
 }
@@ -12,6 +12,7 @@
  */
 
 import * as apigatewayV2 from 'aws-cdk-lib/aws-apigatewayv2';
+import * as s3 from 'aws-cdk-lib/aws-s3';
 import { HttpIamAuthorizer } from 'aws-cdk-lib/aws-apigatewayv2-authorizers';
 import { HttpLambdaIntegration } from 'aws-cdk-lib/aws-apigatewayv2-integrations';
 import { Construct } from 'constructs';
@@ -28,12 +29,16 @@ import { IAuth } from '../auth/auth-interface';
  * @property {IAuth} auth - The authentication mechanism for the service.
  * @property {apigatewayV2.IHttpRouteAuthorizer} authorizer - The HTTP route authorizer for the service.
  * @property {IEventManager} eventManager - The event manager for handling tenant-related events.
+ * @property {s3.IBucket} exportBucket - The bucket that tenant exports are written to.
+ * @property {boolean} enableChangeFeed - Whether to serve the tenant change feed, at /tenants/changes.
  */
 export interface TenantManagementServiceProps {
   readonly api: apigatewayV2.HttpApi;
   readonly auth: IAuth;
   readonly authorizer: apigatewayV2.IHttpRouteAuthorizer;
   readonly eventManager: IEventManager;
+  readonly exportBucket?: s3.IBucket;
+  readonly enableChangeFeed?: boolean;
 }
 
 /**
@@ -74,10 +79,13 @@ export class TenantManagementService extends Construct {
   constructor(scope: Construct, id: string, props: TenantManagementServiceProps) {
     super(scope, id);
 
-    const table = new TenantManagementTable(this, 'tenantManagementTable');
+    const table = new TenantManagementTable(this, 'tenantManagementTable', {
+      enableChangeFeed: props.enableChangeFeed,
+    });
     const lambda = new TenantManagementLambda(this, 'tenantManagementLambda', {
       eventManager: props.eventManager,
       table,
+      exportBucket: props.exportBucket,
     });
 
     const tenantsHttpLambdaIntegration = new HttpLambdaIntegration(
@@ -93,11 +101,28 @@ export class TenantManagementService extends Construct {
         authorizer: props.authorizer,
         integration: tenantsHttpLambdaIntegration,
       },
+      {
+        method: apigatewayV2.HttpMethod.GET,
+        path: `${this.tenantsPath}/stats`,
+        authorizer: props.authorizer,
+        integration: tenantsHttpLambdaIntegration,
+      },
       {
         method: apigatewayV2.HttpMethod.POST,
         path: this.tenantsPath,
         integration: tenantsHttpLambdaIntegration,
       },
+      {
+        method: apigatewayV2.HttpMethod.POST,
+        path: `${this.tenantsPath}/batch`,
+        integration: tenantsHttpLambdaIntegration,
+      },
+      {
+        method: apigatewayV2.HttpMethod.POST,
+        path: `${this.tenantsPath}/batch-get`,
+        authorizer: props.authorizer,
+        integration: tenantsHttpLambdaIntegration,
+      },
       {
         method: apigatewayV2.HttpMethod.DELETE,
         path: this.tenantIdPath,
@@ -115,6 +140,14 @@ export class TenantManagementService extends Construct {
         integration: tenantsHttpLambdaIntegration,
       },
     ];
+    if (table.tenantChangesIndexName) {
+      routes.push({
+        method: apigatewayV2.HttpMethod.GET,
+        path: `${this.tenantsPath}/changes`,
+        authorizer: props.authorizer,
+        integration: tenantsHttpLambdaIntegration,
+      });
+    }
     generateRoutes(props.api, routes, new HttpIamAuthorizer());
 
     this.table = table;
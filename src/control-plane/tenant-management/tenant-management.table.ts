@@ -11,10 +11,26 @@
  *  and limitations under the License.
  */
 
-import { AttributeType, ProjectionType, Table } from 'aws-cdk-lib/aws-dynamodb';
+import { AttributeType, ProjectionType, StreamViewType, Table } from 'aws-cdk-lib/aws-dynamodb';
 import { Construct } from 'constructs';
 import { addTemplateTag } from '../../utils';
 
+/**
+ * Represents the properties of the TenantManagementTable.
+ *
+ * @interface TenantManagementTableProps
+ */
+export interface TenantManagementTableProps {
+  /**
+   * Whether to create the tenantChangesIndex, which orders tenants by the time they last changed.
+   *
+   * CloudFormation creates at most one global secondary index per table update, so on a
+   * table that exists already, enable this in a deployment of its own.
+   * @default false
+   */
+  readonly enableChangeFeed?: boolean;
+}
+
 /**
  * Represents a table for managing tenant details in the application.
  *
@@ -29,6 +45,13 @@ export class TenantManagementTable extends Construct {
    */
   public readonly tenantDetails: Table;
 
+  /**
+   * The table that stores the tenant counters, kept up to date from the stream of the tenant details table.
+   *
+   * @type {Table}
+   */
+  public readonly tenantStats: Table;
+
   /**
    * The name of the global secondary index for the tenant configuration.
    *
@@ -36,6 +59,26 @@ export class TenantManagementTable extends Construct {
    */
   public readonly tenantConfigIndexName: string = 'tenantConfigIndex';
 
+  /**
+   * The name of the sparse global secondary index that lists active tenants.
+   *
+   * Only active tenants have the index's partition key attribute, which spreads them
+   * over a few partitions of the index (ACTIVE#<shard>). Active tenants created before
+   * the index existed, or before it was sharded, are given it by the tenantBackfillFunc
+   * of the TenantManagementLambda, which runs when it is deployed.
+   *
+   * @type {string}
+   */
+  public readonly activeTenantsIndexName: string = 'activeTenantsIndex';
+
+  /**
+   * The name of the global secondary index that orders tenants by the time they last changed,
+   * if it is enabled.
+   *
+   * @type {string}
+   */
+  public readonly tenantChangesIndexName?: string;
+
   /**
    * The name of the column that stores the tenant configuration.
    *
@@ -63,8 +106,9 @@ export class TenantManagementTable extends Construct {
    *
    * @param {Construct} scope - The parent construct.
    * @param {string} id - The ID of the construct.
+   * @param {TenantManagementTableProps} props - The properties of the table.
    */
-  constructor(scope: Construct, id: string) {
+  constructor(scope: Construct, id: string, props?: TenantManagementTableProps) {
     super(scope, id);
     addTemplateTag(this, 'Tables');
     this.tenantDetails = new Table(this, 'TenantDetails', {
@@ -72,6 +116,14 @@ export class TenantManagementTable extends Construct {
       pointInTimeRecoverySpecification: {
         pointInTimeRecoveryEnabled: true,
       },
+      stream: StreamViewType.NEW_AND_OLD_IMAGES,
+    });
+
+    this.tenantStats = new Table(this, 'TenantStats', {
+      partitionKey: { name: 'statsId', type: AttributeType.STRING },
+      pointInTimeRecoverySpecification: {
+        pointInTimeRecoveryEnabled: true,
+      },
     });
 
     this.tenantDetails.addGlobalSecondaryIndex({
@@ -80,5 +132,26 @@ export class TenantManagementTable extends Construct {
       projectionType: ProjectionType.INCLUDE,
       nonKeyAttributes: [this.tenantConfigColumn],
     });
+
+    // active tenants are spread over a few partitions of the index (sbtaws_active_listing
+    // is ACTIVE#<shard>), each sorted by tenantId
+    this.tenantDetails.addGlobalSecondaryIndex({
+      indexName: this.activeTenantsIndexName,
+      partitionKey: { name: 'sbtaws_active_listing', type: AttributeType.STRING },
+      sortKey: { name: this.tenantIdColumn, type: AttributeType.STRING },
+      projectionType: ProjectionType.ALL,
+    });
+
+    if (props?.enableChangeFeed) {
+      // tenants are spread over a few partitions of the index (sbtaws_change_feed is
+      // TENANTS#<shard>), each sorted by updatedAt
+      this.tenantChangesIndexName = 'tenantChangesIndex';
+      this.tenantDetails.addGlobalSecondaryIndex({
+        indexName: this.tenantChangesIndexName,
+        partitionKey: { name: 'sbtaws_change_feed', type: AttributeType.STRING },
+        sortKey: { name: 'updatedAt', type: AttributeType.STRING },
+        projectionType: ProjectionType.ALL,
+      });
+    }
   }
 }
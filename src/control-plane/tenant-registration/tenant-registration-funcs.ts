@@ -75,6 +75,7 @@ export class TenantRegistrationLambda extends Construct {
       environment: {
         TENANT_REGISTRATION_TABLE_NAME: props.table.tenantRegistration.tableName,
         TENANT_API_URL: props.api.url!,
+        SERVICE_NAME: 'TenantRegistrations',
         EVENTBUS_NAME: props.eventManager.busName,
         EVENT_SOURCE: props.eventManager.controlPlaneEventSource,
         ONBOARDING_DETAIL_TYPE: props.eventManager.events.onboardingRequest.detailType,
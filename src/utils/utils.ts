@@ -13,7 +13,10 @@
 
 import { Stack } from 'aws-cdk-lib';
 import * as apigatewayV2 from 'aws-cdk-lib/aws-apigatewayv2';
+import { IRuleTarget } from 'aws-cdk-lib/aws-events';
+import * as targets from 'aws-cdk-lib/aws-events-targets';
 import { IFunction } from 'aws-cdk-lib/aws-lambda';
+import { IQueue } from 'aws-cdk-lib/aws-sqs';
 import { Construct } from 'constructs';
 import { EventDefinition } from './event-manager';
 
@@ -145,4 +148,22 @@ export interface IASyncFunction {
    * The event definition that will trigger the handler function.
    */
   readonly trigger?: EventDefinition;
+
+  /**
+   * The queue that buffers the trigger's events for the handler function.
+   * When set, events are sent to this queue instead of invoking the handler
+   * function, which is expected to consume the queue.
+   */
+  readonly queue?: IQueue;
 }
+
+/**
+ * Returns the target that delivers events to an async function: its queue
+ * when it has one, the function itself otherwise.
+ */
+export const createAsyncFunctionTarget = (asyncFunction: IASyncFunction): IRuleTarget => {
+  if (asyncFunction.queue) {
+    return new targets.SqsQueue(asyncFunction.queue);
+  }
+  return new targets.LambdaFunction(asyncFunction.handler);
+};
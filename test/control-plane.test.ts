@@ -13,6 +13,7 @@
 
 import * as cdk from 'aws-cdk-lib';
 import { Annotations, Capture, Match, Template } from 'aws-cdk-lib/assertions';
+import * as s3 from 'aws-cdk-lib/aws-s3';
 import { AwsSolutionsChecks } from 'cdk-nag';
 import { Construct } from 'constructs';
 import { CognitoAuth, ControlPlane } from '../src/control-plane';
@@ -63,6 +64,7 @@ const app = new cdk.App();
 interface TestStackProps extends cdk.StackProps {
   systemAdminEmail: string;
   disableAPILogging?: boolean;
+  exportTenants?: boolean;
 }
 class TestStack extends cdk.Stack {
   constructor(scope: cdk.App, id: string, props: TestStackProps) {
@@ -79,6 +81,9 @@ class TestStack extends cdk.Stack {
       auth: cognitoAuth,
       eventManager: eventManager,
       disableAPILogging: props.disableAPILogging,
+      ...(props.exportTenants && {
+        tenantExportBucket: new s3.Bucket(this, 'TenantExportBucket', { enforceSSL: true }),
+      }),
     });
   }
 }
@@ -136,3 +141,47 @@ describe('ControlPlane API logging', () => {
     );
   });
 });
+
+describe('ControlPlane tenant export', () => {
+  it('should not create the export function without a tenantExportBucket', () => {
+    const stackWithoutExport = new TestStack(new cdk.App(), 'stackWithoutExport', {
+      systemAdminEmail: 'test@example.com',
+    });
+    const template = Template.fromStack(stackWithoutExport);
+
+    template.resourcePropertiesCountIs('AWS::Lambda::Function', { Handler: 'export.handler' }, 0);
+  });
+
+  it('should create an export function that writes to the tenantExportBucket', () => {
+    const stackWithExport = new TestStack(new cdk.App(), 'stackWithExport', {
+      systemAdminEmail: 'test@example.com',
+      exportTenants: true,
+    });
+    const template = Template.fromStack(stackWithExport);
+    const bucketLogicalId = Object.keys(template.findResources('AWS::S3::Bucket')).find((id) =>
+      id.startsWith('TenantExportBucket')
+    );
+    expect(bucketLogicalId).toBeDefined();
+
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Handler: 'export.handler',
+      Environment: {
+        Variables: Match.objectLike({
+          EXPORT_BUCKET: { Ref: bucketLogicalId },
+        }),
+      },
+    });
+    template.hasResourceProperties('AWS::IAM::Policy', {
+      PolicyDocument: {
+        Statement: Match.arrayWith([
+          Match.objectLike({
+            Action: Match.arrayWith(['s3:PutObject']),
+            Resource: {
+              'Fn::Join': ['', [{ 'Fn::GetAtt': [bucketLogicalId, 'Arn'] }, '/*']],
+            },
+          }),
+        ]),
+      },
+    });
+  });
+});
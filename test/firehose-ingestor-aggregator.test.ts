@@ -0,0 +1,139 @@
+/**
+ *  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ *  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+ *  with the License. A copy of the License is located at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ *  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+ *  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+ *  and limitations under the License.
+ */
+
+import * as cdk from 'aws-cdk-lib';
+import { Match, Template } from 'aws-cdk-lib/assertions';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
+import * as lambda from 'aws-cdk-lib/aws-lambda';
+import { FirehoseAggregator, FirehoseAggregatorProps, UsageWindow } from '../src/control-plane';
+
+const requiredProps: FirehoseAggregatorProps = {
+  primaryKeyColumn: 'tenantId',
+  primaryKeyPath: 'tenantId',
+  aggregateKeyPath: 'metric.name',
+  aggregateValuePath: 'metric.value',
+};
+
+const createAggregator = (id: string, props: Partial<FirehoseAggregatorProps> = {}) => {
+  const stack = new cdk.Stack(new cdk.App(), id);
+  new FirehoseAggregator(stack, 'FirehoseAggregator', { ...requiredProps, ...props });
+  return Template.fromStack(stack);
+};
+
+describe('FirehoseAggregator', () => {
+  it('should aggregate into a single item per primary key by default', () => {
+    const template = createAggregator('DefaultAggregatorStack');
+
+    template.hasResourceProperties('AWS::DynamoDB::Table', {
+      KeySchema: [{ AttributeName: 'tenantId', KeyType: 'HASH' }],
+      GlobalSecondaryIndexes: Match.absent(),
+      TimeToLiveSpecification: Match.absent(),
+      StreamSpecification: Match.absent(),
+    });
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({
+          SHARD_COUNT: Match.absent(),
+          TIMESTAMP_PATH: Match.absent(),
+          USAGE_WINDOW: Match.absent(),
+        }),
+      },
+    });
+  });
+
+  it('should pass the aggregation settings to the aggregator function', () => {
+    const stack = new cdk.Stack(new cdk.App(), 'SettingsAggregatorStack');
+    const parquetLayerArn = 'arn:aws:lambda:us-east-1:111111111111:layer:pyarrow:1';
+    new FirehoseAggregator(stack, 'FirehoseAggregator', {
+      ...requiredProps,
+      aggregateOperations: { 'size': ['sum', 'max'], '*': ['count'] },
+      maxWorkers: 8,
+      writeCapacityBudget: 100,
+      shardCount: 16,
+      shardThreshold: 500,
+      parquetLayer: lambda.LayerVersion.fromLayerVersionArn(stack, 'ParquetLayer', parquetLayerArn),
+    });
+    const template = Template.fromStack(stack);
+
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({
+          AGGREGATE_OPERATIONS: JSON.stringify({ 'size': ['sum', 'max'], '*': ['count'] }),
+          MAX_WORKERS: '8',
+          WRITE_CAPACITY_BUDGET: '100',
+          SHARD_COUNT: '16',
+          SHARD_THRESHOLD: '500',
+        }),
+      },
+      Layers: Match.arrayWith([parquetLayerArn]),
+    });
+  });
+
+  it('should aggregate per usage window with a window index and expiring items', () => {
+    const template = createAggregator('WindowedAggregatorStack', {
+      timestampPath: 'timestamp',
+      usageWindow: UsageWindow.HOURLY,
+      usageRetention: cdk.Duration.days(7),
+      dataRepositoryStream: dynamodb.StreamViewType.NEW_IMAGE,
+    });
+
+    template.hasResourceProperties('AWS::DynamoDB::Table', {
+      KeySchema: [
+        { AttributeName: 'tenantId', KeyType: 'HASH' },
+        { AttributeName: 'usageWindow', KeyType: 'RANGE' },
+      ],
+      GlobalSecondaryIndexes: [
+        Match.objectLike({
+          IndexName: 'UsageWindowIndex',
+          KeySchema: [
+            { AttributeName: 'usageWindow', KeyType: 'HASH' },
+            { AttributeName: 'tenantId', KeyType: 'RANGE' },
+          ],
+        }),
+      ],
+      TimeToLiveSpecification: { AttributeName: 'sbtaws_expires_at', Enabled: true },
+      StreamSpecification: { StreamViewType: 'NEW_IMAGE' },
+    });
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({
+          TIMESTAMP_PATH: 'timestamp',
+          USAGE_WINDOW: 'HOURLY',
+          USAGE_RETENTION_HOURS: '168',
+        }),
+      },
+    });
+  });
+
+  it('should keep windowed items for 30 days by default', () => {
+    const template = createAggregator('RetentionAggregatorStack', {
+      timestampPath: 'timestamp',
+    });
+
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({
+          USAGE_WINDOW: 'DAILY',
+          USAGE_RETENTION_HOURS: '720',
+        }),
+      },
+    });
+  });
+
+  it.each([0, 97, 1.5])('should reject a shardCount of %p', (shardCount) => {
+    const stack = new cdk.Stack(new cdk.App(), 'ShardCountAggregatorStack');
+    expect(
+      () => new FirehoseAggregator(stack, 'FirehoseAggregator', { ...requiredProps, shardCount })
+    ).toThrow(/shardCount must be an integer from 1 to 96/);
+  });
+});
@@ -0,0 +1,183 @@
+/**
+ *  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ *
+ *  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+ *  with the License. A copy of the License is located at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ *  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+ *  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+ *  and limitations under the License.
+ */
+
+import * as cdk from 'aws-cdk-lib';
+import { Match, Template } from 'aws-cdk-lib/assertions';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import {
+  CognitoAuth,
+  ControlPlane,
+  MockBillingProvider,
+  MockBillingProviderProps,
+  UsageWindow,
+} from '../src/control-plane';
+import { EventManager } from '../src/utils';
+
+const createBillingProvider = (id: string, props?: MockBillingProviderProps) => {
+  const stack = new cdk.Stack(new cdk.App(), id);
+  const billing = new MockBillingProvider(stack, 'MockBilling', props);
+  return { stack, billing, template: Template.fromStack(stack) };
+};
+
+const logicalIdOf = (stack: cdk.Stack, construct: { node: { defaultChild?: unknown } }) =>
+  stack.getLogicalId(construct.node.defaultChild as cdk.CfnElement);
+
+describe('MockBillingProvider', () => {
+  it('should invoke the customer functions directly by default', () => {
+    const { billing, template } = createBillingProvider('DefaultBillingStack');
+
+    expect(billing.createCustomerFunction.queue).toBeUndefined();
+    expect(billing.deleteCustomerFunction.queue).toBeUndefined();
+    template.resourceCountIs('AWS::SQS::Queue', 0);
+    template.resourceCountIs('AWS::Lambda::EventSourceMapping', 0);
+  });
+
+  it('should let the PutUsage function invoke itself to continue a billing run', () => {
+    const { stack, billing, template } = createBillingProvider('PutUsageBillingStack');
+    const putUsageHandler = billing.putUsageFunction!.handler;
+
+    template.hasResourceProperties('AWS::Lambda::Permission', {
+      Action: 'lambda:InvokeFunction',
+      FunctionName: { 'Fn::GetAtt': [logicalIdOf(stack, putUsageHandler), 'Arn'] },
+      Principal: { 'Fn::GetAtt': [logicalIdOf(stack, putUsageHandler.role!), 'Arn'] },
+    });
+  });
+
+  it('should buffer customer events in queues with a customerBatchSize', () => {
+    const { stack, billing, template } = createBillingProvider('BatchedBillingStack', {
+      customerBatchSize: 10,
+    });
+
+    for (const asyncFunction of [billing.createCustomerFunction, billing.deleteCustomerFunction]) {
+      expect(asyncFunction.queue).toBeDefined();
+      template.hasResourceProperties('AWS::Lambda::EventSourceMapping', {
+        BatchSize: 10,
+        MaximumBatchingWindowInSeconds: 5,
+        FunctionResponseTypes: ['ReportBatchItemFailures'],
+        EventSourceArn: { 'Fn::GetAtt': [logicalIdOf(stack, asyncFunction.queue!), 'Arn'] },
+        FunctionName: { Ref: logicalIdOf(stack, asyncFunction.handler) },
+      });
+    }
+
+    // every queue has a dead-letter queue
+    template.resourceCountIs('AWS::SQS::Queue', 4);
+    template.resourcePropertiesCountIs(
+      'AWS::SQS::Queue',
+      { RedrivePolicy: Match.objectLike({ maxReceiveCount: 5 }) },
+      2
+    );
+  });
+
+  it('should track changed tenants with incrementalBilling', () => {
+    const { billing, template } = createBillingProvider('IncrementalBillingStack', {
+      incrementalBilling: true,
+    });
+    expect(billing.ingestor).toBeDefined();
+
+    template.hasResourceProperties('AWS::DynamoDB::Table', {
+      KeySchema: [{ AttributeName: 'tenantId', KeyType: 'HASH' }],
+      StreamSpecification: { StreamViewType: 'NEW_IMAGE' },
+    });
+    template.hasResourceProperties('AWS::Lambda::EventSourceMapping', {
+      StartingPosition: 'TRIM_HORIZON',
+      FilterCriteria: {
+        Filters: [{ Pattern: JSON.stringify({ eventName: ['INSERT', 'MODIFY'] }) }],
+      },
+    });
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({
+          DIRTY_TENANTS_TABLE: { Ref: Match.stringLikeRegexp('DirtyTenantsTable') },
+        }),
+      },
+    });
+  });
+
+  it('should aggregate and bill usage per window with a usageWindow', () => {
+    const { template } = createBillingProvider('WindowedBillingStack', {
+      usageWindow: UsageWindow.DAILY,
+    });
+
+    template.hasResourceProperties('AWS::DynamoDB::Table', {
+      KeySchema: [
+        { AttributeName: 'tenantId', KeyType: 'HASH' },
+        { AttributeName: 'usageWindow', KeyType: 'RANGE' },
+      ],
+      TimeToLiveSpecification: { AttributeName: 'sbtaws_expires_at', Enabled: true },
+    });
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({ TIMESTAMP_PATH: 'timestamp', USAGE_WINDOW: 'DAILY' }),
+      },
+    });
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({
+          BILLING_TABLE: Match.anyValue(),
+          USAGE_WINDOW: 'DAILY',
+        }),
+      },
+    });
+  });
+
+  it('should pass sharding and scan settings to the ingestor and the PutUsage function', () => {
+    const { template } = createBillingProvider('ShardedBillingStack', {
+      shardCount: 8,
+      shardThreshold: 200,
+      scanSegments: 4,
+    });
+
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({ SHARD_COUNT: '8', SHARD_THRESHOLD: '200' }),
+      },
+    });
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({
+          BILLING_TABLE: Match.anyValue(),
+          SHARD_COUNT: '8',
+          SCAN_SEGMENTS: '4',
+        }),
+      },
+    });
+  });
+
+  it('should send onboarding and offboarding events to the customer queues', () => {
+    const stack = new cdk.Stack(new cdk.App(), 'BatchedBillingControlPlaneStack');
+    const eventManager = new EventManager(stack, 'EventManager', {
+      controlPlaneEventSource: 'test.control.plane',
+      applicationPlaneEventSource: 'test.app.plane',
+    });
+    const billing = new MockBillingProvider(stack, 'MockBilling', { customerBatchSize: 10 });
+    new ControlPlane(stack, 'ControlPlane', {
+      systemAdminEmail: 'test@example.com',
+      auth: new CognitoAuth(stack, 'CognitoAuth'),
+      eventManager: eventManager,
+      billing: billing,
+    });
+    const template = Template.fromStack(stack);
+
+    for (const [detailType, queue] of [
+      ['onboardingRequest', billing.createCustomerFunction.queue!],
+      ['offboardingRequest', billing.deleteCustomerFunction.queue!],
+    ] as [string, sqs.IQueue][]) {
+      template.hasResourceProperties('AWS::Events::Rule', {
+        EventPattern: Match.objectLike({ 'detail-type': [detailType] }),
+        Targets: Match.arrayWith([
+          Match.objectLike({ Arn: { 'Fn::GetAtt': [logicalIdOf(stack, queue), 'Arn'] } }),
+        ]),
+      });
+    }
+  });
+});
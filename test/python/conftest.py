@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import importlib.util
+import json
+import os
+import sys
+from pathlib import Path
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_aws
+
+ROOT = Path(__file__).resolve().parents[2]
+FUNCTIONS = ROOT / "resources" / "functions"
+HELPER_LAYER = ROOT / "resources" / "layers" / "helper"
+
+# every client the functions create talks to moto
+os.environ.update(
+    AWS_DEFAULT_REGION="us-east-1",
+    AWS_REGION="us-east-1",
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+    POWERTOOLS_TRACE_DISABLED="1",
+    POWERTOOLS_METRICS_NAMESPACE="test",
+)
+sys.path.insert(0, str(HELPER_LAYER))
+
+
+def load_function(function, module="index", **environment):
+    """
+    Import a module of a function, e.g. load_function("mock-billing/put-usage"),
+    with the environment it is configured with. Every function has an
+    index.py, so the module is imported under a name of its own, while its
+    directory is importable for the modules next to it.
+    """
+    directory = FUNCTIONS / function
+    if str(directory) not in sys.path:
+        sys.path.insert(0, str(directory))
+    name = f"{function.replace('/', '_').replace('-', '_')}_{module}"
+    spec = importlib.util.spec_from_file_location(name, directory / f"{module}.py")
+    loaded = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ, environment):
+        spec.loader.exec_module(loaded)
+    sys.modules[name] = loaded
+    return loaded
+
+
+@pytest.fixture
+def aws():
+    with mock_aws():
+        yield
+
+
+def create_table(name, partition_key, sort_key=None, **kwargs):
+    """Create a pay per request DynamoDB table keyed by string attributes."""
+    keys = [(partition_key, "HASH")] + ([(sort_key, "RANGE")] if sort_key else [])
+    attributes = {key for key, _ in keys}
+    for index in kwargs.get("GlobalSecondaryIndexes", []):
+        attributes.update(key["AttributeName"] for key in index["KeySchema"])
+    return boto3.resource("dynamodb").create_table(
+        TableName=name,
+        KeySchema=[{"AttributeName": key, "KeyType": key_type} for key, key_type in keys],
+        AttributeDefinitions=[
+            {"AttributeName": attribute, "AttributeType": "S"} for attribute in sorted(attributes)
+        ],
+        BillingMode="PAY_PER_REQUEST",
+        **kwargs,
+    )
+
+
+def http_request(app, method, path, body=None, headers=None, query=None):
+    """Resolve an API Gateway HTTP API request with the resolver of a function."""
+    event = {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": "",
+        "headers": headers or {},
+        "queryStringParameters": query,
+        "requestContext": {
+            "http": {"method": method, "path": path, "sourceIp": "127.0.0.1"},
+            "requestId": "request",
+            "stage": "$default",
+        },
+        "body": None if body is None else json.dumps(body),
+        "isBase64Encoded": False,
+    }
+    response = app.resolve(event, None)
+    return response["statusCode"], json.loads(response["body"]) if response.get("body") else None
+
+
+class LambdaContext:
+    function_name = "test"
+    memory_limit_in_mb = 128
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:test"
+    aws_request_id = "request"
+
+    def get_remaining_time_in_millis(self):
+        return 300_000
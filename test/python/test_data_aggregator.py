@@ -0,0 +1,144 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+from collections import Counter
+
+import boto3
+import pytest
+
+from conftest import create_table, load_function
+
+ENVIRONMENT = {
+    "SERVICE_NAME": "aggregator",
+    "DATA_TABLE": "usage",
+    "LEDGER_TABLE": "ledger",
+    "PRIMARY_KEY_COLUMN": "tenantId",
+    "PRIMARY_KEY_PATH": "tenantId",
+    "AGGREGATE_KEY_PATH": "metric.name",
+    "AGGREGATE_VALUE_PATH": "metric.value",
+    "CHECKPOINT_LINES": "4",
+    "SHARD_COUNT": "4",
+    "SHARD_THRESHOLD": "3",
+}
+data_aggregator = load_function("data-aggregator", **ENVIRONMENT)
+BUCKET = "usage-bucket"
+# 10 lines of 3 tenants, so the object takes 3 checkpoints, and t1 is
+# sharded in the checkpoints it has 3 lines of
+LINES = ["t1", "t1", "t1", "t2", "t1", "t1", "t1", "t3", "t2", "t1"]
+
+
+@pytest.fixture
+def usage_object(aws, monkeypatch):
+    for name, value in ENVIRONMENT.items():
+        monkeypatch.setenv(name, value)
+    create_table("usage", "tenantId")
+    create_table("ledger", "objectId")
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket=BUCKET)
+    body = "\n".join(
+        json.dumps({"tenantId": tenant_id, "metric": {"name": "requests", "value": 2}})
+        for tenant_id in LINES
+    )
+    s3.put_object(Bucket=BUCKET, Key="usage/1.json", Body=body.encode())
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "eventName": "ObjectCreated:Put",
+                "s3": {
+                    "bucket": {"name": BUCKET},
+                    "object": {"key": "usage/1.json", "size": len(body), "sequencer": "0001"},
+                },
+            }
+        ]
+    }
+
+
+def usage():
+    """Return the requests counted per tenant, over the tenant's item and its shards."""
+    counted = Counter()
+    for item in boto3.resource("dynamodb").Table("usage").scan()["Items"]:
+        counted[item.get("sbtaws_shard_of", item["tenantId"])] += item["requests"]
+    return counted
+
+
+def expected_usage():
+    return Counter({tenant_id: 2 * count for tenant_id, count in Counter(LINES).items()})
+
+
+def fail_transaction(monkeypatch, failing):
+    """Make transaction number failing (counting from 1) of the handler fail."""
+    write = data_aggregator.pacer.write
+    transactions = []
+
+    def failing_write(request, *args, **kwargs):
+        if request == data_aggregator.write_client.transact_write_items:
+            transactions.append(kwargs)
+            if len(transactions) == failing:
+                raise RuntimeError("lost connection")
+        return write(request, *args, **kwargs)
+
+    monkeypatch.setattr(data_aggregator.pacer, "write", failing_write)
+
+
+def test_aggregates_an_object(usage_object):
+    data_aggregator.handler(usage_object, None)
+
+    assert usage() == expected_usage()
+    items = boto3.resource("dynamodb").Table("usage").scan()["Items"]
+    assert any(item["tenantId"].startswith("t1#") for item in items)
+
+
+def test_an_object_delivered_again_is_counted_once(usage_object):
+    data_aggregator.handler(usage_object, None)
+    data_aggregator.handler(usage_object, None)
+
+    assert usage() == expected_usage()
+    ledger = boto3.resource("dynamodb").Table("ledger").scan()["Items"]
+    assert [item["status"] for item in ledger] == ["COMPLETE"]
+
+
+def test_a_retry_resumes_from_the_last_checkpoint(usage_object, monkeypatch):
+    fail_transaction(monkeypatch, 2)
+    with pytest.raises(RuntimeError):
+        data_aggregator.handler(usage_object, None)
+    monkeypatch.delattr(data_aggregator.pacer, "write")
+
+    # the first checkpoint was committed, the second was not
+    assert usage() == Counter({"t1": 6, "t2": 2})
+    data_aggregator.handler(usage_object, None)
+
+    assert usage() == expected_usage()
+
+
+def test_a_retry_skips_the_groups_of_a_checkpoint_that_were_committed(usage_object, monkeypatch):
+    # every tenant of a checkpoint is committed in a group of its own
+    monkeypatch.setattr(data_aggregator, "MAX_TRANSACTION_KEYS", 1)
+    fail_transaction(monkeypatch, 4)
+    with pytest.raises(RuntimeError):
+        data_aggregator.handler(usage_object, None)
+
+    # the failed group was the second (t3) of the second checkpoint
+    assert usage() == Counter({"t1": 12, "t2": 2})
+    ledger = boto3.resource("dynamodb").Table("ledger").scan()["Items"]
+    assert (ledger[0]["lineOffset"], ledger[0]["pendingOffset"], ledger[0]["groupsCommitted"]) == (4, 8, 1)
+
+    monkeypatch.delattr(data_aggregator.pacer, "write")
+    data_aggregator.handler(usage_object, None)
+
+    assert usage() == expected_usage()
+
+
+def test_skips_records_whose_timestamp_is_not_one(monkeypatch):
+    monkeypatch.setattr(data_aggregator, "usage_window", "DAILY")
+    monkeypatch.setattr(data_aggregator, "timestamp_path", "timestamp")
+    lines = [
+        json.dumps({"tenantId": "t1", "metric": {"name": "requests", "value": 1}, "timestamp": timestamp})
+        for timestamp in ["2025-06-10T12:00:00", 1e300, "yesterday", None, 1749513600]
+    ]
+
+    aggregates, lines_read = data_aggregator._aggregate_lines(lines)
+
+    assert lines_read == 5
+    assert aggregates.line_counts == {("t1", "2025-06-10"): 2}
@@ -0,0 +1,47 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+
+import pytest
+
+from conftest import create_table, load_function
+
+delete_customer = load_function(
+    "mock-billing/delete-customer", CUSTOMERS_TABLE="customers", TENANT_INDEX_NAME="tenantIndex"
+)
+
+
+@pytest.fixture
+def customers(aws):
+    return create_table(
+        "customers",
+        "customerId",
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "tenantIndex",
+                "KeySchema": [{"AttributeName": "tenantId", "KeyType": "HASH"}],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+    )
+
+
+def message(message_id, body):
+    return {"messageId": message_id, "body": body, "eventSource": "aws:sqs"}
+
+
+def test_deletes_the_customers_of_a_batch_of_tenants(customers):
+    for index in range(30):
+        customers.put_item(Item={"customerId": f"c{index}", "tenantId": f"t{index % 15}"})
+    records = [
+        message(f"m{index}", json.dumps({"detail": {"tenantId": f"t{index}"}})) for index in range(12)
+    ]
+
+    response = delete_customer.delete_customers(
+        delete_customer.SQSEvent({"Records": records + [message("invalid", "{}")]})
+    )
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "invalid"}]}
+    remaining = {item["tenantId"] for item in customers.scan()["Items"]}
+    assert remaining == {"t12", "t13", "t14"}
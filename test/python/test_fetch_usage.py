@@ -0,0 +1,68 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import create_table, http_request, load_function
+
+fetch_usage = load_function("mock-billing/fetch-usage", BILLING_TABLE="billing")
+windowed_fetch_usage = load_function("mock-billing/fetch-usage", BILLING_TABLE="billing", USAGE_WINDOW="DAILY")
+
+
+def epoch(*date):
+    return str(int(datetime(*date, tzinfo=timezone.utc).timestamp()))
+
+
+@pytest.fixture
+def billing(aws):
+    return create_table("billing", "tenantId", "billingPeriod")
+
+
+def put_records(billing, billing_periods):
+    for billing_period in billing_periods:
+        billing.put_item(Item={"tenantId": "t1", "billingPeriod": billing_period})
+
+
+def fetch(module, **query):
+    status, body = http_request(module.app, "GET", "/billing/usage/t1", query=query)
+    return status, body and [record["billingPeriod"] for record in body.get("data", [])]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ({"from": "2025-06", "to": "2025-06"}, [epoch(2025, 6, 1), epoch(2025, 6, 30, 23)]),
+        ({"from": "2025-06-30", "to": "2025"}, [epoch(2025, 6, 30, 23), epoch(2025, 7, 1)]),
+        ({"to": "2025-05"}, [epoch(2025, 5, 31)]),
+        ({"from": epoch(2025, 6, 1), "to": epoch(2025, 6, 30, 23)}, [epoch(2025, 6, 1), epoch(2025, 6, 30, 23)]),
+        ({"from": "0", "to": "5"}, []),
+        ({"rollup": "MONTHLY", "from": "2025-06-10"}, ["2025-06"]),
+    ],
+)
+def test_fetches_records_named_by_epoch_seconds(billing, query, expected):
+    runs = [epoch(2025, 5, 31), epoch(2025, 6, 1), epoch(2025, 6, 30, 23), epoch(2025, 7, 1)]
+    put_records(billing, runs + ["MONTHLY#2025-05", "MONTHLY#2025-06"])
+
+    assert fetch(fetch_usage, **query) == (200, expected)
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ({"from": "2025-06", "to": "2025-06"}, ["2025-06-01", "2025-06-30"]),
+        ({"from": "2025-06-30T12", "to": "2025-07-01T00"}, ["2025-06-30", "2025-07-01"]),
+        ({"from": epoch(2025, 6, 30, 12)}, ["2025-06-30", "2025-07-01"]),
+    ],
+)
+def test_fetches_records_named_by_window(billing, query, expected):
+    put_records(billing, ["2025-05-31", "2025-06-01", "2025-06-30", "2025-07-01"])
+
+    assert fetch(windowed_fetch_usage, **query) == (200, expected)
+
+
+@pytest.mark.parametrize("value", ["2025-13", "June", "2025-06-1", "-1", "2025-06-10 12"])
+def test_rejects_invalid_periods(billing, value):
+    assert fetch(fetch_usage, **{"from": value})[0] == 400
+    assert fetch(windowed_fetch_usage, to=value)[0] == 400
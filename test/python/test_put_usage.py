@@ -0,0 +1,156 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+from botocore.exceptions import ClientError
+
+from conftest import LambdaContext, create_table, load_function
+
+ENVIRONMENT = {"DATA_REPOSITORY": "usage", "BILLING_TABLE": "billing", "SHARD_COUNT": "4"}
+put_usage = load_function("mock-billing/put-usage", **ENVIRONMENT)
+windowed_put_usage = load_function("mock-billing/put-usage", **ENVIRONMENT, USAGE_WINDOW="DAILY")
+# 2025-06-10 and 2025-06-20, both in June 2025
+RUN = str(int(datetime(2025, 6, 10, tzinfo=timezone.utc).timestamp()))
+NEXT_RUN = str(int(datetime(2025, 6, 20, tzinfo=timezone.utc).timestamp()))
+
+
+@pytest.fixture
+def billing(aws):
+    return create_table("billing", "tenantId", "billingPeriod")
+
+
+@pytest.fixture
+def usage(billing):
+    return create_table("usage", "tenantId")
+
+
+@pytest.fixture
+def windowed_usage(billing):
+    return create_table(
+        "usage",
+        "tenantId",
+        "usageWindow",
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "UsageWindowIndex",
+                "KeySchema": [
+                    {"AttributeName": "usageWindow", "KeyType": "HASH"},
+                    {"AttributeName": "tenantId", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+    )
+
+
+def put_sharded_usage(usage, requests, shard_requests):
+    usage.put_item(Item={"tenantId": "t1", "requests": Decimal(requests), "size_max": Decimal(7)})
+    for shard, requests in shard_requests.items():
+        usage.put_item(
+            Item={"tenantId": f"t1#{shard}", "sbtaws_shard_of": "t1", "requests": Decimal(requests)}
+        )
+
+
+def record(billing, billing_period):
+    return billing.get_item(Key={"tenantId": "t1", "billingPeriod": billing_period}).get("Item")
+
+
+def test_bills_a_tenant_with_its_shards(usage, billing):
+    put_sharded_usage(usage, 5, {0: 3, 2: 2})
+
+    response = put_usage.handler({"runId": RUN}, LambdaContext())
+
+    assert response["statusCode"] == 200
+    assert record(billing, RUN) == {
+        "tenantId": "t1",
+        "billingPeriod": RUN,
+        "requests": Decimal(10),
+        "size_max": Decimal(7),
+    }
+    # the usage that was billed is gone
+    assert usage.scan()["Items"] == []
+
+
+def test_adds_billing_records_up_into_rollups(usage, billing):
+    put_sharded_usage(usage, 5, {1: 5})
+    put_usage.handler({"runId": RUN}, LambdaContext())
+    put_sharded_usage(usage, 1, {3: 2})
+    put_usage.handler({"runId": NEXT_RUN}, LambdaContext())
+
+    assert record(billing, NEXT_RUN)["requests"] == 3
+    # minimums and maximums cannot be added up
+    assert record(billing, "MONTHLY#2025-06") == {
+        "tenantId": "t1",
+        "billingPeriod": "MONTHLY#2025-06",
+        "requests": Decimal(13),
+    }
+    assert record(billing, "YEARLY#2025")["requests"] == 13
+
+
+def test_billing_a_window_again_adds_only_the_difference_to_rollups(windowed_usage, billing):
+    window = "2025-06-10"
+    windowed_usage.put_item(Item={"tenantId": "t1", "usageWindow": window, "requests": Decimal(5)})
+    windowed_usage.put_item(
+        Item={"tenantId": "t1#0", "usageWindow": window, "sbtaws_shard_of": "t1", "requests": Decimal(3)}
+    )
+    windowed_put_usage.bill_window(window)
+    # a record that arrived late
+    windowed_usage.put_item(
+        Item={"tenantId": "t1#1", "usageWindow": window, "sbtaws_shard_of": "t1", "requests": Decimal(4)}
+    )
+    windowed_put_usage.bill_window(window)
+
+    assert record(billing, window)["requests"] == 12
+    assert record(billing, "MONTHLY#2025-06")["requests"] == 12
+    # windowed usage is left in place
+    assert len(windowed_usage.scan()["Items"]) == 3
+
+
+def client_error(operation):
+    return ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, operation)
+
+
+def test_retries_failed_scans(usage, billing, monkeypatch):
+    put_sharded_usage(usage, 5, {})
+    scan = put_usage.data_repository.scan
+    failures = iter(range(put_usage.MAX_SCAN_ATTEMPTS - 1))
+
+    def failing_scan(**kwargs):
+        if next(failures, None) is not None:
+            raise client_error("Scan")
+        return scan(**kwargs)
+
+    monkeypatch.setattr(put_usage.data_repository, "scan", failing_scan)
+    monkeypatch.setattr(put_usage.time, "sleep", lambda seconds: None)
+
+    put_usage.handler({"runId": RUN}, LambdaContext())
+
+    assert record(billing, RUN)["requests"] == 5
+
+
+def test_a_failed_batch_does_not_stop_the_segment(usage, billing, monkeypatch):
+    usage.put_item(Item={"tenantId": "t1", "requests": Decimal(5)})
+    usage.put_item(Item={"tenantId": "t2", "requests": Decimal(3)})
+    # every tenant is billed in a batch of its own, the first one fails
+    monkeypatch.setattr(put_usage, "MAX_TRANSACTION_ITEMS", 4)
+    close_usage = put_usage.close_usage
+    calls = []
+
+    def failing_close_usage(batch, current_period):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise client_error("TransactWriteItems")
+        return close_usage(batch, current_period)
+
+    monkeypatch.setattr(put_usage, "close_usage", failing_close_usage)
+
+    response = put_usage.handler({"runId": RUN}, LambdaContext())
+
+    assert response["statusCode"] == 200
+    failed, billed = (batch[0][0] for batch in calls)
+    assert billing.get_item(Key={"tenantId": billed, "billingPeriod": RUN})["Item"]
+    # the usage of the failed batch is billed in the next run
+    assert [item["tenantId"] for item in usage.scan()["Items"]] == [failed]
@@ -0,0 +1,218 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import base64
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+
+from conftest import LambdaContext, create_table, http_request, load_function
+
+tenant_management = load_function(
+    "tenant-management",
+    TENANT_DETAILS_TABLE="tenants",
+    ACTIVE_TENANTS_INDEX_NAME="activeTenantsIndex",
+    TENANT_STATS_TABLE="tenant-stats",
+)
+backfill = load_function("tenant-management", "backfill", TENANT_DETAILS_TABLE="tenants")
+
+
+@pytest.fixture
+def tenants(aws):
+    table = create_table(
+        "tenants",
+        "tenantId",
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "activeTenantsIndex",
+                "KeySchema": [
+                    {"AttributeName": "sbtaws_active_listing", "KeyType": "HASH"},
+                    {"AttributeName": "tenantId", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            },
+            {
+                "IndexName": "tenantChangesIndex",
+                "KeySchema": [
+                    {"AttributeName": "sbtaws_change_feed", "KeyType": "HASH"},
+                    {"AttributeName": "updatedAt", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            },
+        ],
+    )
+    create_table("tenant-stats", "statsId")
+    return table
+
+
+def create_tenant(tenant):
+    status, body = http_request(tenant_management.app, "POST", "/tenants", tenant)
+    assert status == 201
+    return body["data"]["tenantId"]
+
+
+def update_tenant(tenantId, tenant):
+    return http_request(tenant_management.app, "PUT", f"/tenants/{tenantId}", tenant)
+
+
+def test_updates_map_keys_with_dots(tenants):
+    tenantId = create_tenant(
+        {"tenantConfig": {"example.com": {"plan": "a"}, "example": {"com": {"plan": "a"}}}}
+    )
+
+    status, body = update_tenant(
+        tenantId, {"tenantConfig": {"example.com": {"plan": "b"}, "example": {"com": {"plan": "a"}}}}
+    )
+
+    assert status == 200
+    assert body["data"]["tenantConfig"] == {"example.com": {"plan": "b"}, "example": {"com": {"plan": "a"}}}
+    assert body["data"]["sbtaws_version"] == 2
+
+
+def test_updates_nested_maps_and_removes_their_old_attributes(tenants):
+    tenantId = create_tenant({"tenantConfig": {"plan": "a", "limits": {"users": 5}, "beta": True}})
+
+    status, _ = update_tenant(tenantId, {"tenantConfig": {"plan": "a", "limits": {"users": 10}}})
+
+    assert status == 200
+    item = tenants.get_item(Key={"tenantId": tenantId})["Item"]
+    assert item["tenantConfig"] == {"plan": "a", "limits": {"users": Decimal(10)}}
+
+
+def test_dotted_keys_update_an_attribute_of_a_map(tenants):
+    tenantId = create_tenant({"tenantConfig": {"plan": "a"}})
+
+    status, body = update_tenant(tenantId, {"tenantConfig.plan": "b"})
+
+    assert status == 200
+    assert body["data"]["tenantConfig"] == {"plan": "b"}
+
+
+def test_rejects_dotted_keys_of_maps_that_do_not_exist(tenants):
+    tenantId = create_tenant({})
+
+    status, _ = update_tenant(tenantId, {"tenantConfig.plan": "b"})
+
+    assert status == 400
+
+
+@pytest.fixture
+def change_feed(tenants, monkeypatch):
+    monkeypatch.setattr(tenant_management, "tenant_changes_index_name", "tenantChangesIndex")
+    monkeypatch.setattr(tenant_management, "CHANGE_FEED_SETTLE_TIME", timedelta(0))
+
+
+def get_changes(since=None, limit=100):
+    query = {"limit": str(limit)} | ({"since": since} if since else {})
+    return http_request(tenant_management.app, "GET", "/tenants/changes", query=query)
+
+
+def test_reads_changes_after_the_cursor(change_feed):
+    tenantIds = [create_tenant({"tenantName": f"tenant{index}"}) for index in range(3)]
+
+    status, first = get_changes(limit=2)
+    assert status == 200
+    status, rest = get_changes(first["cursor"])
+
+    assert status == 200
+    assert sorted(tenant["tenantId"] for tenant in first["data"] + rest["data"]) == sorted(tenantIds)
+    assert not rest["has_more"]
+
+
+@pytest.mark.parametrize(
+    "position",
+    [
+        {},
+        {"tenantId": "t1", "sbtaws_change_feed": "TENANTS#0"},
+        {"tenantId": 1, "sbtaws_change_feed": "TENANTS#0", "updatedAt": "2025-06-10T00:00:00+00:00"},
+        {"tenantId": "t1", "sbtaws_change_feed": "TENANTS#1", "updatedAt": "2025-06-10T00:00:00+00:00"},
+        {"tenantId": "t1", "sbtaws_change_feed": "TENANTS#0", "updatedAt": "x", "tier": "basic"},
+        "t1",
+    ],
+)
+def test_rejects_invalid_cursor_positions(change_feed, position):
+    since = base64.urlsafe_b64encode(json.dumps({"TENANTS#0": position}).encode()).decode()
+
+    status, _ = get_changes(since)
+
+    assert status == 400
+
+
+def get_tenants(**query):
+    return http_request(tenant_management.app, "GET", "/tenants", query=query)
+
+
+def get_all_active_tenants(**query):
+    tenantIds = []
+    next_token = None
+    while True:
+        page_query = query | ({"next_token": next_token} if next_token else {})
+        status, body = get_tenants(active="true", **page_query)
+        assert status == 200
+        page = [tenant["tenantId"] for tenant in body["data"]]
+        assert page == sorted(page)
+        tenantIds += page
+        next_token = body.get("next_token")
+        if not next_token:
+            return tenantIds
+
+
+def test_pages_through_the_shards_of_the_active_tenants(tenants):
+    tenantIds = [create_tenant({"tier": "basic" if index % 3 else "premium"}) for index in range(20)]
+    for tenantId in tenantIds[:4]:
+        assert http_request(tenant_management.app, "DELETE", f"/tenants/{tenantId}")[0] == 200
+
+    listed = get_all_active_tenants(limit="3")
+
+    assert sorted(listed) == sorted(tenantIds[4:])
+    shards = {tenants.get_item(Key={"tenantId": tenantId})["Item"]["sbtaws_active_listing"] for tenantId in listed}
+    assert len(shards) > 1
+
+
+def test_filters_active_tenants(tenants):
+    tenantIds = [create_tenant({"tier": "basic" if index % 3 else "premium"}) for index in range(12)]
+
+    listed = get_all_active_tenants(limit="2", tier="premium")
+
+    assert sorted(listed) == sorted(tenantIds[::3])
+
+
+@pytest.mark.parametrize(
+    "positions",
+    [
+        {"ACTIVE": None},
+        {"ACTIVE#0": {"tenantId": "t1", "sbtaws_active_listing": "ACTIVE#1"}},
+        {"ACTIVE#0": {"tenantId": 1, "sbtaws_active_listing": "ACTIVE#0"}},
+        {"ACTIVE#0": {}},
+        [],
+    ],
+)
+def test_rejects_invalid_active_tenant_tokens(tenants, positions):
+    next_token = base64.urlsafe_b64encode(json.dumps(positions).encode()).decode()
+
+    status, _ = get_tenants(active="true", next_token=next_token)
+
+    assert status == 400
+
+
+def test_backfill_lists_tenants_in_their_shard(tenants):
+    tenants.put_item(Item={"tenantId": "t1", "sbtaws_active": True})
+    tenants.put_item(Item={"tenantId": "t2", "sbtaws_active": True, "sbtaws_active_listing": "ACTIVE"})
+    tenants.put_item(Item={"tenantId": "t3", "sbtaws_active": False})
+    listed_tenant = create_tenant({})
+
+    assert backfill.handler({}, LambdaContext()) == {"listed": 2}
+
+    assert sorted(get_all_active_tenants()) == sorted(["t1", "t2", listed_tenant])
+    assert "sbtaws_active_listing" not in tenants.get_item(Key={"tenantId": "t3"})["Item"]
+
+
+def test_updates_move_tenants_to_their_shard(tenants):
+    tenants.put_item(Item={"tenantId": "t1", "sbtaws_active": True, "sbtaws_active_listing": "ACTIVE"})
+
+    status, _ = update_tenant("t1", {"tier": "basic"})
+
+    assert status == 200
+    assert get_all_active_tenants() == ["t1"]
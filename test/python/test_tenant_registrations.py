@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from decimal import Decimal
+
+import pytest
+
+from conftest import create_table, http_request, load_function
+
+# the signed client of the tenant API needs aws-requests-auth
+pytest.importorskip("aws_requests_auth")
+
+tenant_registrations = load_function(
+    "tenant-registrations",
+    TENANT_REGISTRATION_TABLE_NAME="tenant-registrations",
+    EVENTBUS_NAME="events",
+    EVENT_SOURCE="test.control.plane",
+    ONBOARDING_DETAIL_TYPE="onboardingRequest",
+    OFFBOARDING_DETAIL_TYPE="offboardingRequest",
+    TENANT_API_URL="https://tenants.example.com/",
+)
+
+
+@pytest.fixture
+def registrations(aws):
+    return create_table("tenant-registrations", "tenantRegistrationId")
+
+
+def update_registration(registrations, current, tenant_registration_data):
+    registrations.put_item(Item={"tenantRegistrationId": "r1", "tenantId": "t1", **current})
+    status, body = http_request(
+        tenant_registrations.app,
+        "PATCH",
+        "/tenant-registrations/r1",
+        {"tenantRegistrationData": tenant_registration_data},
+    )
+    assert status == 200
+    return registrations.get_item(Key={"tenantRegistrationId": "r1"})["Item"]
+
+
+def test_updates_map_keys_with_dots(registrations):
+    value = {"example.com": {"plan": "b"}, "example": {"com": {"plan": "a"}}}
+
+    item = update_registration(
+        registrations,
+        {"config": {"example.com": {"plan": "a"}, "example": {"com": {"plan": "a"}}}},
+        {"config": value},
+    )
+
+    assert item["config"] == value
+
+
+def test_updates_nested_maps(registrations):
+    item = update_registration(
+        registrations,
+        {"config": {"limits": {"users": Decimal(5)}}},
+        {"config.limits.users": 10},
+    )
+
+    assert item["config"] == {"limits": {"users": Decimal(10)}}
+
+
+def test_deactivates_with_only_the_changed_attributes():
+    update = tenant_registrations.build_update(
+        {"sbtaws_active": False},
+        current={"tenantRegistrationId": "r1", "sbtaws_active": True, "config": {"a.b": 1}},
+    )
+
+    assert update["UpdateExpression"] == "SET #upd0 = :upd0"
+    assert update["ExpressionAttributeNames"] == {"#upd0": "sbtaws_active"}
@@ -0,0 +1,123 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from decimal import Decimal
+
+import pytest
+
+from conftest import create_table
+from update_expression import build_update
+
+
+def apply(table, key, update):
+    return table.update_item(Key=key, ReturnValues="ALL_NEW", **update)["Attributes"]
+
+
+@pytest.fixture
+def table(aws):
+    return create_table("items", "id")
+
+
+def test_sets_removes_and_adds():
+    update = build_update({"tier": "gold", "tenantConfig.plan": "a"}, remove=["old"], add={"version": 1})
+
+    names = update["ExpressionAttributeNames"]
+    assert update["UpdateExpression"] == (
+        "SET #upd0 = :upd0, #upd1.#upd2 = :upd1 REMOVE #upd3 ADD #upd4 :upd2"
+    )
+    assert [names[f"#upd{index}"] for index in range(5)] == [
+        "tier",
+        "tenantConfig",
+        "plan",
+        "old",
+        "version",
+    ]
+    assert update["ExpressionAttributeValues"] == {":upd0": "gold", ":upd1": "a", ":upd2": 1}
+
+
+def test_nothing_to_update():
+    assert build_update({}) is None
+    assert build_update({"tier": "gold"}, remove=["old"], current={"tier": "gold"}) is None
+
+
+def test_skips_unchanged_values():
+    update = build_update({"tier": "gold", "name": "acme"}, current={"tier": "gold", "name": "old"})
+
+    assert update["UpdateExpression"] == "SET #upd0 = :upd0"
+    assert update["ExpressionAttributeNames"] == {"#upd0": "name"}
+
+
+def test_tuple_paths_keep_dotted_names():
+    update = build_update({("tenantConfig", "example.com"): 1})
+
+    assert update["UpdateExpression"] == "SET #upd0.#upd1 = :upd0"
+    assert update["ExpressionAttributeNames"] == {"#upd0": "tenantConfig", "#upd1": "example.com"}
+
+
+def test_nested_changes(table):
+    key = {"id": "t1"}
+    current = {
+        **key,
+        "tenantConfig": {"plan": "a", "limits": {"users": Decimal(5), "seats": Decimal(2)}},
+    }
+    table.put_item(Item=current)
+    value = {"plan": "a", "limits": {"users": Decimal(10), "seats": Decimal(2)}}
+
+    update = build_update({"tenantConfig": value}, current=current)
+
+    assert update["UpdateExpression"] == "SET #upd0.#upd1.#upd2 = :upd0"
+    assert apply(table, key, update)["tenantConfig"] == value
+
+
+def test_removes_map_attributes_that_are_gone(table):
+    key = {"id": "t1"}
+    current = {**key, "tenantConfig": {"plan": "a", "limits": {"users": Decimal(5)}, "beta": True}}
+    table.put_item(Item=current)
+    value = {"plan": "b", "limits": {}}
+
+    update = build_update({"tenantConfig": value}, current=current)
+
+    assert apply(table, key, update)["tenantConfig"] == value
+
+
+def test_map_keys_with_dots_change_only_their_own_attribute(table):
+    key = {"id": "t1"}
+    current = {
+        **key,
+        "tenantConfig": {"example.com": {"plan": "a"}, "example": {"com": {"plan": "a"}}},
+    }
+    table.put_item(Item=current)
+    value = {"example.com": {"plan": "b"}, "example": {"com": {"plan": "a"}}}
+
+    update = build_update({"tenantConfig": value}, current=current)
+
+    assert apply(table, key, update)["tenantConfig"] == value
+
+
+def test_map_keys_with_dots_can_be_removed(table):
+    key = {"id": "t1"}
+    current = {**key, "tenantConfig": {"example.com": Decimal(1)}}
+    table.put_item(Item=current)
+
+    update = build_update({"tenantConfig": {"other": Decimal(2)}}, current=current)
+
+    assert apply(table, key, update)["tenantConfig"] == {"other": Decimal(2)}
+
+
+def test_replaces_values_that_are_not_maps(table):
+    key = {"id": "t1"}
+    current = {**key, "tenantConfig": "none"}
+    table.put_item(Item=current)
+    value = {"example.com": {"plan": "a"}}
+
+    update = build_update({"tenantConfig": value}, current=current)
+
+    assert update["UpdateExpression"] == "SET #upd0 = :upd0"
+    assert apply(table, key, update)["tenantConfig"] == value
+
+
+def test_only_removes_attributes_the_item_has():
+    update = build_update({"tier": "gold"}, remove=["listing", "gone"], current={"listing": "x"})
+
+    assert update["UpdateExpression"] == "SET #upd0 = :upd0 REMOVE #upd1"
+    assert update["ExpressionAttributeNames"] == {"#upd0": "tier", "#upd1": "listing"}
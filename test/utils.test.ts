@@ -12,7 +12,12 @@
  */
 
 import { App, Stack } from 'aws-cdk-lib';
-import { addTemplateTag } from '../src/utils';
+import { Template } from 'aws-cdk-lib/assertions';
+import * as events from 'aws-cdk-lib/aws-events';
+import * as targets from 'aws-cdk-lib/aws-events-targets';
+import * as lambda from 'aws-cdk-lib/aws-lambda';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import { addTemplateTag, createAsyncFunctionTarget } from '../src/utils';
 const app = new App();
 const telemetryConst = 'sbt-aws (uksb-1tupboc57)';
 
@@ -51,3 +56,57 @@ describe('addTemplateTag', () => {
     expect(stackD.templateOptions.description).toBe(expectedDescription);
   });
 });
+
+describe('createAsyncFunctionTarget', () => {
+  const createHandler = (stack: Stack) =>
+    new lambda.Function(stack, 'Handler', {
+      runtime: lambda.Runtime.PYTHON_3_13,
+      handler: 'index.handler',
+      code: lambda.Code.fromInline('def handler(event, context): pass'),
+    });
+
+  it('should target the queue when the function has one', () => {
+    const stack = new Stack(app, 'TestStackQueueTarget');
+    const handler = createHandler(stack);
+    const queue = new sqs.Queue(stack, 'Queue');
+    const target = createAsyncFunctionTarget({ handler, queue });
+    expect(target).toBeInstanceOf(targets.SqsQueue);
+
+    new events.Rule(stack, 'Rule', {
+      eventPattern: { source: ['test'] },
+      targets: [target],
+    });
+    const template = Template.fromStack(stack);
+    template.hasResourceProperties('AWS::Events::Rule', {
+      Targets: [
+        {
+          Arn: { 'Fn::GetAtt': [stack.getLogicalId(queue.node.defaultChild as sqs.CfnQueue), 'Arn'] },
+        },
+      ],
+    });
+    template.resourceCountIs('AWS::Lambda::Permission', 0);
+  });
+
+  it('should target the function when it has no queue', () => {
+    const stack = new Stack(app, 'TestStackFunctionTarget');
+    const handler = createHandler(stack);
+    const target = createAsyncFunctionTarget({ handler });
+    expect(target).toBeInstanceOf(targets.LambdaFunction);
+
+    new events.Rule(stack, 'Rule', {
+      eventPattern: { source: ['test'] },
+      targets: [target],
+    });
+    const template = Template.fromStack(stack);
+    template.hasResourceProperties('AWS::Events::Rule', {
+      Targets: [
+        {
+          Arn: {
+            'Fn::GetAtt': [stack.getLogicalId(handler.node.defaultChild as lambda.CfnFunction), 'Arn'],
+          },
+        },
+      ],
+    });
+    template.resourceCountIs('AWS::SQS::Queue', 0);
+  });
+});